@@ -0,0 +1,160 @@
+"""All tile images packed into one sheet, cached on disk between runs.
+
+Images are packed at their own size in shelves (rows of images side by
+side), with an index file recording each image's rect on the sheet and the
+mtime, size and SHA-1 of every source PNG. On startup only the sources are stat'ed: the cached sheet is
+decoded in one go unless a source changed, and a source is only hashed when
+its mtime or size differ, so touching a file doesn't rebuild the sheet.
+
+Tile images are subsurfaces of the sheet, so they are the source images
+pixel for pixel and scale exactly as the files themselves would.
+"""
+import hashlib
+import json
+import os
+import pygame
+from settings import *
+
+ATLAS_VERSION = 2  # Bumped when the sheet layout or index format changes
+
+def atlas_paths(sources):
+    """Return the cached sheet and index files of a list of tile image paths"""
+    # Named after the sources, so each tiles folder (and each set of tiles) has its own atlas
+    name = hashlib.sha1("\n".join(os.path.abspath(path) for path in sources).encode("utf-8")).hexdigest()
+    return os.path.join(ATLAS_CACHE_DIR, name + ".png"), os.path.join(ATLAS_CACHE_DIR, name + ".json")
+
+def source_state(path, known=None):
+    """Return the mtime, size and SHA-1 of a tile image, or None if it doesn't exist.
+
+    The file is only read and hashed if its mtime or size differ from known.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if known is not None and known["mtime_ns"] == stat.st_mtime_ns and known["size"] == stat.st_size:
+        return known
+    with open(path, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "sha1": digest}
+
+def same_images(states, known_states):
+    """Whether the tile images are the same as when the atlas was built, judging by their hashes"""
+    for path, state in states.items():
+        known = known_states.get(path)
+        if (state is None) != (known is None):
+            return False
+        if state is not None and state["sha1"] != known["sha1"]:
+            return False
+    return True
+
+class TileAtlas:
+    """A sheet of tile images, each at its own size in its own rect"""
+
+    def __init__(self, sheet, rects):
+        self.sheet = sheet
+        self.rects = rects  # Image path -> (x, y, width, height) of the image on the sheet
+
+    def image(self, path):
+        """Return a tile image as a subsurface of the sheet, or None if it has no image"""
+        rect = self.rects.get(path)
+        if rect is None:
+            return None
+        return self.sheet.subsurface(rect)
+
+def pack_shelves(sizes):
+    """Place rectangles of the given (width, height) sizes in shelves.
+
+    Returns ((sheet width, sheet height), positions), where positions lists
+    the (x, y) of each rectangle in the order given. Tallest rectangles go
+    first, and shelves are about as wide as the sheet is tall.
+    """
+    if not sizes:
+        return (1, 1), []
+    area = sum(width * height for width, height in sizes)
+    shelf_width = max(max(width for width, _ in sizes), int(area ** 0.5))
+
+    positions = [None] * len(sizes)
+    x = y = shelf_height = sheet_width = 0
+    for i in sorted(range(len(sizes)), key=lambda i: -sizes[i][1]):
+        width, height = sizes[i]
+        if x + width > shelf_width:
+            # Start a new shelf under the last one
+            y += shelf_height
+            x = shelf_height = 0
+        positions[i] = (x, y)
+        x += width
+        shelf_height = max(shelf_height, height)
+        sheet_width = max(sheet_width, x)
+    return (sheet_width, y + shelf_height), positions
+
+def build_sheet(sources):
+    """Pack the tile images that exist into a new sheet, returning (sheet, rects)"""
+    images = {}
+    for path in sources:
+        if os.path.exists(path):
+            images[path] = pygame.image.load(path)
+
+    sheet_size, positions = pack_shelves([image.get_size() for image in images.values()])
+    sheet = pygame.Surface(sheet_size, pygame.SRCALPHA)
+    rects = {}
+    for (path, image), position in zip(images.items(), positions):
+        # Copied as is, alpha included, so the subsurface is the file's image
+        sheet.blit(image, position, special_flags=pygame.BLEND_RGBA_MAX)
+        rects[path] = (*position, *image.get_size())
+    return sheet, rects
+
+def save_atlas(sheet_path, index_path, sheet, index):
+    """Store the sheet, unless it is None, and its index, replacing each file only once it is complete"""
+    os.makedirs(os.path.dirname(sheet_path), exist_ok=True)
+    if sheet is not None:
+        temp_sheet = sheet_path + ".new.png"
+        pygame.image.save(sheet, temp_sheet)
+        os.replace(temp_sheet, sheet_path)
+    # The index goes last, so it never describes a sheet that wasn't written
+    temp_index = index_path + ".new"
+    with open(temp_index, 'w') as f:
+        json.dump(index, f)
+    os.replace(temp_index, index_path)
+
+def load_atlas(sources):
+    """Return the atlas of the tile images at the given paths, from the disk cache if none changed"""
+    sheet_path, index_path = atlas_paths(sources)
+    try:
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+        if index.get("version") != ATLAS_VERSION or sorted(index["sources"]) != sorted(sources):
+            index = None
+    except (OSError, ValueError, KeyError):
+        index = None
+
+    known_states = index["sources"] if index is not None else {}
+    states = {path: source_state(path, known_states.get(path)) for path in sources}
+
+    sheet = None
+    rebuilt = False
+    if index is not None and same_images(states, known_states):
+        try:
+            sheet = pygame.image.load(sheet_path)
+            rects = {path: tuple(rect) for path, rect in index["rects"].items()}
+        except (OSError, pygame.error, KeyError):
+            sheet = None  # Unreadable, so built again below
+
+    if sheet is None:
+        sheet, rects = build_sheet(sources)
+        rebuilt = True
+
+    # Store a new sheet, or just the new mtimes of sources that were touched but not changed
+    if rebuilt or states != known_states:
+        index = {"version": ATLAS_VERSION, "sources": states,
+                 "rects": {path: list(rect) for path, rect in rects.items()}}
+        try:
+            save_atlas(sheet_path, index_path, sheet if rebuilt else None, index)
+        except (OSError, pygame.error):
+            pass  # The cache only speeds up the next start
+
+    # Converting to the window's pixel format makes blits faster, but needs the window -
+    # tools that run without one keep the sheet as loaded
+    if pygame.display.get_surface() is not None:
+        sheet = sheet.convert_alpha()
+    return TileAtlas(sheet, rects)
@@ -0,0 +1,494 @@
+"""In-app file browser for saving and loading maps, drawn over the grid area.
+
+Directory listings are cached and only rescanned when the directory's mtime
+changes, which saving a map always does since saves end with a rename. Map
+thumbnails are rendered on a background thread and cached on disk under the
+map's path, size and mtime, so a map is only rendered again after it changes.
+"""
+import hashlib
+import json
+import math
+import os
+import queue
+import threading
+from collections import namedtuple
+import numpy as np
+import pygame
+from settings import *
+from chunks import GridStore
+from fonts import get_font, render_text
+import json_format
+import map_format
+
+MAP_EXTENSIONS = (".dungeonb", ".dungeon")
+
+# Posted by the thumbnail thread to wake up the main loop when a thumbnail is ready
+THUMBNAIL_READY = pygame.USEREVENT + 1
+
+# A directory or map file in a listing
+Entry = namedtuple("Entry", "name path is_dir size mtime_ns")
+
+def is_map_file(name):
+    return name.lower().endswith(MAP_EXTENSIONS)
+
+class DirectoryCache:
+    """Directory listings of subdirectories and map files, rescanned only when a directory's mtime changes"""
+
+    def __init__(self):
+        self.listings = {}  # directory path -> (mtime in ns, list of Entry)
+
+    def list(self, directory):
+        mtime_ns = os.stat(directory).st_mtime_ns
+        cached = self.listings.get(directory)
+        if cached is not None and cached[0] == mtime_ns:
+            return cached[1]
+
+        entries = []
+        with os.scandir(directory) as scan:
+            for item in scan:
+                if item.name.startswith("."):
+                    continue  # Hidden files
+                try:
+                    if item.is_dir():
+                        entries.append(Entry(item.name, item.path, True, 0, 0))
+                    elif is_map_file(item.name):
+                        stat = item.stat()
+                        entries.append(Entry(item.name, item.path, False, stat.st_size, stat.st_mtime_ns))
+                except OSError:
+                    continue  # Removed while scanning, or unreadable
+
+        # Directories first, then maps, by name
+        entries.sort(key=lambda entry: (not entry.is_dir, entry.name.lower()))
+        self.listings[directory] = (mtime_ns, entries)
+        return entries
+
+def render_thumbnail(path, color_table, size):
+    """Return a (size, size, 3) uint8 colour array [x, y] giving an overview of a map file.
+
+    Each pixel covers a power-of-two square of cells and shows the highest
+    tile id in it, so thin walls survive the downscaling.
+    """
+    store = GridStore(CHUNK_SIZE)
+    try:
+        if map_format.is_binary_map(path):
+            map_file = map_format.MapFile(path)
+            if map_file.chunk_size == CHUNK_SIZE:
+                store.add_lazy_chunks(map_file)
+            else:
+                for chunk_x, chunk_y in map_file.directory:
+                    store.write_region(chunk_x * map_file.chunk_size, chunk_y * map_file.chunk_size,
+                                       map_file.read_chunk((chunk_x, chunk_y)))
+                map_file.close()
+        else:
+            with open(path, 'r') as f:
+                json_format.read_map(f, store.write_cells)
+
+        pixels = np.zeros((size, size, 3), dtype=np.uint8)
+        keys = store.chunk_keys()
+        if not keys:
+            return pixels
+
+        # Cells per pixel, a power of two so pixels line up with chunk edges
+        min_cx = min(key[0] for key in keys)
+        min_cy = min(key[1] for key in keys)
+        span_x = max(key[0] for key in keys) - min_cx + 1
+        span_y = max(key[1] for key in keys) - min_cy + 1
+        step = 1 << max(0, math.ceil(math.log2(max(span_x, span_y) * CHUNK_SIZE / size)))
+
+        ids = np.zeros((size, size), dtype=np.int8)  # [y, x]
+        for key in keys:
+            chunk = store.chunk_array(key)
+            if step <= CHUNK_SIZE:
+                # Several pixels per chunk - the highest id in each step x step block
+                blocks = CHUNK_SIZE // step
+                block_ids = chunk.reshape(blocks, step, blocks, step).max(axis=(1, 3))
+                y0 = (key[1] - min_cy) * blocks
+                x0 = (key[0] - min_cx) * blocks
+                ids[y0:y0 + blocks, x0:x0 + blocks] = block_ids
+            else:
+                # Several chunks per pixel
+                chunks_per_pixel = step // CHUNK_SIZE
+                pixel_y = (key[1] - min_cy) // chunks_per_pixel
+                pixel_x = (key[0] - min_cx) // chunks_per_pixel
+                ids[pixel_y, pixel_x] = max(ids[pixel_y, pixel_x], chunk.max())
+
+        # Crop to the map, blow it up by a whole factor to fill the thumbnail, and centre it
+        height = -(-span_y * CHUNK_SIZE // step)
+        width = -(-span_x * CHUNK_SIZE // step)
+        scale = size // max(width, height)
+        ids = ids[:height, :width].repeat(scale, axis=0).repeat(scale, axis=1)
+        top = (size - ids.shape[0]) // 2
+        left = (size - ids.shape[1]) // 2
+        pixels[left:left + ids.shape[1], top:top + ids.shape[0]] = color_table[ids.view(np.uint8)].transpose(1, 0, 2)
+        return pixels
+    finally:
+        store.clear()  # Unmaps the file
+
+class ThumbnailCache:
+    """Map thumbnails, rendered on a background thread and kept on disk by path, size and mtime"""
+
+    def __init__(self, cache_dir, size):
+        self.cache_dir = cache_dir
+        self.size = size
+        self.color_table = None  # Tile id -> colour, from render_cache.build_color_table
+        self.surfaces = {}  # (path, size, mtime) -> thumbnail Surface, or None while it is being made
+        self.requests = queue.LifoQueue()  # Newest first, so the maps on screen now come before scrolled-past ones
+        self.results = queue.Queue()
+        self.worker = None
+
+    def get(self, entry):
+        """Return the thumbnail of a map file, or None if it isn't ready yet (it is then requested)"""
+        key = (entry.path, entry.size, entry.mtime_ns)
+        if key in self.surfaces:
+            return self.surfaces[key]
+        self.surfaces[key] = None
+        self.requests.put(key)
+        if self.worker is None:
+            self.worker = threading.Thread(target=self._work, name="thumbnails", daemon=True)
+            self.worker.start()
+        return None
+
+    def collect(self):
+        """Take in the thumbnails finished since the last call, returning whether there were any"""
+        arrived = False
+        while True:
+            try:
+                key, pixels = self.results.get_nowait()
+            except queue.Empty:
+                return arrived
+            self.surfaces[key] = pygame.surfarray.make_surface(pixels)
+            arrived = True
+
+    def cache_path(self, key):
+        """Return the prefix shared by every thumbnail of a path, and the file of this version of it"""
+        path, size, mtime_ns = key
+        prefix = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()
+        return prefix, os.path.join(self.cache_dir, f"{prefix}-{size}-{mtime_ns}.png")
+
+    def _work(self):
+        while True:
+            key = self.requests.get()
+            try:
+                pixels = self._load_or_render(key)
+            except Exception:
+                pixels = np.full((self.size, self.size, 3), DARK_GRAY, dtype=np.uint8)  # Unreadable map
+            self.results.put((key, pixels))
+            try:
+                pygame.event.post(pygame.event.Event(THUMBNAIL_READY))
+            except pygame.error:
+                return  # pygame has quit
+
+    def _load_or_render(self, key):
+        prefix, cache_file = self.cache_path(key)
+        if os.path.exists(cache_file):
+            return pygame.surfarray.array3d(pygame.image.load(cache_file))
+
+        pixels = render_thumbnail(key[0], self.color_table, self.size)
+
+        # Store it for next time, and drop the thumbnails of older versions of the map
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for name in os.listdir(self.cache_dir):
+            if name.startswith(prefix + "-"):
+                os.remove(os.path.join(self.cache_dir, name))
+        temp_file = cache_file + ".new.png"
+        pygame.image.save(pygame.surfarray.make_surface(pixels), temp_file)
+        os.replace(temp_file, cache_file)
+        return pixels
+
+def load_recent_maps():
+    """Return the recently opened or saved maps, newest first"""
+    try:
+        with open(RECENT_MAPS_FILE, 'r') as f:
+            return [path for path in json.load(f) if isinstance(path, str)]
+    except (OSError, ValueError):
+        return []
+
+def remember_map(path):
+    """Put a map at the front of the recent maps and store the list"""
+    global recent_maps
+    path = os.path.abspath(path)
+    recent_maps = ([path] + [recent for recent in recent_maps if recent != path])[:RECENT_MAPS_KEPT]
+    try:
+        os.makedirs(os.path.dirname(RECENT_MAPS_FILE), exist_ok=True)
+        with open(RECENT_MAPS_FILE, 'w') as f:
+            json.dump(recent_maps, f)
+    except OSError:
+        pass  # The list is a convenience; saving the map itself is what matters
+
+# Recently opened or saved maps, newest first
+recent_maps = load_recent_maps()
+
+class FileBrowser:
+    """A panel for picking a map file to load or a file name to save to.
+
+    While it is open it takes all mouse and keyboard input. Clicking a map
+    (or a recent map) loads it; when saving, clicking a map fills in its name.
+    """
+
+    # Layout, relative to the panel
+    MARGIN = 20
+    ROW_HEIGHT = THUMBNAIL_SIZE + 8
+    CARD_WIDTH = 130
+
+    def __init__(self):
+        self.mode = None  # "load" or "save" while open
+        self.on_pick = None
+        self.on_cancel = None
+        self.directory = os.getcwd()
+        self.file_name = ""  # Name typed when saving
+        self.confirm_path = None  # Existing file that saving again will replace, while asking to confirm that
+        self.scroll = 0  # First listing row shown
+        self.hovered = None  # Index of the clickable area under the mouse
+        self.targets = []  # (rect, action) of every clickable area as last drawn
+        self.revision = 0  # Changes whenever the panel has to be redrawn
+        self.directories = DirectoryCache()
+        self.thumbnails = ThumbnailCache(THUMBNAIL_CACHE_DIR, THUMBNAIL_SIZE)
+
+    @property
+    def is_open(self):
+        return self.mode is not None
+
+    def open(self, mode, on_pick, on_cancel, directory=None, file_name=""):
+        """Show the browser; on_pick(path) is called with the chosen file, or on_cancel() if there is none"""
+        self.mode = mode
+        self.on_pick = on_pick
+        self.on_cancel = on_cancel
+        if directory is not None and os.path.isdir(directory):
+            self.directory = directory
+        self.file_name = file_name
+        self.confirm_path = None
+        self.scroll = 0
+        self.revision += 1
+
+    def close(self):
+        self.mode = None
+        self.confirm_path = None
+        self.targets = []
+        self.hovered = None
+        self.revision += 1
+
+    def pick(self, path):
+        on_pick = self.on_pick
+        self.close()
+        on_pick(path)
+
+    def cancel(self):
+        on_cancel = self.on_cancel
+        self.close()
+        on_cancel()
+
+    def change_directory(self, directory):
+        self.directory = directory
+        self.confirm_path = None
+        self.scroll = 0
+        self.revision += 1
+
+    def choose_entry(self, entry):
+        """A click on a listed directory or map"""
+        if entry.is_dir:
+            self.change_directory(entry.path)
+        elif self.mode == "load":
+            self.pick(entry.path)
+        else:
+            self.file_name = entry.name
+            self.confirm_path = None
+            self.revision += 1
+
+    def choose_recent(self, path):
+        """A click on a recent map"""
+        if self.mode == "load":
+            self.pick(path)
+        else:
+            self.directory, self.file_name = os.path.split(path)
+            self.confirm_path = None
+            self.scroll = 0
+            self.revision += 1
+
+    def save_typed_name(self):
+        """Save to the typed file name, adding the binary map extension if it has none.
+
+        An existing file is only replaced once the save is asked for a second time.
+        """
+        name = self.file_name.strip()
+        if not name:
+            return
+        if not is_map_file(name):
+            name += ".dungeonb"
+        path = os.path.join(self.directory, name)
+        if os.path.exists(path) and path != self.confirm_path:
+            self.confirm_path = path
+            self.revision += 1
+            return
+        self.pick(path)
+
+    def update(self):
+        """Take in the thumbnails finished since the last frame, redrawing the panel if there are any"""
+        if self.thumbnails.collect():
+            self.revision += 1
+
+    def handle_event(self, event):
+        """Handle an input event while the browser is open. Returns True if it was used."""
+        if event.type == pygame.MOUSEMOTION:
+            hovered = next((i for i, (rect, _) in enumerate(self.targets) if rect.collidepoint(event.pos)), None)
+            if hovered != self.hovered:
+                self.hovered = hovered
+                self.revision += 1
+            return True
+
+        if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+            for rect, action in self.targets:
+                if rect.collidepoint(event.pos):
+                    action()
+                    return True
+            if not self.panel_rect().collidepoint(event.pos):
+                self.cancel()  # Clicked outside the panel
+            return True
+
+        if event.type == pygame.MOUSEWHEEL:
+            self.scroll = max(0, self.scroll - event.y)
+            self.revision += 1
+            return True
+
+        if event.type == pygame.KEYDOWN:
+            if event.key == pygame.K_ESCAPE and self.confirm_path is not None:
+                self.confirm_path = None  # Keep the existing file, and the browser open to pick another name
+            elif event.key == pygame.K_ESCAPE:
+                self.cancel()
+            elif event.key in (pygame.K_RETURN, pygame.K_KP_ENTER) and self.mode == "save":
+                self.save_typed_name()
+            elif event.key == pygame.K_BACKSPACE:
+                self.confirm_path = None
+                if self.mode == "save":
+                    self.file_name = self.file_name[:-1]
+                else:
+                    self.change_directory(os.path.dirname(self.directory))
+            elif self.mode == "save" and event.unicode and ord(event.unicode) >= 32 and event.unicode not in '/\\':
+                self.file_name += event.unicode
+                self.confirm_path = None
+            self.revision += 1
+            return True
+
+        # Everything else (button releases, text input, ...) is swallowed while the browser is open
+        return event.type in (pygame.MOUSEBUTTONUP, pygame.TEXTINPUT, pygame.KEYUP, THUMBNAIL_READY)
+
+    def panel_rect(self):
+        return pygame.Rect(self.MARGIN, self.MARGIN, GRID_WIDTH - 2 * self.MARGIN, GRID_HEIGHT - 2 * self.MARGIN)
+
+    def add_target(self, surface, rect, action):
+        """Make rect clickable, highlighting it while hovered"""
+        if self.hovered == len(self.targets):
+            pygame.draw.rect(surface, GRAY, rect)
+        self.targets.append((rect, action))
+
+    def draw_button(self, surface, rect, text, action):
+        pygame.draw.rect(surface, BROWN, rect)
+        self.add_target(surface, rect, action)
+        pygame.draw.rect(surface, BLACK, rect, 2)
+        label = render_text(text, 24, WHITE)
+        surface.blit(label, label.get_rect(center=rect.center))
+
+    def draw_thumbnail(self, surface, entry, x, y):
+        thumbnail = self.thumbnails.get(entry)
+        frame = pygame.Rect(x, y, THUMBNAIL_SIZE, THUMBNAIL_SIZE)
+        if thumbnail is None:
+            pygame.draw.rect(surface, BLACK, frame)  # Still being rendered
+        else:
+            surface.blit(thumbnail, frame)
+        pygame.draw.rect(surface, GRAY, frame, 1)
+
+    def draw(self, surface):
+        """Draw the browser over the grid area and work out where its clickable areas are"""
+        self.targets = []
+        panel = self.panel_rect()
+        pygame.draw.rect(surface, DARK_GRAY, panel)
+        pygame.draw.rect(surface, BLUE, panel, 2)
+        left = panel.x + 10
+        width = panel.width - 20
+        y = panel.y + 10
+
+        # Title and current directory, cut from the left if it is too long
+        title = "Load Map" if self.mode == "load" else "Save Map"
+        surface.blit(render_text(title, 30, WHITE), (left, y))
+        y += 30
+        directory = self.directory
+        small_font = get_font(20)
+        while len(directory) > 4 and small_font.size(directory)[0] > width:
+            directory = "..." + directory[4:]
+        surface.blit(render_text(directory, 20, LIGHT_BLUE), (left, y))
+        y += 26
+
+        # Recent maps as thumbnail cards
+        recent = [path for path in recent_maps if os.path.exists(path)][:width // self.CARD_WIDTH]
+        if recent:
+            surface.blit(render_text("Recent", 20, GRAY), (left, y))
+            y += 20
+            for i, path in enumerate(recent):
+                card = pygame.Rect(left + i * self.CARD_WIDTH, y, self.CARD_WIDTH - 6, THUMBNAIL_SIZE + 26)
+                self.add_target(surface, card, lambda path=path: self.choose_recent(path))
+                try:
+                    stat = os.stat(path)
+                    entry = Entry(os.path.basename(path), path, False, stat.st_size, stat.st_mtime_ns)
+                    self.draw_thumbnail(surface, entry, card.centerx - THUMBNAIL_SIZE // 2, card.y + 2)
+                except OSError:
+                    pass
+                name = os.path.basename(path)
+                while len(name) > 4 and small_font.size(name)[0] > card.width - 4:
+                    name = name[:-4] + "..."
+                label = render_text(name, 20, WHITE)
+                surface.blit(label, label.get_rect(midbottom=(card.centerx, card.bottom - 2)))
+            y += THUMBNAIL_SIZE + 32
+
+        # Bottom bar - the file name box when saving, and the buttons
+        bar_y = panel.bottom - 10 - BUTTON_HEIGHT
+        cancel_rect = pygame.Rect(panel.right - 10 - BUTTON_WIDTH, bar_y, BUTTON_WIDTH, BUTTON_HEIGHT)
+        self.draw_button(surface, cancel_rect, "Cancel", self.cancel)
+        if self.mode == "save":
+            save_rect = cancel_rect.move(-BUTTON_WIDTH - 10, 0)
+            self.draw_button(surface, save_rect, "Replace" if self.confirm_path else "Save", self.save_typed_name)
+            name_rect = pygame.Rect(left, bar_y, save_rect.x - 10 - left, BUTTON_HEIGHT)
+            pygame.draw.rect(surface, BLACK, name_rect)
+            pygame.draw.rect(surface, WHITE, name_rect, 1)
+            name_surface = render_text(self.file_name + "|", 24, WHITE)
+            # Keep the end of a long name, where the cursor is, in view
+            name_area = pygame.Rect(max(0, name_surface.get_width() - name_rect.width + 10), 0,
+                                    name_rect.width - 10, name_surface.get_height())
+            surface.blit(name_surface, (name_rect.x + 5, name_rect.centery - name_surface.get_height() // 2), name_area)
+
+        # Saving over an existing map asks first, above the file name box
+        if self.confirm_path is not None:
+            bar_y -= 26
+            question = f"Replace {os.path.basename(self.confirm_path)}? Enter to replace, Esc to keep it"
+            surface.blit(render_text(question, 20, RED), (left, bar_y + 4))
+
+        # The directory listing, with a row to go up a directory
+        list_top = y
+        list_bottom = bar_y - 10
+        try:
+            entries = self.directories.list(self.directory)
+        except OSError as e:
+            surface.blit(render_text(f"Can't read directory: {e.strerror}", 20, RED), (left, list_top))
+            entries = []
+        parent = os.path.dirname(self.directory)
+        if parent != self.directory:
+            entries = [Entry("..", parent, True, 0, 0)] + entries
+
+        rows_shown = max(1, (list_bottom - list_top) // self.ROW_HEIGHT)
+        self.scroll = min(self.scroll, max(0, len(entries) - rows_shown))
+        for row, entry in enumerate(entries[self.scroll:self.scroll + rows_shown]):
+            rect = pygame.Rect(left, list_top + row * self.ROW_HEIGHT, width, self.ROW_HEIGHT - 4)
+            self.add_target(surface, rect, lambda entry=entry: self.choose_entry(entry))
+            text_x = rect.x + THUMBNAIL_SIZE + 10
+            if entry.is_dir:
+                pygame.draw.rect(surface, BROWN, (rect.x + 4, rect.y + 12, THUMBNAIL_SIZE - 8, THUMBNAIL_SIZE - 20))
+                surface.blit(render_text(entry.name + "/", 24, LIGHT_BLUE), (text_x, rect.y + 14))
+            else:
+                self.draw_thumbnail(surface, entry, rect.x, rect.y + 2)
+                surface.blit(render_text(entry.name, 24, WHITE), (text_x, rect.y + 4))
+                details = f"{max(1, entry.size // 1024)} KB"
+                surface.blit(render_text(details, 20, GRAY), (text_x, rect.y + 28))
+
+        if not entries:
+            surface.blit(render_text("No maps here", 24, GRAY), (left, list_top))
+
+# The browser used by the save and load commands
+file_browser = FileBrowser()
@@ -0,0 +1,482 @@
+"""Chunked storage and spatial index for the infinite grid.
+
+The grid is split into fixed-size square chunks so that drawing code can
+visit only the cells near the camera instead of every cell on the map.
+"""
+import numpy as np
+
+EMPTY_CELL = 0  # Same value as settings.EMPTY, which can't be imported here
+TILE_ID_RANGE = (-128, 127)  # The tile ids an int8 cell can hold
+
+def tile_id_array(values):
+    """Return tile ids as an int8 array, raising ValueError if any don't fit in a cell instead of letting them wrap"""
+    values = np.asarray(values)
+    if values.dtype == np.int8:
+        return values
+    if values.dtype.kind not in "iu":
+        raise ValueError(f"Tile ids must be integers, not {values.dtype}")
+    if values.size:
+        low, high = int(values.min()), int(values.max())
+        if low < TILE_ID_RANGE[0] or high > TILE_ID_RANGE[1]:
+            bad = low if low < TILE_ID_RANGE[0] else high
+            raise ValueError(f"Tile id {bad} is out of range ({TILE_ID_RANGE[0]} to {TILE_ID_RANGE[1]})")
+    return values.astype(np.int8)
+
+def chunk_key(x, y, chunk_size):
+    """Return the (chunk_x, chunk_y) coordinate of the chunk containing cell (x, y)"""
+    return x // chunk_size, y // chunk_size
+
+def chunks_in_rect(chunks, chunk_size, min_x, min_y, max_x, max_y):
+    """Yield the keys in chunks of the chunks overlapping the inclusive cell rectangle"""
+    min_cx, min_cy = chunk_key(min_x, min_y, chunk_size)
+    max_cx, max_cy = chunk_key(max_x, max_y, chunk_size)
+
+    # Walk whichever is smaller: the chunk range or the chunks that exist
+    range_count = (max_cx - min_cx + 1) * (max_cy - min_cy + 1)
+    if range_count > len(chunks):
+        for key in list(chunks):
+            if min_cx <= key[0] <= max_cx and min_cy <= key[1] <= max_cy:
+                yield key
+    else:
+        for cy in range(min_cy, max_cy + 1):
+            for cx in range(min_cx, max_cx + 1):
+                if (cx, cy) in chunks:
+                    yield (cx, cy)
+
+class ChunkedGrid(dict):
+    """Dictionary of (x, y) -> value that keeps its keys indexed by chunk"""
+
+    def __init__(self, chunk_size):
+        super().__init__()
+        self.chunk_size = chunk_size
+        self.chunks = {}  # (chunk_x, chunk_y) -> set of (x, y) keys in that chunk
+        self.revisions = {}  # (chunk_x, chunk_y) -> revision of the last change in that chunk
+        self._revision = 0
+
+    def _touch(self, key):
+        """Mark a chunk as changed so cached renders of it become stale"""
+        self._revision += 1
+        self.revisions[key] = self._revision
+
+    @property
+    def revision(self):
+        """Return a number that changes every time any cell changes"""
+        return self._revision
+
+    def chunk_revision(self, key):
+        """Return a number that changes every time a cell in the chunk changes"""
+        return self.revisions.get(key, 0)
+
+    def __setitem__(self, pos, value):
+        if pos in self:
+            if dict.__getitem__(self, pos) == value:
+                return  # Repainting the same value must not dirty the chunk
+            self._touch(chunk_key(pos[0], pos[1], self.chunk_size))
+        else:
+            key = chunk_key(pos[0], pos[1], self.chunk_size)
+            self.chunks.setdefault(key, set()).add(pos)
+            self._touch(key)
+        super().__setitem__(pos, value)
+
+    def __delitem__(self, pos):
+        super().__delitem__(pos)
+        self._unindex(pos)
+
+    def _unindex(self, pos):
+        """Remove a key from its chunk, dropping the chunk once it is empty"""
+        key = chunk_key(pos[0], pos[1], self.chunk_size)
+        self._touch(key)
+        chunk = self.chunks[key]
+        chunk.discard(pos)
+        if not chunk:
+            del self.chunks[key]
+
+    def pop(self, pos, *default):
+        if pos in self:
+            self._unindex(pos)
+        return super().pop(pos, *default)
+
+    def popitem(self):
+        pos, value = super().popitem()
+        self._unindex(pos)
+        return pos, value
+
+    def setdefault(self, pos, default=None):
+        if pos not in self:
+            self[pos] = default
+        return self[pos]
+
+    def update(self, *args, **kwargs):
+        for pos, value in dict(*args, **kwargs).items():
+            self[pos] = value
+
+    def clear(self):
+        super().clear()
+        for key in self.chunks:
+            self._touch(key)
+        self.chunks.clear()
+
+    def chunks_in_rect(self, min_x, min_y, max_x, max_y):
+        """Yield the keys of non-empty chunks overlapping the inclusive cell rectangle"""
+        return chunks_in_rect(self.chunks, self.chunk_size, min_x, min_y, max_x, max_y)
+
+    def chunk_items(self, key):
+        """Yield ((x, y), value) for every stored cell in a chunk"""
+        for pos in self.chunks.get(key, ()):
+            yield pos, dict.__getitem__(self, pos)
+
+    def items_in_rect(self, min_x, min_y, max_x, max_y):
+        """Yield ((x, y), value) for every stored cell inside the inclusive cell rectangle"""
+        for key in self.chunks_in_rect(min_x, min_y, max_x, max_y):
+            for pos in self.chunks[key]:
+                if min_x <= pos[0] <= max_x and min_y <= pos[1] <= max_y:
+                    yield pos, dict.__getitem__(self, pos)
+
+class GridStore:
+    """Infinite grid of tile ids stored as fixed-size NumPy int8 chunks.
+
+    Behaves like a dict of (x, y) -> tile id that only holds non-empty cells:
+    writing EMPTY removes a cell, and a chunk is freed once all its cells are
+    empty. Chunk arrays are indexed [y, x] from the chunk origin.
+
+    Chunks can also be added lazily from a source such as map_format.MapFile;
+    they count as part of the grid but are only decoded when first accessed.
+    """
+
+    def __init__(self, chunk_size):
+        self.chunk_size = chunk_size
+        self.chunks = {}  # (chunk_x, chunk_y) -> (chunk_size, chunk_size) int8 array
+        self.counts = {}  # (chunk_x, chunk_y) -> number of non-empty cells in the chunk, decoded or not
+        self.pending = {}  # (chunk_x, chunk_y) -> source to decode the chunk from on first access
+        self.revisions = {}  # (chunk_x, chunk_y) -> revision of the last change in that chunk
+        self.shared = set()  # Keys of chunk arrays also held by a snapshot, copied before they are written
+        self._revision = 0
+        self._size = 0
+
+    def _touch(self, key):
+        """Mark a chunk as changed so cached renders of it become stale"""
+        self._revision += 1
+        self.revisions[key] = self._revision
+
+    @property
+    def revision(self):
+        """Return a number that changes every time any cell changes"""
+        return self._revision
+
+    def chunk_revision(self, key):
+        """Return a number that changes every time a cell in the chunk changes"""
+        return self.revisions.get(key, 0)
+
+    def _chunk(self, key):
+        """Return the array of a chunk, decoding it first if it is still pending, or None if it is empty"""
+        chunk = self.chunks.get(key)
+        if chunk is None and key in self.pending:
+            source = self.pending.pop(key)
+            chunk = source.read_chunk(key)
+            self.chunks[key] = chunk
+            if not self.pending:
+                source.close()  # Every chunk is decoded, so the source isn't needed any more
+        return chunk
+
+    def _writable_chunk(self, key):
+        """Return the array of a chunk for writing, first copying it if a snapshot holds it"""
+        chunk = self._chunk(key)
+        if key in self.shared:
+            self.shared.discard(key)
+            chunk = chunk.copy()
+            self.chunks[key] = chunk
+        return chunk
+
+    def snapshot(self):
+        """Return the grid as it is now without copying any cells.
+
+        Returns ({key: int8 array} of the decoded chunks, {key: source} of the
+        pending ones). The arrays are shared with the grid, which copies a
+        chunk the next time it is written, so they never change afterwards
+        and can be read from another thread.
+        """
+        self.shared.update(self.chunks)
+        return dict(self.chunks), dict(self.pending)
+
+    def add_lazy_chunks(self, source):
+        """Add every chunk of source without decoding it.
+
+        source needs chunk_counts ({key: cell count}), read_chunk(key) returning
+        an int8 array, and close(). Its chunks must not overlap existing ones.
+        """
+        for key, count in source.chunk_counts.items():
+            self.counts[key] = count
+            self.pending[key] = source
+            self._size += count
+            self._touch(key)
+        if not self.pending:
+            source.close()
+
+    def replace_source(self, source, replacement):
+        """Decode the chunks still pending from source out of replacement instead, and close source"""
+        for key, pending_source in self.pending.items():
+            if pending_source is source:
+                self.pending[key] = replacement
+        source.close()
+
+    def get(self, pos, default=None):
+        x, y = pos
+        size = self.chunk_size
+        key = (x // size, y // size)
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            if key not in self.pending:
+                return default
+            chunk = self._chunk(key)
+        value = chunk[y % size, x % size]
+        return default if value == EMPTY_CELL else int(value)
+
+    def __getitem__(self, pos):
+        value = self.get(pos)
+        if value is None:
+            raise KeyError(pos)
+        return value
+
+    def __contains__(self, pos):
+        return self.get(pos) is not None
+
+    def __setitem__(self, pos, value):
+        value = tile_id_array(value)[()]
+        x, y = pos
+        size = self.chunk_size
+        key = (x // size, y // size)
+        chunk = self._writable_chunk(key)
+        if chunk is None:
+            if value == EMPTY_CELL:
+                return
+            chunk = np.zeros((size, size), dtype=np.int8)
+            self.chunks[key] = chunk
+            self.counts[key] = 0
+        
+        local_y = y % size
+        local_x = x % size
+        old_value = chunk[local_y, local_x]
+        if old_value == value:
+            return  # Repainting the same value must not dirty the chunk
+        chunk[local_y, local_x] = value
+        self._touch(key)
+        
+        if old_value == EMPTY_CELL:
+            self.counts[key] += 1
+            self._size += 1
+        elif value == EMPTY_CELL:
+            self.counts[key] -= 1
+            self._size -= 1
+            if self.counts[key] == 0:
+                self._free_chunk(key)
+
+    def __delitem__(self, pos):
+        if pos not in self:
+            raise KeyError(pos)
+        self[pos] = EMPTY_CELL
+
+    def write_cells(self, xs, ys, values):
+        """Write many cells at once and return an int8 array of their previous values.
+
+        xs and ys are equal-length integer arrays and values is an array of the
+        same length or a single tile id. Cells are written one chunk at a time
+        with array indexing; if a cell is listed more than once the last value
+        wins, and every listing of it gets the value from before the call.
+        """
+        xs = np.asarray(xs, dtype=np.int64)
+        ys = np.asarray(ys, dtype=np.int64)
+        values = np.broadcast_to(tile_id_array(values), xs.shape)
+        old_values = np.zeros(xs.shape, dtype=np.int8)
+        if not len(xs):
+            return old_values
+
+        size = self.chunk_size
+        chunk_xs = xs // size
+        chunk_ys = ys // size
+        local_xs = xs - chunk_xs * size
+        local_ys = ys - chunk_ys * size
+
+        # Sort the cells by chunk, then by cell within the chunk, with one key per cell - a stable
+        # sort keeps the listings of the same cell in the order they were given
+        min_chunk_x = chunk_xs.min()
+        chunk_columns = chunk_xs.max() - min_chunk_x + 1
+        chunk_rows = chunk_ys.max() - chunk_ys.min() + 1
+        if int(chunk_columns) * int(chunk_rows) <= (1 << 62) // (size * size):
+            chunk_numbers = (chunk_ys - chunk_ys.min()) * chunk_columns + (chunk_xs - min_chunk_x)
+        else:
+            # Cells too far apart to number every chunk in between - number only the chunks listed
+            _, chunk_numbers = np.unique(np.stack([chunk_ys, chunk_xs], axis=1), axis=0, return_inverse=True)
+            chunk_numbers = chunk_numbers.reshape(-1).astype(np.int64)
+        cell_keys = chunk_numbers * (size * size) + local_ys * size + local_xs
+        order = np.argsort(cell_keys, kind="stable")
+        sorted_keys = cell_keys[order]
+        sorted_xs = chunk_xs[order]
+        sorted_ys = chunk_ys[order]
+        
+        # Find where each chunk's run starts
+        sorted_chunks = chunk_numbers[order]
+        breaks = np.flatnonzero(sorted_chunks[1:] != sorted_chunks[:-1]) + 1
+        starts = [0] + breaks.tolist()
+        ends = breaks.tolist() + [len(order)]
+        
+        # Only the last listing of each cell is written - NumPy doesn't say which of several
+        # assignments to the same element wins
+        last_listing = np.ones(len(order), dtype=bool)
+        last_listing[:-1] = sorted_keys[1:] != sorted_keys[:-1]
+        if last_listing.all():
+            last_listing = None  # No cell is listed twice
+
+        for start, end in zip(starts, ends):
+            key = (int(sorted_xs[start]), int(sorted_ys[start]))
+            indices = order[start:end]
+            # Every listing gets the previous value, but only the last listing of a cell is written
+            written = indices if last_listing is None else indices[last_listing[start:end]]
+            new_values = values[written]
+            chunk = self._writable_chunk(key)
+            if chunk is None:
+                if not new_values.any():
+                    continue  # Erasing cells that are already empty
+                chunk = np.zeros((size, size), dtype=np.int8)
+                self.chunks[key] = chunk
+                self.counts[key] = 0
+
+            old_values[indices] = chunk[local_ys[indices], local_xs[indices]]
+            cell_ys = local_ys[written]
+            cell_xs = local_xs[written]
+            previous = chunk[cell_ys, cell_xs]
+            if np.array_equal(previous, new_values):
+                continue  # Repainting the same values must not dirty the chunk
+            chunk[cell_ys, cell_xs] = new_values
+            self._touch(key)
+
+            # Recount the chunk, which is cheaper than tracking duplicates
+            count = int(np.count_nonzero(chunk))
+            self._size += count - self.counts[key]
+            self.counts[key] = count
+            if count == 0:
+                self._free_chunk(key)
+        return old_values
+
+    def _free_chunk(self, key):
+        """Drop a chunk whose cells are all empty"""
+        del self.chunks[key]
+        del self.counts[key]
+        self.shared.discard(key)
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        for pos, _ in self.items():
+            yield pos
+
+    def keys(self):
+        return iter(self)
+
+    def values(self):
+        for _, value in self.items():
+            yield value
+
+    def items(self):
+        """Yield ((x, y), tile id) for every non-empty cell"""
+        for key in list(self.counts):
+            yield from self.chunk_items(key)
+
+    def clear(self):
+        for key in self.counts:
+            self._touch(key)
+        for source in set(self.pending.values()):
+            source.close()
+        self.chunks.clear()
+        self.counts.clear()
+        self.pending.clear()
+        self.shared.clear()
+        self._size = 0
+
+    def chunk_keys(self):
+        """Return the keys of every non-empty chunk, decoded or not"""
+        return list(self.counts)
+
+    def chunk_array(self, key):
+        """Return the int8 array of a chunk, or None if all its cells are empty"""
+        return self._chunk(key)
+
+    def chunk_items(self, key):
+        """Yield ((x, y), tile id) for every non-empty cell in a chunk"""
+        chunk = self._chunk(key)
+        if chunk is None:
+            return
+        origin_x = key[0] * self.chunk_size
+        origin_y = key[1] * self.chunk_size
+        local_ys, local_xs = np.nonzero(chunk)
+        values = chunk[local_ys, local_xs].tolist()
+        for local_x, local_y, value in zip(local_xs.tolist(), local_ys.tolist(), values):
+            yield (origin_x + local_x, origin_y + local_y), value
+
+    def chunks_in_rect(self, min_x, min_y, max_x, max_y):
+        """Yield the keys of non-empty chunks overlapping the inclusive cell rectangle"""
+        return chunks_in_rect(self.counts, self.chunk_size, min_x, min_y, max_x, max_y)
+
+    def read_region(self, min_x, min_y, width, height):
+        """Return an int8 array [y, x] with a copy of the cells in the rectangle starting at (min_x, min_y)"""
+        region = np.zeros((height, width), dtype=np.int8)
+        size = self.chunk_size
+        max_x = min_x + width - 1
+        max_y = min_y + height - 1
+        for key in self.chunks_in_rect(min_x, min_y, max_x, max_y):
+            chunk = self._chunk(key)
+            
+            # Copy the part of the chunk that overlaps the rectangle
+            origin_x = key[0] * size
+            origin_y = key[1] * size
+            x0 = max(min_x, origin_x)
+            y0 = max(min_y, origin_y)
+            x1 = min(max_x + 1, origin_x + size)
+            y1 = min(max_y + 1, origin_y + size)
+            region[y0 - min_y:y1 - min_y, x0 - min_x:x1 - min_x] = \
+                chunk[y0 - origin_y:y1 - origin_y, x0 - origin_x:x1 - origin_x]
+        return region
+
+    def write_region(self, min_x, min_y, region):
+        """Copy an int8 array [y, x] into the rectangle starting at (min_x, min_y) and return the previous cells"""
+        region = tile_id_array(region)
+        height, width = region.shape
+        old_region = np.zeros((height, width), dtype=np.int8)
+        size = self.chunk_size
+        min_cx, min_cy = chunk_key(min_x, min_y, size)
+        max_cx, max_cy = chunk_key(min_x + width - 1, min_y + height - 1, size)
+
+        for cy in range(min_cy, max_cy + 1):
+            for cx in range(min_cx, max_cx + 1):
+                key = (cx, cy)
+
+                # The part of the chunk that overlaps the rectangle
+                origin_x = cx * size
+                origin_y = cy * size
+                x0 = max(min_x, origin_x)
+                y0 = max(min_y, origin_y)
+                x1 = min(min_x + width, origin_x + size)
+                y1 = min(min_y + height, origin_y + size)
+                new_cells = region[y0 - min_y:y1 - min_y, x0 - min_x:x1 - min_x]
+
+                chunk = self._writable_chunk(key)
+                if chunk is None:
+                    if not new_cells.any():
+                        continue  # Clearing cells that are already empty
+                    chunk = np.zeros((size, size), dtype=np.int8)
+                    self.chunks[key] = chunk
+                    self.counts[key] = 0
+
+                chunk_cells = chunk[y0 - origin_y:y1 - origin_y, x0 - origin_x:x1 - origin_x]
+                old_region[y0 - min_y:y1 - min_y, x0 - min_x:x1 - min_x] = chunk_cells
+                if np.array_equal(chunk_cells, new_cells):
+                    continue  # Repainting the same values must not dirty the chunk
+                chunk_cells[...] = new_cells
+                self._touch(key)
+
+                count = int(np.count_nonzero(chunk))
+                self._size += count - self.counts[key]
+                self.counts[key] = count
+                if count == 0:
+                    self._free_chunk(key)
+        return old_region
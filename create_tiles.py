@@ -24,8 +24,8 @@ def create_tile_image(filename, color, symbol=None):
     pygame.image.save(surface, filename)
 
 def main():
-    # Initialize pygame
-    pygame.init()
+    # Only fonts are needed to draw the tile symbols - no window is opened
+    pygame.font.init()
     
     # Create tiles directory if it doesn't exist
     os.makedirs("tiles", exist_ok=True)
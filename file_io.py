@@ -1,84 +1,361 @@
+import io
 import json
 import os
-import tkinter as tk
-import tkinter.filedialog
+import tempfile
+import threading
+import numpy as np
 from settings import *
 from tiles import set_entrance_tile
+from history import edit_history, edit_journal, set_note_text
+from browser import file_browser, remember_map
+import journal
+import map_format
+import json_format
+import image_export
 
-def show_save_dialog():
-    """Show a save file dialog and return the chosen file path"""
-    # Create a root window and hide it
-    root = tk.Tk()
-    root.withdraw()
-    
-    # Show the save dialog
-    file_path = tkinter.filedialog.asksaveasfilename(
-        defaultextension=".dungeon",
-        filetypes=[("Dungeon Map", "*.dungeon"), ("All Files", "*.*")],
-        title="Save Dungeon Map"
-    )
-    
-    root.destroy()
-    return file_path
-
-def show_load_dialog():
-    """Show a load file dialog and return the chosen file path"""
-    # Create a root window and hide it
-    root = tk.Tk()
-    root.withdraw()
-    
-    # Show the load dialog
-    file_path = tkinter.filedialog.askopenfilename(
-        defaultextension=".dungeon",
-        filetypes=[("Dungeon Map", "*.dungeon"), ("All Files", "*.*")],
-        title="Load Dungeon Map"
-    )
-    
-    root.destroy()
-    return file_path
+def is_json_map_path(file_path):
+    """Whether a map should be saved as JSON rather than in the binary format"""
+    return file_path.lower().endswith(".dungeon")
+
+class MapSnapshot:
+    """The grid, notes and camera as they were when a save started.
+
+    Taking one is cheap: chunk arrays are shared with the grid, which copies
+    a chunk before writing to it again, and chunks still pending from a loaded
+    .dungeonb file are kept as their encoded data.
+    """
+
+    def __init__(self, grid, notes=None, camera=None, zoom=None):
+        import settings
+        
+        # The open map's notes, camera and zoom unless others are given
+        if notes is None:
+            notes = settings.notes
+        if camera is None:
+            camera = (settings.camera_x, settings.camera_y)
+        if zoom is None:
+            zoom = settings.zoom_level
+        
+        self.chunk_size = grid.chunk_size
+        self.chunks, pending = grid.snapshot()
+        # Copied now, since the file they come from is closed when another map is loaded
+        self.encoded_chunks = [(key, source.read_chunk_data(key), grid.counts[key])
+                               for key, source in pending.items()]
+        self.notes = dict(notes)
+        self.camera_x, self.camera_y = camera
+        self.zoom = zoom
+
+    def chunk_arrays(self, decode_pending=False):
+        """Yield (key, int8 array) for the decoded chunks, and the pending ones too if asked"""
+        chunks = list(self.chunks.items())
+        if decode_pending:
+            chunks += [(key, map_format.decode_chunk(data, self.chunk_size)) for key, data, _ in self.encoded_chunks]
+        for key, chunk in chunks:
+            # Leave out the entrance tile (since it's always at 0,0) - the array is shared, so on a copy
+            if key == (0, 0):
+                chunk = chunk.copy()
+                chunk[0, 0] = EMPTY
+            yield key, chunk
+
+# The thread writing the last map that was saved
+active_save = None
 
 def save_map(grid, camera_pos=None, zoom=None):
-    """Save the map to a file"""
+    """Pick a file in the file browser and save the map to it"""
     import settings
     
-    # Get file path from dialog
-    file_path = show_save_dialog()
-    if not file_path:
-        settings.status_message = "Save cancelled."
+    # One save at a time
+    if active_save is not None and active_save.is_alive() and active_save.name != "compact_journal":
+        settings.status_message = "Still saving the previous map..."
         settings.status_message_timer = 180  # 3 seconds at 60 FPS
         return
     
+    # Start in the folder of the open map, offering its name
+    if settings.map_path is not None:
+        directory, file_name = os.path.split(os.path.abspath(settings.map_path))
+    else:
+        directory, file_name = None, ""
+    file_browser.open("save", lambda file_path: save_map_to(grid, file_path), save_cancelled,
+                      directory=directory, file_name=file_name)
+
+def save_cancelled():
+    import settings
+    
+    settings.status_message = "Save cancelled."
+    settings.status_message_timer = 180  # 3 seconds at 60 FPS
+
+def save_map_to(grid, file_path):
+    """Save the map to a file on a worker thread, so editing can go on meanwhile"""
+    global active_save
+    import settings
+    
+    # The browser blocks other saves while it is open, but a journal compaction may have started - it is short, so it is waited for
+    finish_saving()
+    
+    settings.status_message = f"Saving {os.path.basename(file_path)}..."
+    settings.status_message_timer = 300  # 5 seconds at 60 FPS
+    
+    # Saving over the map that was opened replaces the file its pending chunks are read from
+    release_map_file(grid, file_path)
+    
+    # Edits from now on aren't in the snapshot, so they are carried over to the journal of the new save
+    snapshot = MapSnapshot(grid)
+    rotation = edit_journal.begin_rotation()
+    active_save = threading.Thread(target=write_snapshot, args=(snapshot, file_path, rotation), name="save_map")
+    active_save.start()
+
+def release_map_file(grid, file_path):
+    """Stop the grid reading pending chunks out of file_path, so the file can be replaced.
+
+    Windows won't replace a file that is memory-mapped, so chunks still
+    pending from it are read from a copy of its data in memory instead.
+    """
+    for source in set(grid.pending.values()):
+        if source.path is not None and os.path.exists(file_path) and os.path.samefile(source.path, file_path):
+            grid.replace_source(source, source.in_memory())
+
+def finish_saving():
+    """Wait for a save that is still being written, e.g. before quitting"""
+    if active_save is not None:
+        active_save.join()
+
+def write_map_file(snapshot, file_path, progress=None):
+    """Write a snapshot to a temporary file and rename it over file_path.
+
+    The rename replaces the old file in one step, so a crash or full disk
+    part way through leaves the previous save intact. The format follows
+    the file extension.
+    """
+    if progress is None:
+        progress = lambda done, total: None
+    
+    temp_path = file_path + ".saving"
     try:
-        # Create a copy of the grid without the entrance tile (since it's always at 0,0)
-        grid_to_save = {str(k): v for k, v in grid.items() if k != (0, 0) and v != EMPTY}
-        
-        # Save notes - convert tuple keys to strings for JSON
-        notes_to_save = {str(k): v for k, v in settings.notes.items()}
-        
-        # Create data object with all map information
-        map_data = {
-            "grid": grid_to_save,
-            "notes": notes_to_save,
-            "camera": {
-                "x": settings.camera_x,
-                "y": settings.camera_y
-            },
-            "zoom": settings.zoom_level
-        }
+        if is_json_map_path(file_path):
+            with open(temp_path, 'w') as f:
+                save_json_map(f, snapshot, progress)
+                f.flush()
+                os.fsync(f.fileno())
+        else:
+            with open(temp_path, 'wb') as f:
+                map_format.write_map(f, snapshot.chunk_size, snapshot.chunk_arrays(), snapshot.notes,
+                                     snapshot.camera_x, snapshot.camera_y, snapshot.zoom,
+                                     encoded_chunks=snapshot.encoded_chunks, progress=progress)
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def write_snapshot(snapshot, file_path, rotation):
+    """Save a snapshot to file_path and start the journal over from it (runs on the worker thread)"""
+    import settings
+    
+    file_name = os.path.basename(file_path)
+    
+    def report_progress(done, total):
+        settings.status_message = f"Saving {file_name}... {100 * done // max(total, 1)}%"
+        settings.status_message_timer = 300  # 5 seconds at 60 FPS
+    
+    try:
+        write_map_file(snapshot, file_path, report_progress)
+        settings.map_path = file_path
+        remember_map(file_path)
         
-        # Save to file
-        with open(file_path, 'w') as f:
-            json.dump(map_data, f)
+        # The journal starts over from the new save
+        edit_journal.finish_rotation(rotation, journal_path(file_path), journal.file_identity(file_path))
         
-        settings.status_message = f"Map saved: {os.path.basename(file_path)}"
+        settings.status_message = f"Map saved: {file_name}"
         settings.status_message_timer = 180  # 3 seconds at 60 FPS
         
     except Exception as e:
+        edit_journal.abort_rotation(rotation)
         settings.status_message = f"Error saving map: {str(e)}"
         settings.status_message_timer = 300  # 5 seconds at 60 FPS
 
+def save_json_map(file, snapshot, progress):
+    """Write a snapshot as a JSON .dungeon file"""
+    # Convert tuple keys to strings for JSON
+    grid_to_save = {}
+    chunks = list(snapshot.chunk_arrays(decode_pending=True))
+    size = snapshot.chunk_size
+    for done, ((chunk_x, chunk_y), chunk) in enumerate(chunks, 1):
+        local_ys, local_xs = np.nonzero(chunk)
+        xs = (local_xs + chunk_x * size).tolist()
+        ys = (local_ys + chunk_y * size).tolist()
+        for x, y, tile_id in zip(xs, ys, chunk[local_ys, local_xs].tolist()):
+            grid_to_save[f"({x}, {y})"] = tile_id
+        if done % map_format.PROGRESS_CHUNKS == 0:
+            progress(done, len(chunks))
+    
+    # Save notes - convert tuple keys to strings for JSON
+    notes_to_save = {str(k): v for k, v in snapshot.notes.items()}
+    
+    # Create data object with all map information
+    map_data = {
+        "grid": grid_to_save,
+        "notes": notes_to_save,
+        "camera": {
+            "x": snapshot.camera_x,
+            "y": snapshot.camera_y
+        },
+        "zoom": snapshot.zoom
+    }
+    
+    json.dump(map_data, file)
+
+# The thread exporting the last map image
+active_export = None
+
+def unused_image_path(map_path):
+    """Return <map>.png next to the map, or <map>-2.png, <map>-3.png, ... if that is taken"""
+    base = os.path.splitext(map_path)[0]
+    png_path = base + ".png"
+    number = 2
+    while os.path.exists(png_path) or os.path.exists(png_path + ".saving"):
+        png_path = f"{base}-{number}.png"
+        number += 1
+    return png_path
+
+def export_image(grid, tiles):
+    """Export the whole map as a PNG next to the map file, on a worker thread.
+
+    An existing image is never replaced - each export gets a new numbered name.
+    """
+    global active_export
+    import settings
+    
+    if active_export is not None and active_export.is_alive():
+        settings.status_message = "Still exporting the previous image..."
+        settings.status_message_timer = 180  # 3 seconds at 60 FPS
+        return
+    
+    # The image goes next to the map, so a new map has to be saved first
+    if settings.map_path is None:
+        settings.status_message = "Save the map before exporting it as an image"
+        settings.status_message_timer = 180  # 3 seconds at 60 FPS
+        return
+    png_path = unused_image_path(settings.map_path)
+    
+    settings.status_message = f"Exporting {os.path.basename(png_path)}..."
+    settings.status_message_timer = 300  # 5 seconds at 60 FPS
+    
+    # Tile images are packed here, since they come from the display's surfaces
+    setup = image_export.export_setup(tiles, EXPORT_TILE_SIZE)
+    snapshot = MapSnapshot(grid)
+    active_export = threading.Thread(target=write_image, args=(snapshot, setup, png_path), name="export_image")
+    active_export.start()
+
+def write_image(snapshot, setup, png_path):
+    """Render a snapshot to a PNG (runs on the worker thread)"""
+    import settings
+    
+    file_name = os.path.basename(png_path)
+    
+    def report_progress(done, total):
+        settings.status_message = f"Exporting {file_name}... {100 * done // max(total, 1)}%"
+        settings.status_message_timer = 300  # 5 seconds at 60 FPS
+    
+    # The export workers read the map from a file, so the snapshot is written to a temporary one first
+    handle, temp_path = tempfile.mkstemp(suffix=".dungeonb")
+    os.close(handle)
+    try:
+        write_map_file(snapshot, temp_path)
+        size = image_export.export_map(temp_path, png_path, setup, EXPORT_STRIP_PIXELS, progress=report_progress)
+        if size is None:
+            settings.status_message = "Nothing to export - the map is empty"
+        else:
+            settings.status_message = f"Exported {file_name} ({size[0]}x{size[1]})"
+        settings.status_message_timer = 180  # 3 seconds at 60 FPS
+    except Exception as e:
+        settings.status_message = f"Error exporting image: {str(e)}"
+        settings.status_message_timer = 300  # 5 seconds at 60 FPS
+    finally:
+        os.remove(temp_path)
+
+def journal_path(map_path):
+    """Where the edit journal of a map is kept - next to the map file, or in the per-user data folder for a new map"""
+    if map_path is None:
+        return UNTITLED_JOURNAL_PATH
+    return map_path + ".journal"
+
+def open_journal(map_path):
+    """Start journaling the edits of the map that was just opened (None for a new map).
+
+    Edits left in the map's journal since its last save - because the
+    program crashed or was closed without saving - are replayed first.
+    Returns how many were replayed.
+    """
+    import settings
+    
+    path = journal_path(map_path)
+    base = journal.file_identity(map_path) if map_path is not None else journal.NO_BASE
+    try:
+        journal_base, snapshot, records, length = journal.read_journal(path)
+    except (OSError, ValueError):
+        journal_base = None  # No journal, or an unreadable one
+    
+    # A journal written against an older save of the map no longer applies to it
+    if journal_base != base:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        edit_journal.create(path, base)
+        return 0
+    
+    # A compacted journal holds the whole map as it was when it was compacted
+    if snapshot is not None:
+        grid.clear()
+        settings.notes.clear()
+        load_binary_map(map_format.MapFile(data=snapshot), grid, settings.notes)
+    
+    for record in records:
+        if record[0] == journal.CELLS:
+            _, xs, ys, values = record
+            grid.write_cells(xs, ys, values)
+        else:
+            _, pos, note_text = record
+            set_note_text(pos, note_text)
+    
+    edit_journal.resume(path, base, length)
+    return len(records)
+
+# Journal size that starts the next compaction, pushed back after one fails
+compact_journal_at = JOURNAL_COMPACT_BYTES
+
+def compact_journal():
+    """Fold the journal into a snapshot of the whole map on a worker thread once it has grown too large"""
+    global active_save
+    
+    if edit_journal.size < compact_journal_at or (active_save is not None and active_save.is_alive()):
+        return
+    
+    snapshot = MapSnapshot(grid)
+    rotation = edit_journal.begin_rotation()
+    active_save = threading.Thread(target=write_journal_snapshot, args=(snapshot, rotation), name="compact_journal")
+    active_save.start()
+
+def write_journal_snapshot(snapshot, rotation):
+    """Replace the journal with the snapshot and the edits made since it was taken (runs on the worker thread)"""
+    global compact_journal_at
+    import settings
+    
+    try:
+        data = io.BytesIO()
+        map_format.write_map(data, snapshot.chunk_size, snapshot.chunk_arrays(), snapshot.notes,
+                             snapshot.camera_x, snapshot.camera_y, snapshot.zoom,
+                             encoded_chunks=snapshot.encoded_chunks)
+        edit_journal.finish_rotation(rotation, edit_journal.path, edit_journal.base, data.getvalue())
+        compact_journal_at = JOURNAL_COMPACT_BYTES
+        
+    except Exception as e:
+        edit_journal.abort_rotation(rotation)
+        compact_journal_at = edit_journal.size + JOURNAL_COMPACT_BYTES
+        settings.status_message = f"Error compacting the edit journal: {str(e)}"
+        settings.status_message_timer = 300  # 5 seconds at 60 FPS
+
 def load_map(tiles):
-    """Load the map from a file"""
+    """Pick a map in the file browser and load it"""
     import settings
     
     # Handle case when tiles is None (called from keyboard shortcut)
@@ -87,49 +364,59 @@ def load_map(tiles):
         settings.status_message_timer = 180  # 3 seconds at 60 FPS
         return
     
-    # Get file path from dialog
-    file_path = show_load_dialog()
-    if not file_path:
-        settings.status_message = "Load cancelled."
-        settings.status_message_timer = 180  # 3 seconds at 60 FPS
-        return
+    directory = os.path.dirname(os.path.abspath(settings.map_path)) if settings.map_path is not None else None
+    file_browser.open("load", lambda file_path: load_map_from(file_path, tiles), load_cancelled,
+                      directory=directory)
+
+def load_cancelled():
+    import settings
+    
+    settings.status_message = "Load cancelled."
+    settings.status_message_timer = 180  # 3 seconds at 60 FPS
+
+def load_map_from(file_path, tiles):
+    """Load the map from a file"""
+    import settings
+    
+    # The previous map has to be completely saved, and its journal written, before it is replaced
+    finish_saving()
+    previous_journal = edit_journal.path
+    discarded = edit_journal.size > journal.HEADER.size  # Whether the previous map had unsaved edits
+    edit_journal.close()
     
     try:
-        # Load data from file
-        with open(file_path, 'r') as f:
-            map_data = json.load(f)
-        
         # Clear existing grid
         grid.clear()
         
         # Clear existing notes
         settings.notes.clear()
         
-        # Load grid data
-        for pos_str, tile_id in map_data["grid"].items():
-            # Convert string coordinates back to tuple
-            x, y = eval(pos_str)
-            grid[(x, y)] = tile_id
-            
-        # Load notes data if present
-        if "notes" in map_data:
-            for pos_str, note_text in map_data["notes"].items():
-                # Convert string coordinates back to tuple
-                x, y = eval(pos_str)
-                settings.notes[(x, y)] = note_text
+        # Edits to the previous map can't be undone on this one
+        edit_history.clear()
+        
+        camera, zoom = read_map_file(file_path, grid, settings.notes)
+        settings.map_path = file_path
+        remember_map(file_path)
+        
+        # Loading a map throws away the unsaved edits of the previous one, so its journal
+        # mustn't bring them back the next time that map is opened
+        if previous_journal is not None and os.path.exists(previous_journal):
+            os.remove(previous_journal)
+        
+        # Bring back edits that were never saved
+        recovered = open_journal(file_path)
             
         # Restore camera position
-        if "camera" in map_data:
-            settings.camera_x = map_data["camera"]["x"]
-            settings.camera_y = map_data["camera"]["y"]
+        if camera is not None:
+            settings.camera_x, settings.camera_y = camera
         else:
             # Center on origin if no camera data
             settings.camera_x = 0 - GRID_WIDTH_TILES / 2
             settings.camera_y = 0 - GRID_HEIGHT_TILES / 2
             
         # Restore zoom level
-        if "zoom" in map_data:
-            settings.zoom_level = max(MIN_ZOOM, min(MAX_ZOOM, map_data["zoom"]))
+        if zoom is not None:
+            settings.zoom_level = max(MIN_ZOOM, min(MAX_ZOOM, zoom))
             update_grid_dimensions()
             
             # Update scaled images for all tiles
@@ -140,8 +427,53 @@ def load_map(tiles):
         set_entrance_tile(grid, tiles)
             
         settings.status_message = f"Map loaded: {os.path.basename(file_path)}"
+        if recovered:
+            settings.status_message += f" (recovered {recovered} unsaved edits)"
+        elif discarded:
+            settings.status_message += " (unsaved edits to the previous map were discarded)"
         settings.status_message_timer = 180  # 3 seconds at 60 FPS
         
     except Exception as e:
         settings.status_message = f"Error loading map: {str(e)}"
-        settings.status_message_timer = 300  # 5 seconds at 60 FPS 
\ No newline at end of file
+        settings.status_message_timer = 300  # 5 seconds at 60 FPS
+
+def read_map_file(file_path, grid, notes):
+    """Fill a grid and notes dict from a map file of either format and return its (camera, zoom)"""
+    # Binary maps are recognised by their header, anything else is read as JSON
+    if map_format.is_binary_map(file_path):
+        return load_binary_map(map_format.MapFile(file_path), grid, notes)
+    return load_json_map(file_path, grid, notes)
+
+def load_json_map(file_path, grid, notes):
+    """Fill a grid and notes dict from a JSON .dungeon file and return its (camera, zoom)"""
+    # Grid cells go straight into the grid as arrays, a block of the file at a time when streaming
+    with open(file_path, 'r') as f:
+        map_data = json_format.read_map(f, grid.write_cells, stream=JSON_STREAM_LOAD,
+                                        block_chars=JSON_STREAM_BLOCK_CHARS)
+        
+    # Load notes data if present
+    notes.update(map_data.get("notes", {}))
+    
+    camera = None
+    if "camera" in map_data:
+        camera = (map_data["camera"]["x"], map_data["camera"]["y"])
+    return camera, map_data.get("zoom")
+
+def load_binary_map(map_file, grid, notes):
+    """Fill a grid and notes dict from an opened .dungeonb MapFile and return its (camera, zoom).
+
+    Only the chunk directory and notes are read here; chunks are decoded from
+    the memory-mapped file when they are first drawn or edited.
+    """
+    notes.update(map_file.read_notes())
+    
+    if map_file.chunk_size == grid.chunk_size:
+        grid.add_lazy_chunks(map_file)
+    else:
+        # Chunks of a different size have to be copied into the grid's own chunks
+        for chunk_x, chunk_y in map_file.directory:
+            chunk = map_file.read_chunk((chunk_x, chunk_y))
+            grid.write_region(chunk_x * map_file.chunk_size, chunk_y * map_file.chunk_size, chunk)
+        map_file.close()
+    
+    return (map_file.camera_x, map_file.camera_y), map_file.zoom
@@ -0,0 +1,140 @@
+from bisect import bisect_right
+from collections import OrderedDict
+import pygame
+from settings import *
+
+# Loaded fonts, keyed by (face, size) - SysFont looks up and opens a font file on every call
+fonts = {}
+
+# Rendered text surfaces, keyed by (text, face, size, color)
+rendered_text_cache = OrderedDict()
+
+# Word-wrapped lines, keyed by (text, face, size, max_width)
+wrap_cache = OrderedDict()
+
+def get_font(size, face=None):
+    """Return the font for the given face and size, loading it on first use"""
+    key = (face, size)
+    font = fonts.get(key)
+    if font is None:
+        # The font module is started on first use rather than with the display
+        if not pygame.font.get_init():
+            pygame.font.init()
+        font = pygame.font.SysFont(face, size)
+        fonts[key] = font
+    return font
+
+def render_text(text, size, color, face=None):
+    """Return an antialiased surface with the rendered text, rendering it only on a cache miss"""
+    key = (text, face, size, color)
+    text_surface = rendered_text_cache.get(key)
+    if text_surface is not None:
+        rendered_text_cache.move_to_end(key)
+        return text_surface
+
+    text_surface = get_font(size, face).render(text, True, color)
+    rendered_text_cache[key] = text_surface
+
+    # Drop the least recently used surfaces once the cache is full
+    while len(rendered_text_cache) > TEXT_CACHE_SIZE:
+        rendered_text_cache.popitem(last=False)
+    return text_surface
+
+def wrap_words(words, font, max_width, first=0):
+    """Greedily wrap words[first:] into lines no wider than max_width.
+
+    Returns (lines, starts) where starts holds the index of the first word of
+    each line, so a layout can later resume wrapping from any line start.
+    """
+    lines = []
+    starts = []
+    current_line = ""
+    current_start = first
+    
+    for i in range(first, len(words)):
+        word = words[i]
+        # Try adding the next word
+        test_line = current_line + word + " "
+        # Check if it would be too wide
+        width, _ = font.size(test_line)
+        
+        if width <= max_width:
+            if not current_line:
+                current_start = i
+            current_line = test_line  # Still fits, keep going
+        else:
+            if current_line:  # If we have text for this line, add it
+                lines.append(current_line)
+                starts.append(current_start)
+                current_line = word + " "  # Start a new line with this word
+                current_start = i
+            else:
+                # Word is too long for the whole line, force add it
+                lines.append(word + " ")
+                starts.append(i)
+                current_line = ""
+    
+    # Add the last line if it has content
+    if current_line:
+        lines.append(current_line)
+        starts.append(current_start)
+    
+    return lines, starts
+
+def wrap_text(text, size, max_width, face=None):
+    """Return the word-wrapped lines of text, wrapping it only on a cache miss"""
+    key = (text, face, size, max_width)
+    lines = wrap_cache.get(key)
+    if lines is not None:
+        wrap_cache.move_to_end(key)
+        return lines
+    
+    lines, _ = wrap_words(text.split(), get_font(size, face), max_width)
+    
+    # If there are no lines (empty text), use a single empty line
+    lines = tuple(lines) or ("",)
+    wrap_cache[key] = lines
+    while len(wrap_cache) > WRAP_CACHE_SIZE:
+        wrap_cache.popitem(last=False)
+    return lines
+
+class TextLayout:
+    """Word-wrapped layout of a text that is edited a few characters at a time.
+
+    set_text only re-wraps from the line before the first changed word, so
+    typing at the end of a long note measures just the last line or two.
+    """
+
+    def __init__(self, size, max_width, face=None):
+        self.size = size
+        self.face = face
+        self.max_width = max_width
+        self.words = []
+        self.starts = []  # Index of the first word of each line
+        self.lines = [""]
+
+    def set_text(self, text):
+        """Update the layout for new text, re-wrapping only what can have changed"""
+        words = text.split()
+        
+        # Find the first word that differs from the current layout
+        common = min(len(words), len(self.words))
+        first_changed = 0
+        while first_changed < common and words[first_changed] == self.words[first_changed]:
+            first_changed += 1
+        if first_changed == len(words) == len(self.words):
+            return
+        
+        # A shorter word may now fit on the previous line, so resume one line earlier
+        line = max(0, bisect_right(self.starts, first_changed) - 2)
+        first_word = self.starts[line] if line < len(self.starts) else 0
+        
+        font = get_font(self.size, self.face)
+        lines, starts = wrap_words(words, font, self.max_width, first_word)
+        self.lines = (self.lines[:line] if self.starts else []) + lines
+        self.starts = self.starts[:line] + starts
+        self.words = words
+        
+        # If there are no lines (empty text), use a single empty line
+        if not self.lines:
+            self.lines = [""]
@@ -1,7 +1,90 @@
 import pygame
 import math
+from collections import OrderedDict
 from settings import *
 from tiles import grid_to_cell, grid_to_screen, screen_to_grid
+from render_cache import ChunkRenderCache, ChunkColorCache, build_color_table
+from fonts import get_font, render_text, wrap_text
+
+# Composed chunk surfaces, re-rendered only when a cell in the chunk changes
+chunk_cache = ChunkRenderCache(CHUNK_CACHE_PIXEL_BUDGET)
+
+# Per-chunk tile colours for the far zoom renderer, and the tile id -> colour lookup
+chunk_colors = ChunkColorCache(LOD_CHUNK_CACHE_SIZE)
+color_table = None
+
+# Rendered note hover popups, keyed by (note text, max width)
+note_popup_cache = OrderedDict()
+
+# Rendered 'N' note markers, keyed by zoom level
+note_markers = {}
+
+def note_marker_surface(zoom):
+    """Return the 'N' marker drawn on note tiles at a zoom level, rendering it once per zoom"""
+    marker = note_markers.get(zoom)
+    if marker is None:
+        marker = render_text("N", max(16, int(20 * zoom)), BLUE)
+        note_markers[zoom] = marker
+    return marker
+
+def note_popup_surface(note_text, max_width):
+    """Return the hover popup for a note, rendering it only on a cache miss"""
+    key = (note_text, max_width)
+    popup = note_popup_cache.get(key)
+    if popup is not None:
+        note_popup_cache.move_to_end(key)
+        return popup
+    
+    wrapped_lines = wrap_text(note_text, 24, max_width)
+    note_font = get_font(24)
+    
+    # Calculate popup dimensions
+    line_height = note_font.get_height()
+    popup_height = (len(wrapped_lines) * line_height) + 10  # padding
+    
+    # Calculate width based on the widest line
+    widest_line_width = max(note_font.size(line)[0] for line in wrapped_lines)
+    popup_width = widest_line_width + 20  # padding
+    
+    # Create popup background
+    popup = pygame.Surface((popup_width, popup_height))
+    popup.fill(DARK_GRAY)
+    pygame.draw.rect(popup, BLUE, popup.get_rect(), 2)
+    
+    # Draw each line of the note text
+    for i, line in enumerate(wrapped_lines):
+        note_surface = note_font.render(line, True, WHITE)
+        popup.blit(note_surface, (10, 5 + (i * line_height)))  # 10px/5px padding
+    
+    note_popup_cache[key] = popup
+    while len(note_popup_cache) > NOTE_POPUP_CACHE_SIZE:
+        note_popup_cache.popitem(last=False)
+    return popup
+
+def draw_grid_lod(surface, tiles, grid, min_x, min_y, max_x, max_y):
+    """Draw the visible cells as one colour per tile with a single upload and scale"""
+    global color_table
+    import settings
+    
+    if color_table is None:
+        color_table = build_color_table(tiles)
+    
+    # One pixel per cell, straight from the cached chunk colour arrays
+    colors = chunk_colors.colors_in_rect(grid, color_table, min_x, min_y, max_x, max_y)
+    
+    # Mark notes, since their 'N' labels would cover everything at this size
+    for (note_x, note_y), _ in settings.notes.items_in_rect(min_x, min_y, max_x, max_y):
+        colors[note_x - min_x, note_y - min_y] = BLUE
+    
+    cells_image = pygame.surfarray.make_surface(colors)
+    cells_image.set_colorkey(BLACK)  # Empty cells stay transparent over the origin lines
+    
+    # Stretch the cell image so every cell covers its tile on screen
+    tile_size = BASE_TILE_SIZE * settings.zoom_level
+    screen_x, screen_y = grid_to_screen(min_x, min_y)
+    width = math.ceil(colors.shape[0] * tile_size)
+    height = math.ceil(colors.shape[1] * tile_size)
+    surface.blit(pygame.transform.scale(cells_image, (width, height)), (screen_x, screen_y))
 
 def draw_grid(surface, tiles, grid):
     """Draw the grid and all tiles on it"""
@@ -9,6 +92,10 @@ def draw_grid(surface, tiles, grid):
     grid_rect = pygame.Rect(0, 0, GRID_WIDTH, GRID_HEIGHT)
     pygame.draw.rect(surface, BLACK, grid_rect)
     
+    # Keep tiles off the palette, which is only redrawn when it changes
+    previous_clip = surface.get_clip()
+    surface.set_clip(grid_rect)
+    
     # Import settings directly to get the most up-to-date camera position
     import settings
     
@@ -22,117 +109,62 @@ def draw_grid(surface, tiles, grid):
     min_y = math.floor(settings.camera_y - 1)
     max_x = math.ceil(settings.camera_x + visible_width + 1)
     max_y = math.ceil(settings.camera_y + visible_height + 1)
+    camera_x = settings.camera_x
+    camera_y = settings.camera_y
     
     # Draw origin with different color
     origin_x, origin_y = grid_to_screen(0, 0)
     pygame.draw.line(surface, WHITE, (origin_x, 0), (origin_x, GRID_HEIGHT), 2)
     pygame.draw.line(surface, WHITE, (0, origin_y), (GRID_WIDTH, origin_y), 2)
     
-    # Draw placed tiles
-    for grid_pos, tile_id in grid.items():
-        if tile_id != EMPTY:  # Skip empty tiles
-            # Get grid position
-            grid_x, grid_y = grid_pos
-            
-            # Convert to screen coordinates (this will include floor operations)
-            screen_x, screen_y = grid_to_screen(grid_x, grid_y)
-            
-            # Get tile size with consistent rounding
-            drawn_tile_size = int(tile_size) + 1  # Add 1 to ensure no gaps
-            
-            # Draw the tile
-            tile = tiles[tile_id]
-            
-            # Draw the tile image
-            if tile.scaled_image:
-                # Draw scaled tile image - this should already be sized correctly
-                surface.blit(tile.scaled_image, (screen_x, screen_y))
-            else:
-                # If no image, draw a filled rectangle with the tile's color
-                tile_rect = pygame.Rect(screen_x, screen_y, drawn_tile_size, drawn_tile_size)
-                pygame.draw.rect(surface, tile.color, tile_rect)
-                pygame.draw.rect(surface, GRAY, tile_rect, 1)
+    lod = settings.zoom_level <= LOD_ZOOM_THRESHOLD
+    if lod:
+        # Far zoom - tiles are only a few pixels wide, so draw each one as its colour
+        draw_grid_lod(surface, tiles, grid, min_x, min_y, max_x, max_y)
+    else:
+        # Draw placed tiles - one pre-rendered surface per visible chunk, in one blits call
+        chunk_size = grid.chunk_size
+        blit_sequence = []
+        for key in grid.chunks_in_rect(min_x, min_y, max_x, max_y):
+            chunk_surface = chunk_cache.get(key, grid, tiles, settings.zoom_level)
+            screen_x = math.floor((key[0] * chunk_size - camera_x) * tile_size)
+            screen_y = math.floor((key[1] * chunk_size - camera_y) * tile_size)
+            blit_sequence.append((chunk_surface, (screen_x, screen_y)))
+        surface.blits(blit_sequence, doreturn=False)
     
+    # Draw the outline of the selected rectangle
+    if settings.selection is not None:
+        sel_min_x, sel_min_y, sel_max_x, sel_max_y = settings.selection
+        left, top = grid_to_screen(sel_min_x, sel_min_y)
+        right, bottom = grid_to_screen(sel_max_x + 1, sel_max_y + 1)
+        pygame.draw.rect(surface, GREEN, (left, top, right - left, bottom - top), 2)
+
     # Draw note overlays (separate pass to ensure they're drawn on top)
     mouse_pos = pygame.mouse.get_pos()
     mouse_grid_x, mouse_grid_y = screen_to_grid(mouse_pos[0], mouse_pos[1])
     mouse_cell_x, mouse_cell_y = grid_to_cell(mouse_grid_x, mouse_grid_y)
     mouse_cell = (mouse_cell_x, mouse_cell_y)
     
-    for grid_pos in settings.notes.keys():
-        # Draw the note indicator
-        grid_x, grid_y = grid_pos
-        
-        # Convert to screen coordinates
-        screen_x, screen_y = grid_to_screen(grid_x, grid_y)
-        
-        # Draw 'N' indicator in the top-left corner
-        font = pygame.font.SysFont(None, max(16, int(20 * settings.zoom_level)))
-        note_label = font.render("N", True, BLUE)
-        surface.blit(note_label, (screen_x + 2, screen_y + 2))
+    # Draw 'N' indicator in the top-left corner of each visible note (far zoom colours the cell instead)
+    if not lod:
+        note_label = note_marker_surface(settings.zoom_level)
+        blit_sequence = []
+        for (grid_x, grid_y), _ in settings.notes.items_in_rect(min_x, min_y, max_x, max_y):
+            screen_x = math.floor((grid_x - camera_x) * tile_size)
+            screen_y = math.floor((grid_y - camera_y) * tile_size)
+            blit_sequence.append((note_label, (screen_x + 2, screen_y + 2)))
+        surface.blits(blit_sequence, doreturn=False)
+    
+    # Draw note text popup when hovering over a note tile
+    note_text = settings.notes.get(mouse_cell)
+    if note_text is not None and mouse_pos[0] < GRID_WIDTH:
+        # Calculate width for text wrapping
+        max_popup_width = min(300, GRID_WIDTH - 40)  # Limit popup width
+        popup = note_popup_surface(note_text, max_popup_width)
         
-        # Draw note text popup when hovering over a note tile
-        if grid_pos == mouse_cell and mouse_pos[0] < GRID_WIDTH:
-            # Get note text
-            note_text = settings.notes[grid_pos]
-            
-            # Calculate width for text wrapping
-            max_popup_width = min(300, GRID_WIDTH - 40)  # Limit popup width
-            
-            # Create a list to store wrapped lines
-            wrapped_lines = []
-            
-            # Create a font for measuring and rendering
-            note_font = pygame.font.SysFont(None, 24)
-            
-            # Simple word-wrap algorithm
-            words = note_text.split()
-            current_line = ""
-            
-            for word in words:
-                # Try adding the next word
-                test_line = current_line + word + " "
-                # Check if it would be too wide
-                width, _ = note_font.size(test_line)
-                
-                if width <= max_popup_width:
-                    current_line = test_line  # Still fits, keep going
-                else:
-                    if current_line:  # If we have text for this line, add it
-                        wrapped_lines.append(current_line)
-                        current_line = word + " "  # Start a new line with this word
-                    else:
-                        # Word is too long for the whole line, force add it
-                        wrapped_lines.append(word + " ")
-                        current_line = ""
-            
-            # Add the last line if it has content
-            if current_line:
-                wrapped_lines.append(current_line)
-            
-            # If there are no lines (empty text somehow), add an empty line
-            if not wrapped_lines:
-                wrapped_lines = [""]
-            
-            # Calculate popup dimensions
-            line_height = note_font.get_height()
-            popup_height = (len(wrapped_lines) * line_height) + 10  # padding
-            
-            # Calculate width based on the widest line
-            widest_line_width = max(note_font.size(line)[0] for line in wrapped_lines)
-            popup_width = widest_line_width + 20  # padding
-            
-            # Calculate position for note popup (adjust for different positions)
-            popup_x = min(mouse_pos[0] + 15, GRID_WIDTH - popup_width - 10)
-            popup_y = min(mouse_pos[1] + 15, GRID_HEIGHT - popup_height - 5)
-            
-            # Create popup background
-            popup_rect = pygame.Rect(popup_x, popup_y, popup_width, popup_height)
-            pygame.draw.rect(surface, DARK_GRAY, popup_rect)
-            pygame.draw.rect(surface, BLUE, popup_rect, 2)
-            
-            # Draw each line of the note text
-            for i, line in enumerate(wrapped_lines):
-                note_surface = note_font.render(line, True, WHITE)
-                line_y = popup_y + 5 + (i * line_height)  # 5px padding from top
-                surface.blit(note_surface, (popup_x + 10, line_y))  # 10px padding from left 
\ No newline at end of file
+        # Calculate position for note popup (adjust for different positions)
+        popup_x = min(mouse_pos[0] + 15, GRID_WIDTH - popup.get_width() - 10)
+        popup_y = min(mouse_pos[1] + 15, GRID_HEIGHT - popup.get_height() - 5)
+        surface.blit(popup, (popup_x, popup_y))
+    
+    surface.set_clip(previous_clip)
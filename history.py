@@ -0,0 +1,173 @@
+"""Undo/redo history of grid and note edits.
+
+Every stroke, fill, paste or other operation is stored as one Delta: packed
+arrays of the changed cells with their old and new tile ids, plus any note
+changes. Undoing or redoing a delta is a single bulk grid write.
+"""
+from collections import deque
+from contextlib import contextmanager
+import numpy as np
+from settings import *
+from journal import EditJournal
+
+class Delta:
+    """The cells and notes changed by one operation"""
+
+    def __init__(self, label, xs, ys, old_values, new_values, note_changes):
+        self.label = label
+        self.xs = xs                    # int32 array of cell x coordinates
+        self.ys = ys                    # int32 array of cell y coordinates
+        self.old_values = old_values    # int8 array of tile ids before the operation
+        self.new_values = new_values    # int8 array of tile ids after the operation
+        self.note_changes = note_changes  # List of ((x, y), old text or None, new text or None)
+
+    @property
+    def nbytes(self):
+        """Approximate memory held by the delta"""
+        note_bytes = sum(64 + len(old or "") + len(new or "") for _, old, new in self.note_changes)
+        return self.xs.nbytes + self.ys.nbytes + self.old_values.nbytes + self.new_values.nbytes + note_bytes
+
+    def __len__(self):
+        return len(self.xs)
+
+class EditHistory:
+    """Undo and redo stacks of deltas, with the oldest deltas dropped past a memory limit.
+
+    Changes are recorded between begin() and the matching end(); nested groups
+    are merged into the outermost one. Changes recorded outside any group
+    become a delta of their own.
+    """
+
+    def __init__(self, memory_limit):
+        self.memory_limit = memory_limit
+        self.undo_stack = deque()
+        self.redo_stack = []
+        self.nbytes = 0  # Memory held by the undo and redo stacks
+        self.depth = 0   # Nesting depth of open groups
+        self._reset_group(None)
+
+    def _reset_group(self, label):
+        """Start collecting the changes of a new delta"""
+        self.label = label
+        self.cell_parts = []  # (xs, ys, old values, new values) arrays in the order they were written
+        self.note_changes = []
+
+    def begin(self, label):
+        """Open a group - everything recorded until the matching end() is one delta"""
+        if self.depth == 0:
+            self._reset_group(label)
+        self.depth += 1
+
+    def end(self):
+        """Close a group, pushing its delta once the outermost group is closed"""
+        if self.depth == 0:
+            return
+        self.depth -= 1
+        if self.depth == 0:
+            self._push_group()
+
+    @contextmanager
+    def group(self, label):
+        """Record everything inside a with block as one delta"""
+        self.begin(label)
+        try:
+            yield
+        finally:
+            self.end()
+
+    def record_cells(self, xs, ys, old_values, new_values):
+        """Record cells that were just written, skipping the ones that didn't change"""
+        new_values = np.broadcast_to(np.asarray(new_values, dtype=np.int8), old_values.shape)
+        changed = old_values != new_values
+        if not changed.any():
+            return
+        xs = np.asarray(xs, dtype=np.int32)[changed]
+        ys = np.asarray(ys, dtype=np.int32)[changed]
+        edit_journal.append_cells(xs, ys, new_values[changed])
+        self.begin(None)
+        self.cell_parts.append((xs, ys, old_values[changed], new_values[changed]))
+        self.end()
+
+    def record_note(self, pos, old_text, new_text):
+        """Record a note that was just added, changed or deleted (None means no note)"""
+        if old_text == new_text:
+            return
+        edit_journal.append_note(pos, new_text)
+        self.begin(None)
+        self.note_changes.append((pos, old_text, new_text))
+        self.end()
+
+    def _push_group(self):
+        """Pack the collected changes into a delta and put it on the undo stack"""
+        if not self.cell_parts and not self.note_changes:
+            return
+        if self.cell_parts:
+            xs, ys, old_values, new_values = (np.concatenate(arrays) for arrays in zip(*self.cell_parts))
+        else:
+            xs = ys = np.zeros(0, dtype=np.int32)
+            old_values = new_values = np.zeros(0, dtype=np.int8)
+        delta = Delta(self.label or "Edit", xs, ys, old_values, new_values, self.note_changes)
+        self._reset_group(None)
+
+        # A new edit makes the undone ones unreachable
+        for undone in self.redo_stack:
+            self.nbytes -= undone.nbytes
+        self.redo_stack.clear()
+
+        self.undo_stack.append(delta)
+        self.nbytes += delta.nbytes
+
+        # Forget the oldest edits once the history is over its memory limit
+        while self.nbytes > self.memory_limit and len(self.undo_stack) > 1:
+            self.nbytes -= self.undo_stack.popleft().nbytes
+
+    def undo(self):
+        """Revert the newest delta and return it, or None if there is nothing to undo"""
+        if self.depth or not self.undo_stack:
+            return None
+        delta = self.undo_stack.pop()
+
+        # Write the old values newest-first, so a cell written twice ends up with its first old value
+        grid.write_cells(delta.xs[::-1], delta.ys[::-1], delta.old_values[::-1])
+        edit_journal.append_cells(delta.xs[::-1], delta.ys[::-1], delta.old_values[::-1])
+        for pos, old_text, _ in reversed(delta.note_changes):
+            set_note_text(pos, old_text)
+            edit_journal.append_note(pos, old_text)
+
+        self.redo_stack.append(delta)
+        return delta
+
+    def redo(self):
+        """Re-apply the newest undone delta and return it, or None if there is nothing to redo"""
+        if self.depth or not self.redo_stack:
+            return None
+        delta = self.redo_stack.pop()
+        grid.write_cells(delta.xs, delta.ys, delta.new_values)
+        edit_journal.append_cells(delta.xs, delta.ys, delta.new_values)
+        for pos, _, new_text in delta.note_changes:
+            set_note_text(pos, new_text)
+            edit_journal.append_note(pos, new_text)
+
+        self.undo_stack.append(delta)
+        return delta
+
+    def clear(self):
+        """Forget all history, e.g. after loading a different map"""
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self.nbytes = 0
+        self.depth = 0
+        self._reset_group(None)
+
+def set_note_text(pos, text):
+    """Set the note at pos, or remove it if text is None"""
+    if text is None:
+        notes.pop(pos, None)
+    else:
+        notes[pos] = text
+
+# The history of the open map
+edit_history = EditHistory(HISTORY_MEMORY_LIMIT)
+
+# Every change to the open map, appended for crash recovery - recorded changes and undo/redo alike
+edit_journal = EditJournal(JOURNAL_FLUSH_MS)
@@ -0,0 +1,283 @@
+"""PNG export of a whole map, rendered in horizontal strips by a pool of worker processes.
+
+Each worker reads the map file itself, draws a strip of rows with the
+tile images the way the grid draws them (including note markers), and
+deflates the strip on its own. The parent writes the compressed strips
+into the PNG in order as they arrive, so no image larger than one strip is
+ever held in memory, however large the map is.
+
+Strips are compressed independently and joined into one zlib stream: each
+is a run of raw deflate blocks ending in a sync flush, the parent closes
+the stream with an empty final block, and the Adler-32 checksums of the
+strips are combined without seeing their data again.
+
+This module is loaded by every worker, so it only imports settings inside
+the functions the mapper itself calls; everything the workers need comes
+in through init_worker.
+"""
+import collections
+import multiprocessing
+import os
+import signal
+import struct
+import zlib
+import numpy as np
+import pygame
+from chunks import GridStore
+import json_format
+import map_format
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+IHDR = struct.Struct(">IIBBBBB")  # width, height, bit depth, colour type, compression, filter, interlace
+RGB_COLOR_TYPE = 2
+IDAT_MAX_BYTES = 1 << 20  # Compressed data is split into chunks of at most this size
+
+ZLIB_HEADER = b"\x78\x9c"  # Deflate with a 32K window
+FINAL_BLOCK = zlib.compressobj(wbits=-15).flush()  # An empty final deflate block, ending the stream
+ADLER_BASE = 65521
+
+def adler32_combine(adler1, adler2, length2):
+    """Return the Adler-32 of two pieces of data joined, from their checksums and the second one's length"""
+    remainder = length2 % ADLER_BASE
+    sum1 = adler1 & 0xFFFF
+    sum2 = (remainder * sum1) % ADLER_BASE
+    sum1 = (sum1 + (adler2 & 0xFFFF) + ADLER_BASE - 1) % ADLER_BASE
+    sum2 = (sum2 + (adler1 >> 16) + (adler2 >> 16) + ADLER_BASE - remainder) % ADLER_BASE
+    return sum1 | (sum2 << 16)
+
+class PngWriter:
+    """Writes an 8-bit RGB PNG whose image data arrives as already deflated pieces"""
+
+    def __init__(self, file, width, height):
+        self.file = file
+        self.adler = 1  # Adler-32 of no data
+        self.pending = bytearray(ZLIB_HEADER)
+        file.write(PNG_SIGNATURE)
+        self._write_chunk(b"IHDR", IHDR.pack(width, height, 8, RGB_COLOR_TYPE, 0, 0, 0))
+
+    def _write_chunk(self, kind, data):
+        self.file.write(struct.pack(">I", len(data)))
+        self.file.write(kind)
+        self.file.write(data)
+        self.file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind))))
+
+    def write_deflated(self, data, adler, length):
+        """Add raw deflate blocks ending in a sync flush, for length bytes of filtered rows with checksum adler"""
+        self.adler = adler32_combine(self.adler, adler, length)
+        self.pending += data
+        while len(self.pending) >= IDAT_MAX_BYTES:
+            self._write_chunk(b"IDAT", bytes(self.pending[:IDAT_MAX_BYTES]))
+            del self.pending[:IDAT_MAX_BYTES]
+
+    def close(self):
+        """Finish the zlib stream and the file"""
+        self.pending += FINAL_BLOCK + struct.pack(">I", self.adler)
+        self._write_chunk(b"IDAT", bytes(self.pending))
+        self._write_chunk(b"IEND", b"")
+        self.pending = bytearray()
+
+def map_bounds(map_path, chunk_size, fixed_cells):
+    """Return the (min x, min y, max x, max y) of every tile, note and fixed cell in a map file"""
+    grid, notes = read_map(map_path, chunk_size)
+    try:
+        xs = [x for x, _ in notes] + [x for x, _ in fixed_cells]
+        ys = [y for _, y in notes] + [y for _, y in fixed_cells]
+        keys = grid.chunk_keys()
+        if keys:
+            # Only the outermost chunks have to be decoded to find the outermost cells
+            min_cx = min(key[0] for key in keys)
+            max_cx = max(key[0] for key in keys)
+            min_cy = min(key[1] for key in keys)
+            max_cy = max(key[1] for key in keys)
+            for key in keys:
+                if key[0] not in (min_cx, max_cx) and key[1] not in (min_cy, max_cy):
+                    continue
+                chunk_ys, chunk_xs = np.nonzero(grid.chunk_array(key))
+                if len(chunk_xs):
+                    xs += [key[0] * chunk_size + int(chunk_xs.min()), key[0] * chunk_size + int(chunk_xs.max())]
+                    ys += [key[1] * chunk_size + int(chunk_ys.min()), key[1] * chunk_size + int(chunk_ys.max())]
+        if not xs:
+            return None
+        return min(xs), min(ys), max(xs), max(ys)
+    finally:
+        grid.clear()
+
+def read_map(map_path, chunk_size):
+    """Open a map file as a grid (decoding .dungeonb chunks only when asked) and a notes dict"""
+    grid = GridStore(chunk_size)
+    if map_format.is_binary_map(map_path):
+        map_file = map_format.MapFile(map_path)
+        notes = map_file.read_notes()
+        if map_file.chunk_size == chunk_size:
+            grid.add_lazy_chunks(map_file)
+        else:
+            for chunk_x, chunk_y in map_file.directory:
+                grid.write_region(chunk_x * map_file.chunk_size, chunk_y * map_file.chunk_size,
+                                  map_file.read_chunk((chunk_x, chunk_y)))
+            map_file.close()
+    else:
+        with open(map_path, 'r') as f:
+            notes = json_format.read_map(f, grid.write_cells).get("notes", {})
+    return grid, notes
+
+def export_setup(tiles, tile_size, level=6):
+    """Return what the workers need to draw a map with the mapper's tiles at tile_size pixels per cell.
+
+    Tile images are packed as tile id -> ("image", size, RGBA bytes), or
+    ("color", colour) for tiles without one. Like the grid's scaled images
+    they are one pixel larger than a tile, so neighbours overlap instead of
+    leaving gaps.
+    """
+    import settings
+    from tiles import get_scaled_image
+    from grid import note_marker_surface
+    
+    image_size = tile_size + 1
+    packed_tiles = {}
+    for tile_id, tile in tiles.items():
+        if tile.original_image:
+            image = get_scaled_image(tile, image_size)
+            packed_tiles[tile_id] = ("image", image_size, pygame.image.tostring(image, "RGBA"))
+        else:
+            packed_tiles[tile_id] = ("color", tuple(tile.color[:3]))
+    
+    marker = note_marker_surface(tile_size / settings.BASE_TILE_SIZE)
+    return {
+        "chunk_size": settings.CHUNK_SIZE,
+        "tile_size": tile_size,
+        "tiles": packed_tiles,
+        "marker": (marker.get_size(), pygame.image.tostring(marker, "RGBA")),
+        "fixed_cells": {(0, 0): settings.ENTRANCE},  # The entrance isn't stored in map files
+        "background": settings.BLACK,
+        "outline_color": settings.GRAY,
+        "unknown_color": settings.DARK_GRAY,
+        "level": level,
+    }
+
+# What the workers render, set by init_worker
+render_setup = None
+
+def init_worker(setup):
+    """Unpack the render setup in a worker process"""
+    global render_setup
+    # SDL, if the parent started it, turns SIGTERM into a quit event - the pool needs it to end workers
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    
+    images = {}
+    for tile_id, packed in setup["tiles"].items():
+        if packed[0] == "image":
+            _, size, data = packed
+            images[tile_id] = pygame.image.fromstring(data, (size, size), "RGBA")
+        else:
+            images[tile_id] = packed[1]
+    marker_size, marker_data = setup["marker"]
+    grid, notes = read_map(setup["map_path"], setup["chunk_size"])
+    render_setup = dict(setup, images=images, marker=pygame.image.fromstring(marker_data, marker_size, "RGBA"),
+                        grid=grid, notes=notes)
+
+def render_strip(strip):
+    """Draw rows first_y to last_y (inclusive) of the map and deflate them.
+
+    Returns (deflated data, Adler-32 of the filtered rows, their length).
+    """
+    first_y, last_y = strip
+    setup = render_setup
+    grid = setup["grid"]
+    tile_size = setup["tile_size"]
+    min_x, _, max_x, _ = setup["bounds"]
+    strip_width = (max_x - min_x + 1) * tile_size
+    strip_height = (last_y - first_y + 1) * tile_size
+    surface = pygame.Surface((strip_width, strip_height))
+    surface.fill(setup["background"])
+
+    # The row above is drawn too, since its tile images reach one pixel into this strip
+    cells = collections.defaultdict(list)  # tile id -> screen positions
+    for key in grid.chunks_in_rect(min_x, first_y - 1, max_x, last_y):
+        chunk = grid.chunk_array(key)
+        if chunk is None:
+            continue
+        chunk_ys, chunk_xs = np.nonzero(chunk)
+        ids = chunk[chunk_ys, chunk_xs]
+        xs = chunk_xs + key[0] * grid.chunk_size
+        ys = chunk_ys + key[1] * grid.chunk_size
+        rows = (ys >= first_y - 1) & (ys <= last_y)
+        for x, y, tile_id in zip(xs[rows].tolist(), ys[rows].tolist(), ids[rows].tolist()):
+            if (x, y) not in setup["fixed_cells"]:
+                cells[tile_id].append(((x - min_x) * tile_size, (y - first_y) * tile_size))
+    for (x, y), tile_id in setup["fixed_cells"].items():
+        if first_y - 1 <= y <= last_y and min_x <= x <= max_x:
+            cells[tile_id].append(((x - min_x) * tile_size, (y - first_y) * tile_size))
+
+    for tile_id, positions in cells.items():
+        image = setup["images"].get(tile_id)
+        if isinstance(image, pygame.Surface):
+            surface.blits([(image, position) for position in positions], doreturn=False)
+        else:
+            # Tiles without an image are filled with their colour and outlined, as on the grid
+            color = image if image is not None else setup["unknown_color"]
+            for position in positions:
+                tile_rect = pygame.Rect(position, (tile_size, tile_size))
+                surface.fill(color, tile_rect)
+                pygame.draw.rect(surface, setup["outline_color"], tile_rect, 1)
+
+    # 'N' markers in the top-left corner of notes
+    marker = setup["marker"]
+    surface.blits([(marker, ((x - min_x) * tile_size + 2, (y - first_y) * tile_size + 2))
+                   for (x, y) in setup["notes"] if first_y <= y <= last_y and min_x <= x <= max_x],
+                  doreturn=False)
+
+    # Filter type 0 (none) in front of every row, then deflate up to a byte-aligned sync flush
+    pixels = np.frombuffer(pygame.image.tostring(surface, "RGB"), dtype=np.uint8).reshape(strip_height, strip_width * 3)
+    rows = np.zeros((strip_height, strip_width * 3 + 1), dtype=np.uint8)
+    rows[:, 1:] = pixels
+    del surface, pixels
+    compressor = zlib.compressobj(setup["level"], zlib.DEFLATED, -15)
+    data = compressor.compress(rows) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    return data, zlib.adler32(rows), rows.nbytes
+
+def export_map(map_path, png_path, setup, strip_pixels, workers=None, progress=None):
+    """Render a map file to a PNG, returning its (width, height) in pixels, or None for an empty map.
+
+    setup comes from export_setup. Strips are as many rows as fit in
+    strip_pixels pixels. progress(done, total) is called after each strip.
+    """
+    setup = dict(setup, map_path=map_path)
+    bounds = map_bounds(map_path, setup["chunk_size"], setup["fixed_cells"])
+    if bounds is None:
+        return None
+    setup["bounds"] = bounds
+    min_x, min_y, max_x, max_y = bounds
+    tile_size = setup["tile_size"]
+    width = (max_x - min_x + 1) * tile_size
+    height = (max_y - min_y + 1) * tile_size
+
+    rows_per_strip = max(1, strip_pixels // (width * tile_size))
+    strips = [(y, min(y + rows_per_strip - 1, max_y)) for y in range(min_y, max_y + 1, rows_per_strip)]
+    workers = max(1, min(workers or os.cpu_count() or 1, len(strips)))
+
+    temp_path = png_path + ".saving"
+    pool = multiprocessing.Pool(workers, initializer=init_worker, initargs=(setup,))
+    try:
+        with open(temp_path, "wb") as f:
+            png = PngWriter(f, width, height)
+            # A few strips are queued ahead of the one being written, so the workers stay busy
+            # while finished strips waiting to be written stay few
+            queued = collections.deque()
+            next_strip = 0
+            for done in range(1, len(strips) + 1):
+                while next_strip < len(strips) and len(queued) < 2 * workers:
+                    queued.append(pool.apply_async(render_strip, (strips[next_strip],)))
+                    next_strip += 1
+                png.write_deflated(*queued.popleft().get())
+                if progress is not None:
+                    progress(done, len(strips))
+            png.close()
+        os.replace(temp_path, png_path)
+    except BaseException:
+        pool.terminate()
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    pool.close()
+    pool.join()
+    return width, height
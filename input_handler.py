@@ -3,7 +3,10 @@ import math
 import time
 from settings import *
 from tiles import grid_to_cell, screen_to_grid
-from file_io import save_map, load_map
+from file_io import save_map, load_map, export_image
+from fonts import TextLayout
+from tools import line_cells, paint_cells, set_cells, set_note, flood_fill, copy_region, clear_region, paste_region, move_region
+from history import edit_history
 
 # Additional drag tracking variables
 drag_active = False  # Flag to track if we're in an active drag
@@ -11,17 +14,38 @@ drag_start_x = 0     # Mouse X position when drag started
 drag_start_y = 0     # Mouse Y position when drag started
 last_drag_time = 0   # Time of the last drag update
 
+# Paint stroke tracking
+stroke_cell = None   # Last cell painted by the current left/right drag, None between strokes
+stroke_open = False  # Whether the current stroke is being recorded as an undo step
+
+# Fill tool variables
+fill_tile_id = WALL  # Tile poured by the fill tool - the last tile selected for painting
+
+# Selection tool variables (the selected rectangle itself is settings.selection)
+select_anchor = None  # Cell where the current selection drag started
+move_start = None     # Cell where the current move drag started
+move_from = None      # Selection rectangle before the current move drag
+clipboard = None      # RegionBuffer of the last copied or cut selection
+
 # Note editing variables
 editing_note = False  # Are we currently editing a note?
 editing_pos = None   # (x, y) position of the note being edited
 note_text = ""       # Current text for the note being edited
 
+# Word-wrapped prompt and note text, sized for the edit box drawn by main.draw_note_editor
+NOTE_PROMPT = "Note: "
+note_layout = TextLayout(24, GRID_WIDTH - 50)
+
 # Debug logging function
 def log_debug(message):
     """Print debug messages to console with timestamp"""
     current_time = time.strftime("%H:%M:%S", time.localtime())
     print(f"[{current_time}] {message}")
 
+def update_note_layout():
+    """Re-wrap the edit box text after note_text changed"""
+    note_layout.set_text(NOTE_PROMPT + note_text)
+
 def reset_note_editing():
     """Reset note editing state to avoid lingering states"""
     global editing_note, editing_pos, note_text
@@ -60,16 +84,17 @@ def handle_keyboard_input(keys, tiles, selected_tile_id, all_tiles):
         settings.status_message = "Centered on origin"
         settings.status_message_timer = 60  # 1 second at 60 FPS
     
-    # Handle hotkeys for tile selection
-    for tile_id, tile in all_tiles.items():
-        if tile.hotkey and keys[getattr(pygame, f'K_{tile.hotkey}')]:
-            selected_tile_id = tile_id
+    # Handle hotkeys for tile selection (not while Ctrl shortcuts like Ctrl+C are held)
+    if not pygame.key.get_mods() & (pygame.KMOD_CTRL | pygame.KMOD_META):
+        for tile_id, tile in all_tiles.items():
+            if tile.hotkey and keys[getattr(pygame, f'K_{tile.hotkey}')]:
+                selected_tile_id = tile_id
     
     # Return the (possibly) updated selected tile
     return selected_tile_id
 
-def handle_mouse_motion(event, palette_rect, selected_tile_id=None, tiles=None):
-    """Handle mouse movement events"""
+def handle_mouse_motion(events, palette_rect, selected_tile_id=None, tiles=None):
+    """Handle a batch of consecutive mouse movement events in one go"""
     global drag_active, drag_start_x, drag_start_y, last_drag_time
     # Import settings module to access its camera variables
     import settings
@@ -77,6 +102,9 @@ def handle_mouse_motion(event, palette_rect, selected_tile_id=None, tiles=None):
     # Skip normal interaction if we're editing a note
     if editing_note:
         return
+    
+    # Only the latest position matters for the cursor and camera panning
+    event = events[-1]
         
     # Set cursor appearance based on the selected tool
     if selected_tile_id == PIPETTE and event.pos[0] < GRID_WIDTH:
@@ -106,21 +134,97 @@ def handle_mouse_motion(event, palette_rect, selected_tile_id=None, tiles=None):
     # If the middle mouse button is not pressed anymore, end the drag
     elif drag_active and not pygame.mouse.get_pressed()[1]:
         drag_active = False
+    
+    # Stretching the selection rectangle or moving the selection
+    elif select_anchor is not None or move_from is not None:
+        update_selection_drag(event.pos)
         
     # Drawing with left or right mouse button held down
-    elif event.pos[0] < GRID_WIDTH:  # Only within grid area
-        # Left button down - paint tiles
-        if pygame.mouse.get_pressed()[0]:  # Left mouse button
-            handle_mouse_interaction(event.pos, 1, tiles, selected_tile_id)
-        # Right button down - erase tiles
-        elif pygame.mouse.get_pressed()[2]:  # Right mouse button
-            handle_mouse_interaction(event.pos, 3, tiles, None)
+    else:
+        paint_stroke(events, selected_tile_id)
+
+def paint_stroke(events, selected_tile_id):
+    """Paint (left button) or erase (right button) along the path of the motion events.
+
+    Consecutive positions are joined with Bresenham lines starting from the
+    last cell of the stroke, so fast drags leave no gaps, and the cells are
+    written to the grid in one bulk update per tile id.
+    """
+    global stroke_cell
+    import settings
+    
+    path = []          # Cells to write with the current tile id
+    path_tile = None   # Tile id being written along the path
+    entrance_hit = False
+    
+    for event in events:
+        # Only within grid area, only while painting or erasing, and not with the click-only tools
+        if event.pos[0] >= GRID_WIDTH or selected_tile_id in (FILL, SELECT):
+            stroke_cell = None
+            continue
+        if event.buttons[0] and selected_tile_id != PIPETTE:
+            tile_id = selected_tile_id  # Left button - paint tiles
+        elif event.buttons[2]:
+            tile_id = EMPTY  # Right button - erase tiles
+        else:
+            stroke_cell = None
+            continue
+        
+        # Painting that starts without a press in the grid still makes one undo step
+        start_stroke()
+        
+        # Switching between painting and erasing flushes the path so far
+        if tile_id != path_tile:
+            if path and not paint_cells(path, path_tile):
+                entrance_hit = True
+            path = []
+            path_tile = tile_id
+        
+        grid_x, grid_y = screen_to_grid(event.pos[0], event.pos[1])
+        cell = grid_to_cell(grid_x, grid_y)
+        if stroke_cell is None:
+            path.append(cell)
+        elif cell != stroke_cell:
+            path.extend(line_cells(stroke_cell[0], stroke_cell[1], cell[0], cell[1])[1:])
+        stroke_cell = cell
+    
+    if path and not paint_cells(path, path_tile):
+        entrance_hit = True
+    
+    # Check if the stroke crossed the entrance tile - it is left untouched
+    if entrance_hit:
+        settings.status_message = "Can't modify the entrance tile at (0,0)"
+        settings.status_message_timer = 180  # 3 seconds at 60 FPS
+
+def start_stroke():
+    """Start recording a paint stroke as one undo step, unless one is already open"""
+    global stroke_open
+    if not stroke_open:
+        edit_history.begin("Paint")
+        stroke_open = True
+
+def end_stroke():
+    """Finish the current paint stroke"""
+    global stroke_cell, stroke_open
+    stroke_cell = None
+    if stroke_open:
+        edit_history.end()
+        stroke_open = False
 
 def handle_mouse_button(event, tiles, selected_tile_id, palette_rect):
     """Handle mouse button events"""
-    global drag_active, drag_start_x, drag_start_y, last_drag_time, editing_note, editing_pos, note_text
+    global drag_active, drag_start_x, drag_start_y, last_drag_time, editing_note, editing_pos, note_text, stroke_cell
     import settings  # Import to access notes dictionary
     
+    # Releasing the paint or erase button ends the stroke
+    if event.type == pygame.MOUSEBUTTONUP and event.button in (1, 3):
+        end_stroke()
+    
+    # Releasing the left button finishes a selection drag, wherever the cursor is
+    if event.type == pygame.MOUSEBUTTONUP and event.button == 1 and (select_anchor or move_from):
+        finish_selection_drag()
+        return None
+    
     # Skip normal interaction if we're editing a note and this isn't a note confirmation
     if editing_note and event.button != 1:
         return
@@ -146,11 +250,10 @@ def handle_mouse_button(event, tiles, selected_tile_id, palette_rect):
         # If we're editing a note and this is a different position, save the current note first
         if editing_note and cell_pos != editing_pos and event.button == 1:
             if note_text.strip():  # Only save if there's actual text
-                settings.notes[editing_pos] = note_text
+                set_note(editing_pos, note_text)
                 settings.status_message = f"Note saved at ({editing_pos[0]}, {editing_pos[1]})"
             else:  # If empty text, remove the note
-                if editing_pos in settings.notes:
-                    del settings.notes[editing_pos]
+                set_note(editing_pos, None)
                 settings.status_message = f"Empty note deleted at ({editing_pos[0]}, {editing_pos[1]})"
             settings.status_message_timer = 60
             editing_note = False
@@ -158,9 +261,15 @@ def handle_mouse_button(event, tiles, selected_tile_id, palette_rect):
             note_text = ""
             return
         
+        # Selection tool - drag out a rectangle, or drag the selection to move it
+        if selected_tile_id == SELECT:
+            if event.type == pygame.MOUSEBUTTONDOWN:
+                start_selection_drag(cell_pos, event.button)
+            return None
+        
         # Handle right-click to delete notes
         if event.button == 3 and cell_pos in settings.notes:
-            del settings.notes[cell_pos]
+            set_note(cell_pos, None)
             settings.status_message = f"Note deleted at ({cell_x}, {cell_y})"
             settings.status_message_timer = 60
             return
@@ -175,6 +284,7 @@ def handle_mouse_button(event, tiles, selected_tile_id, palette_rect):
             editing_note = True
             editing_pos = cell_pos
             note_text = settings.notes.get(cell_pos, "")  # Get existing text or empty string
+            update_note_layout()
             
             # Make status message more visible and clear
             settings.status_message = f"EDITING NOTE at ({cell_x}, {cell_y}) - Type your text and press ENTER to save"
@@ -182,6 +292,16 @@ def handle_mouse_button(event, tiles, selected_tile_id, palette_rect):
             
             return
         
+        # Dragging from here continues the stroke from this cell
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            if selected_tile_id not in (PIPETTE, FILL):
+                start_stroke()
+            stroke_cell = cell_pos
+        
+        # Fill only on press - filling again on release would find nothing left to fill
+        elif selected_tile_id == FILL:
+            return None
+        
         # If we're not handling notes specifically, proceed with normal interaction
         picked_tile = handle_mouse_interaction(event.pos, event.button, tiles, selected_tile_id)
         if picked_tile is not None:
@@ -215,11 +335,7 @@ def handle_mousewheel(event):
     old_zoom = settings.zoom_level
     
     # Calculate new zoom level
-    new_zoom = old_zoom
-    if zoom_in:  # Zoom in
-        new_zoom = min(settings.MAX_ZOOM, old_zoom + settings.ZOOM_STEP)
-    else:  # Zoom out
-        new_zoom = max(settings.MIN_ZOOM, old_zoom - settings.ZOOM_STEP)
+    new_zoom = settings.step_zoom(old_zoom, zoom_in)
     
     # If zoom level didn't change, exit early
     if new_zoom == old_zoom:
@@ -280,16 +396,151 @@ def handle_mouse_interaction(pos, button, tiles, selected_tile_id):
             settings.status_message_timer = 120
             return None
             
+    # Fill tool - left click pours the fill tile, right click erases the whole area
+    if selected_tile_id == FILL:
+        fill_area(cell_x, cell_y, fill_tile_id if button == 1 else EMPTY)
+        return None
+            
     # Left click - place selected tile
     elif button == 1:
-        grid[(cell_x, cell_y)] = selected_tile_id
+        paint_cells([(cell_x, cell_y)], selected_tile_id)
     # Right click - remove tile (set to empty)
     elif button == 3:
         if (cell_x, cell_y) in grid:
-            grid[(cell_x, cell_y)] = EMPTY
+            paint_cells([(cell_x, cell_y)], EMPTY)
             
     return None
 
+def fill_area(cell_x, cell_y, tile_id):
+    """Flood fill the area of same tiles around a cell with tile_id in one bulk update"""
+    import settings
+    
+    # Filling an area with the tile it already holds changes nothing
+    if grid.get((cell_x, cell_y), EMPTY) == tile_id:
+        return
+    
+    cells = flood_fill(cell_x, cell_y, FILL_MAX_CELLS)
+    if cells is None:
+        settings.status_message = f"Area too large to fill (over {FILL_MAX_CELLS} tiles)"
+        settings.status_message_timer = 180  # 3 seconds at 60 FPS
+        return
+    
+    xs, ys = cells
+    with edit_history.group("Fill"):
+        set_cells(xs, ys, tile_id)
+    settings.status_message = f"Filled {len(xs)} tiles"
+    settings.status_message_timer = 120  # 2 seconds at 60 FPS
+
+def start_selection_drag(cell_pos, button):
+    """Start selecting a rectangle, or start moving the selection if the press is inside it"""
+    global select_anchor, move_start, move_from
+    import settings
+    
+    # Right click drops the selection
+    if button == 3:
+        settings.selection = None
+        return
+    
+    selection = settings.selection
+    if selection and selection[0] <= cell_pos[0] <= selection[2] and selection[1] <= cell_pos[1] <= selection[3]:
+        move_start = cell_pos
+        move_from = selection
+    else:
+        select_anchor = cell_pos
+        settings.selection = (cell_pos[0], cell_pos[1], cell_pos[0], cell_pos[1])
+
+def update_selection_drag(pos):
+    """Stretch the selection to the cell under pos, or slide it along when moving"""
+    import settings
+    
+    # Keep following the cursor when it strays over the palette
+    grid_x, grid_y = screen_to_grid(min(pos[0], GRID_WIDTH - 1), pos[1])
+    cell_x, cell_y = grid_to_cell(grid_x, grid_y)
+    
+    if select_anchor is not None:
+        settings.selection = (min(select_anchor[0], cell_x), min(select_anchor[1], cell_y),
+                              max(select_anchor[0], cell_x), max(select_anchor[1], cell_y))
+    else:
+        dx = cell_x - move_start[0]
+        dy = cell_y - move_start[1]
+        settings.selection = (move_from[0] + dx, move_from[1] + dy, move_from[2] + dx, move_from[3] + dy)
+
+def finish_selection_drag():
+    """Apply a finished selection drag - moving the tiles if the selection was dragged"""
+    global select_anchor, move_start, move_from
+    import settings
+    
+    min_x, min_y, max_x, max_y = settings.selection
+    if move_from is not None:
+        dx = min_x - move_from[0]
+        dy = min_y - move_from[1]
+        if dx or dy:
+            move_region(*move_from, dx, dy)
+            settings.status_message = f"Moved selection by ({dx}, {dy})"
+            settings.status_message_timer = 120  # 2 seconds at 60 FPS
+    else:
+        settings.status_message = f"Selected {max_x - min_x + 1}x{max_y - min_y + 1} tiles - Ctrl+C/X/V, Delete, or drag to move"
+        settings.status_message_timer = 180  # 3 seconds at 60 FPS
+    
+    select_anchor = None
+    move_start = None
+    move_from = None
+
+def handle_selection_key(key):
+    """Copy, cut, paste, delete or drop the selection. Returns True if the key was used"""
+    global clipboard
+    import settings
+    
+    selection = settings.selection
+    
+    # Paste with the top-left corner at the cell under the mouse, and select the pasted tiles
+    if key == pygame.K_v:
+        if clipboard is None:
+            settings.status_message = "Nothing to paste"
+        else:
+            mouse_pos = pygame.mouse.get_pos()
+            cell_x, cell_y = grid_to_cell(*screen_to_grid(min(mouse_pos[0], GRID_WIDTH - 1), mouse_pos[1]))
+            paste_region(clipboard, cell_x, cell_y)
+            settings.selection = (cell_x, cell_y, cell_x + clipboard.width - 1, cell_y + clipboard.height - 1)
+            settings.status_message = f"Pasted {clipboard.width}x{clipboard.height} tiles at ({cell_x}, {cell_y})"
+        settings.status_message_timer = 120  # 2 seconds at 60 FPS
+        return True
+    
+    if selection is None:
+        return False
+    
+    if key == pygame.K_ESCAPE:
+        settings.selection = None
+        return True
+    
+    if key in (pygame.K_c, pygame.K_x):
+        clipboard = copy_region(*selection)
+    if key in (pygame.K_x, pygame.K_DELETE):
+        with edit_history.group("Cut" if key == pygame.K_x else "Delete"):
+            clear_region(*selection)
+    
+    action = {pygame.K_c: "Copied", pygame.K_x: "Cut", pygame.K_DELETE: "Deleted"}[key]
+    settings.status_message = f"{action} {selection[2] - selection[0] + 1}x{selection[3] - selection[1] + 1} tiles"
+    settings.status_message_timer = 120  # 2 seconds at 60 FPS
+    return True
+
+def undo_redo(redo):
+    """Undo the last edit, or redo the last undone one, and say what happened"""
+    import settings
+    
+    # A stroke still being painted is finished first so it can be undone as a whole
+    end_stroke()
+    
+    delta = edit_history.redo() if redo else edit_history.undo()
+    if delta is None:
+        settings.status_message = "Nothing to redo" if redo else "Nothing to undo"
+    else:
+        action = "Redid" if redo else "Undid"
+        settings.status_message = f"{action} {delta.label.lower()}"
+        if len(delta):
+            settings.status_message += f" ({len(delta)} tiles)"
+    settings.status_message_timer = 120  # 2 seconds at 60 FPS
+
 def check_keys_modifiers(event, all_tiles=None):
     """Check for keyboard shortcuts with modifiers"""
     global editing_note, note_text, editing_pos
@@ -300,18 +551,18 @@ def check_keys_modifiers(event, all_tiles=None):
         # Check for backspace
         if event.key == pygame.K_BACKSPACE:
             note_text = note_text[:-1]
+            update_note_layout()
             return True
             
         # Check for Enter key to finish editing
         if event.key == pygame.K_RETURN or event.key == pygame.K_KP_ENTER:
             # Save the note if there's text
             if note_text.strip():
-                settings.notes[editing_pos] = note_text
+                set_note(editing_pos, note_text)
                 settings.status_message = f"NOTE SAVED at ({editing_pos[0]}, {editing_pos[1]})"
             else:
                 # If empty text, remove the note
-                if editing_pos in settings.notes:
-                    del settings.notes[editing_pos]
+                set_note(editing_pos, None)
                 settings.status_message = f"Empty note deleted at ({editing_pos[0]}, {editing_pos[1]})"
             
             settings.status_message_timer = 180  # 3 seconds at 60 FPS
@@ -331,6 +582,7 @@ def check_keys_modifiers(event, all_tiles=None):
         # Add normal characters to note
         if event.unicode and len(event.unicode) == 1 and ord(event.unicode) >= 32:
             note_text += event.unicode
+            update_note_layout()
             return True
             
         return True  # Block further key processing when editing
@@ -338,6 +590,17 @@ def check_keys_modifiers(event, all_tiles=None):
     # Check if ctrl key is pressed
     ctrl_pressed = pygame.key.get_mods() & (pygame.KMOD_CTRL | pygame.KMOD_META)
     
+    # Ctrl+Z undo, Ctrl+Y or Ctrl+Shift+Z redo
+    if ctrl_pressed and event.key in (pygame.K_z, pygame.K_y):
+        redo = event.key == pygame.K_y or pygame.key.get_mods() & pygame.KMOD_SHIFT
+        undo_redo(redo)
+        return True
+    
+    # Selection shortcuts - Ctrl+C copy, Ctrl+X cut, Ctrl+V paste, Delete erase, Escape deselect
+    if (ctrl_pressed and event.key in (pygame.K_c, pygame.K_x, pygame.K_v)) or \
+            event.key in (pygame.K_DELETE, pygame.K_ESCAPE):
+        return handle_selection_key(event.key)
+    
     # Ctrl+S for save
     if ctrl_pressed and event.key == pygame.K_s:
         save_map(grid, (camera_x, camera_y), zoom_level)
@@ -347,5 +610,10 @@ def check_keys_modifiers(event, all_tiles=None):
     if ctrl_pressed and event.key == pygame.K_l:
         load_map(all_tiles)  # Pass the tiles parameter
         return True
+    
+    # Ctrl+E to export the map as an image
+    if ctrl_pressed and event.key == pygame.K_e:
+        export_image(grid, all_tiles)
+        return True
         
     return False 
\ No newline at end of file
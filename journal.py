@@ -0,0 +1,262 @@
+"""Append-only journal of grid and note edits, kept next to the map file.
+
+Every recorded edit is appended as a small binary record, so after a crash
+the map is rebuilt by replaying the journal on top of the last full save.
+Records are collected in memory and written and fsynced in batches by a
+background thread, so journaling an edit costs a few microseconds.
+
+Layout, all little-endian:
+
+    header    magic, version, size and mtime of the base map file, snapshot length
+    snapshot  optional complete .dungeonb image that replaces the base map
+    records   cell writes and note changes, in the order they happened
+
+The base map's size and mtime tell which save the journal applies to.
+Compaction rewrites the journal as a snapshot of the whole map followed by
+only the records made since, and swaps it in with an atomic rename.
+"""
+import os
+import struct
+import threading
+import numpy as np
+
+MAGIC = b"DJOURNAL"
+VERSION = 1
+
+HEADER = struct.Struct("<8sHqqQ")  # magic, version, base map size, base map mtime (ns), snapshot length
+CELLS_RECORD = struct.Struct("<BI")  # record type, cell count - then int32 xs, int32 ys and int8 tile ids
+NOTE_RECORD = struct.Struct("<BiiI")  # record type, x, y, UTF-8 text length - then the text
+NOTE_DELETE_RECORD = struct.Struct("<Bii")  # record type, x, y
+
+# Record types
+CELLS = 1
+NOTE = 2
+NOTE_DELETE = 3
+
+NO_BASE = (-1, -1)  # Base of the journal of a map that has never been saved
+
+def file_identity(path):
+    """Return the (size, mtime in ns) of a file, which change whenever it is saved"""
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+def read_journal(path):
+    """Read a journal file.
+
+    Returns (base identity, snapshot bytes or None, records, valid length).
+    Records are (CELLS, xs, ys, tile ids) or (NOTE, (x, y), text or None).
+    A record cut off by a crash ends the journal; valid length is where the
+    last whole record ends.
+    """
+    with open(path, "rb") as file:
+        data = file.read()
+    if len(data) < HEADER.size:
+        raise ValueError("Truncated edit journal")
+    magic, version, base_size, base_mtime, snapshot_length = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not an edit journal")
+    if version > VERSION:
+        raise ValueError(f"Edit journal version {version} is newer than this program supports")
+
+    offset = HEADER.size
+    snapshot = None
+    if snapshot_length:
+        snapshot = data[offset:offset + snapshot_length]
+        if len(snapshot) != snapshot_length:
+            raise ValueError("Truncated edit journal snapshot")
+        offset += snapshot_length
+
+    records = []
+    end = len(data)
+    while offset < end:
+        kind = data[offset]
+        if kind == CELLS and offset + CELLS_RECORD.size <= end:
+            _, count = CELLS_RECORD.unpack_from(data, offset)
+            start = offset + CELLS_RECORD.size
+            stop = start + 9 * count
+            if stop > end:
+                break
+            xs = np.frombuffer(data, dtype="<i4", count=count, offset=start)
+            ys = np.frombuffer(data, dtype="<i4", count=count, offset=start + 4 * count)
+            values = np.frombuffer(data, dtype=np.int8, count=count, offset=start + 8 * count)
+            records.append((CELLS, xs, ys, values))
+        elif kind == NOTE and offset + NOTE_RECORD.size <= end:
+            _, x, y, length = NOTE_RECORD.unpack_from(data, offset)
+            start = offset + NOTE_RECORD.size
+            stop = start + length
+            if stop > end:
+                break
+            records.append((NOTE, (x, y), data[start:stop].decode("utf-8")))
+        elif kind == NOTE_DELETE and offset + NOTE_DELETE_RECORD.size <= end:
+            _, x, y = NOTE_DELETE_RECORD.unpack_from(data, offset)
+            stop = offset + NOTE_DELETE_RECORD.size
+            records.append((NOTE, (x, y), None))
+        else:
+            break  # A torn write at the end
+        offset = stop
+    return (base_size, base_mtime), snapshot, records, offset
+
+class EditJournal:
+    """The journal file of the open map, appended to from a memory buffer.
+
+    A background thread writes and fsyncs the buffer every flush_ms. Nothing
+    is recorded while no journal is open.
+    """
+
+    def __init__(self, flush_ms):
+        self.flush_interval = flush_ms / 1000
+        self.lock = threading.Lock()     # Guards the buffers and size, held only briefly
+        self.io_lock = threading.Lock()  # Guards the file, held while writing and fsyncing
+        self.path = None
+        self.file = None
+        self.base = NO_BASE
+        self.buffer = bytearray()  # Records not written to the file yet
+        self.carried = None        # Records made since a rotation began, for the journal that replaces this one
+        self.size = 0              # Bytes in the journal, written or not
+        self.unsynced = False      # Whether bytes were written since the last fsync
+        self.flusher = None
+        self.stop_flushing = threading.Event()
+
+    def create(self, path, base):
+        """Start a new, empty journal for the base map at path, replacing any old one"""
+        self.close()
+        self._write_journal(path + ".new", base, b"", b"")
+        os.replace(path + ".new", path)
+        self._open(path, base, "ab")
+
+    def resume(self, path, base, length):
+        """Keep appending to an existing journal, dropping anything after its first length bytes"""
+        self.close()
+        self._open(path, base, "r+b")
+        self.file.truncate(length)
+        self.file.seek(length)
+        self.size = length
+
+    def _open(self, path, base, mode):
+        self.path = path
+        self.base = base
+        self.file = open(path, mode)
+        self.size = os.path.getsize(path)
+        self.stop_flushing.clear()
+        self.flusher = threading.Thread(target=self._flush_loop, name="journal_flush", daemon=True)
+        self.flusher.start()
+
+    def _write_journal(self, path, base, snapshot, records):
+        """Write and fsync a complete journal file, to be renamed into place"""
+        with open(path, "wb") as file:
+            file.write(HEADER.pack(MAGIC, VERSION, base[0], base[1], len(snapshot)))
+            file.write(snapshot)
+            file.write(records)
+            file.flush()
+            os.fsync(file.fileno())
+
+    def _flush_loop(self):
+        while not self.stop_flushing.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Write and fsync the buffered records"""
+        with self.io_lock:
+            if self.file is None:
+                return
+            with self.lock:
+                records = self.buffer
+                self.buffer = bytearray()
+            if records:
+                self.file.write(records)
+                self.unsynced = True
+            if self.unsynced:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.unsynced = False
+
+    def close(self):
+        """Flush and close the journal, leaving its file for the next time the map is opened"""
+        if self.file is None:
+            return
+        self.stop_flushing.set()
+        self.flusher.join()
+        self.flush()
+        with self.io_lock:
+            self.file.close()
+            self.file = None
+            self.path = None
+            self.base = NO_BASE
+            self.size = 0
+        with self.lock:
+            self.buffer = bytearray()
+            self.carried = None
+
+    def _append(self, record):
+        with self.lock:
+            self.buffer += record
+            self.size += len(record)
+            if self.carried is not None:
+                self.carried += record
+
+    def append_cells(self, xs, ys, values):
+        """Record that the cells in the xs, ys arrays were set to values"""
+        if self.file is None or not len(xs):
+            return
+        self._append(CELLS_RECORD.pack(CELLS, len(xs))
+                     + np.asarray(xs, dtype="<i4").tobytes()
+                     + np.asarray(ys, dtype="<i4").tobytes()
+                     + np.broadcast_to(np.asarray(values, dtype=np.int8), np.shape(xs)).tobytes())
+
+    def append_note(self, pos, text):
+        """Record that the note at pos was set to text, or deleted if text is None"""
+        if self.file is None:
+            return
+        if text is None:
+            self._append(NOTE_DELETE_RECORD.pack(NOTE_DELETE, pos[0], pos[1]))
+        else:
+            encoded = text.encode("utf-8")
+            self._append(NOTE_RECORD.pack(NOTE, pos[0], pos[1], len(encoded)) + encoded)
+
+    def begin_rotation(self):
+        """Start keeping the records made from now on for a journal that will replace this one.
+
+        Called together with taking a snapshot of the map, which holds every
+        edit recorded before it. Returns the rotation to pass to
+        finish_rotation or abort_rotation.
+        """
+        with self.lock:
+            self.carried = bytearray()
+            return self.carried
+
+    def finish_rotation(self, rotation, path, base, snapshot=b""):
+        """Replace the journal with one at path for the base map (plus snapshot) holding the carried records.
+
+        Runs on a worker thread once the snapshot taken at begin_rotation has
+        been saved, either as the map file itself or as the snapshot bytes.
+        Does nothing if the journal was closed or rotated again meanwhile.
+        """
+        with self.lock:
+            if self.carried is not rotation:
+                return
+            carried = bytes(rotation)
+        self._write_journal(path + ".new", base, snapshot, carried)
+
+        with self.io_lock:
+            with self.lock:
+                if self.carried is not rotation:
+                    os.remove(path + ".new")
+                    return
+                # Records made while the new journal was written still have to go into it
+                self.buffer = rotation[len(carried):]
+                self.carried = None
+                self.size = HEADER.size + len(snapshot) + len(rotation)
+            os.replace(path + ".new", path)
+            self.file.close()
+            if self.path != path and os.path.exists(self.path):
+                os.remove(self.path)  # Its edits are all in the new map file
+            self.file = open(path, "ab")
+            self.path = path
+            self.base = base
+            self.unsynced = False
+
+    def abort_rotation(self, rotation):
+        """Keep the current journal after the snapshot of a rotation could not be saved"""
+        with self.lock:
+            if self.carried is rotation:
+                self.carried = None
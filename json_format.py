@@ -0,0 +1,249 @@
+"""JSON map format (.dungeon) reader.
+
+Grid and note keys are written as "(x, y)" strings. They are parsed with
+precompiled regular expressions and NumPy instead of eval, which compiled a
+Python expression per cell and would run anything placed in a shared map.
+
+read_map can stream the "grid" object: the file is read in blocks and every
+block of cells is handed to the grid as arrays, so the whole JSON tree and a
+dict of every cell never have to be held in memory at once.
+"""
+import json
+import re
+import numpy as np
+
+# One "(x, y)" cell key
+CELL_KEY = re.compile(r"\(\s*(-?\d+)\s*,\s*(-?\d+)\s*\)")
+
+# One "(x, y)": tile id entry of the grid object and the comma after it
+GRID_ENTRY = re.compile(r'\s*"\(\s*(-?\d+)\s*,\s*(-?\d+)\s*\)"\s*:\s*(-?\d+)\s*,\s*')
+
+# What a space-joined key and a grid entry look like as written by save_map, once the
+# digits and minus signs are deleted - text matching them is split without a regex
+KEY_SKELETON = "(, ) "
+ENTRY_SKELETON = '"(, )": , '
+NUMBER_CHARS = str.maketrans("", "", "-0123456789")
+
+# Punctuation that is blanked out so only the numbers of keys and entries remain
+KEY_PUNCTUATION = str.maketrans('"():,', "     ")
+
+WHITESPACE = re.compile(r"\s*")
+
+# Characters that can follow a prefix of a JSON number; "" stands for the end of the text
+NUMBER_TAIL_CHARS = ("", ".", "e", "E", "+", "-", "0", "1", "2", "3", "4", "5", "6", "7", "8", "9")
+
+# Powers of ten up to the 18 digits that always fit in an int64
+POWERS_OF_TEN = 10 ** np.arange(19, dtype=np.int64)
+
+def parse_integers(text):
+    """Return the space-separated integers of text as an int64 array.
+
+    The characters are parsed with NumPy, one decimal place of every number
+    at a time. Raises ValueError unless text is only integers of up to 18
+    digits, each with an optional leading minus sign, and spaces.
+    """
+    chars = np.frombuffer(text.encode("ascii"), dtype=np.uint8)
+    digits = chars - ord("0")  # Wraps around for other characters, so they aren't < 10
+    is_digit = digits < 10
+    is_minus = chars == ord("-")
+    is_space = chars == ord(" ")
+    if not np.all(is_digit | is_minus | is_space):
+        raise ValueError("Not a list of integers")
+    
+    # Every number runs from a non-space after a space (or the start) to the last non-space before one
+    first_chars = ~is_space
+    first_chars[1:] &= is_space[:-1]
+    last_chars = ~is_space
+    last_chars[:-1] &= is_space[1:]
+    starts = np.flatnonzero(first_chars)
+    lasts = np.flatnonzero(last_chars)
+    negative = is_minus[starts]
+    lengths = lasts + 1 - starts - negative
+    if not len(starts):
+        return np.zeros(0, dtype=np.int64)
+    if np.count_nonzero(is_minus) != np.count_nonzero(negative) or not 1 <= lengths.min() <= lengths.max() <= 18:
+        raise ValueError("Not a list of integers")
+    
+    # Add each decimal place to the numbers that have that many digits
+    numbers = digits[lasts].astype(np.int64)
+    longer = np.arange(len(numbers))
+    for place in range(1, int(lengths.max())):
+        longer = longer[lengths[longer] > place]
+        numbers[longer] += digits[lasts[longer] - place] * POWERS_OF_TEN[place]
+    numbers[negative] *= -1
+    return numbers
+
+def split_numbers(text, skeleton, numbers_per_item):
+    """Return the numbers of text as an (items, numbers_per_item) int64 array.
+
+    This is the fast path for text that is nothing but repeats of skeleton
+    with numbers filled in; anything else returns None so the caller can
+    fall back to a regular expression.
+    """
+    punctuation = text.translate(NUMBER_CHARS)
+    items = len(punctuation) // len(skeleton)
+    if punctuation != skeleton * items:
+        return None
+    try:
+        numbers = parse_integers(text.translate(KEY_PUNCTUATION))
+    except ValueError:
+        return None  # Minus signs in the wrong place, or a number too long
+    if len(numbers) != items * numbers_per_item:
+        return None
+    return numbers.reshape(items, numbers_per_item)
+
+def to_int64(numbers):
+    """Convert a list of numbers (or of tuples of them) to an int64 array, raising ValueError if one is too large"""
+    try:
+        return np.array(numbers, dtype=np.int64)
+    except OverflowError:
+        raise ValueError("Number too large in the JSON map") from None
+
+def parse_cell_key(key):
+    """Return the (x, y) tuple of one "(x, y)" key"""
+    match = CELL_KEY.fullmatch(key)
+    if match is None:
+        raise ValueError(f"Invalid cell key: {key!r}")
+    return int(match[1]), int(match[2])
+
+def parse_cell_keys(keys):
+    """Return (xs, ys) int64 arrays for a list of "(x, y)" keys, parsing them all at once"""
+    positions = split_numbers(" ".join(keys) + " ", KEY_SKELETON, 2)
+    if positions is None or len(positions) != len(keys):
+        # Keys with unusual spacing are parsed one at a time
+        positions = to_int64([parse_cell_key(key) for key in keys]).reshape(-1, 2)
+    return positions[:, 0], positions[:, 1]
+
+def parse_notes(notes):
+    """Convert a notes object with "(x, y)" keys to (x, y) -> text"""
+    xs, ys = parse_cell_keys(list(notes))
+    return dict(zip(zip(xs.tolist(), ys.tolist()), notes.values()))
+
+def read_map(file, write_cells, stream=True, block_chars=1 << 20):
+    """Read a JSON map from an open text file.
+
+    The cells of the "grid" object are passed to write_cells(xs, ys, values)
+    as arrays - in blocks of about block_chars characters of the file when
+    streaming, or all at once after json.load otherwise. Returns the other
+    top-level values, with "notes" keyed by (x, y) tuples.
+    """
+    if stream:
+        map_data = JsonMapStream(file, block_chars).read(write_cells)
+    else:
+        map_data = json.load(file)
+        grid_data = map_data.pop("grid", {})
+        xs, ys = parse_cell_keys(list(grid_data))
+        values = list(grid_data.values())
+        if not all(type(value) is int for value in values):
+            raise ValueError("Invalid tile id in the JSON map")
+        write_cells(xs, ys, to_int64(values))
+
+    if "notes" in map_data:
+        map_data["notes"] = parse_notes(map_data["notes"])
+    return map_data
+
+class JsonMapStream:
+    """Incremental reader for the top-level object of a JSON map"""
+
+    def __init__(self, file, block_chars):
+        self.file = file
+        self.block_chars = block_chars
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def read_more(self):
+        """Append the next block of the file to the unread text, returning False at the end of the file"""
+        block = self.file.read(self.block_chars)
+        if not block:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + block
+        self.pos = 0
+        return True
+
+    def next_char(self):
+        """Skip whitespace and return the next character, or "" at the end of the file"""
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or not self.read_more():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, char):
+        if self.next_char() != char:
+            raise ValueError(f"Expected {char!r} at offset {self.pos} of the JSON map")
+        self.pos += 1
+
+    def read_value(self):
+        """Decode one complete JSON value, reading more of the file until it is whole"""
+        self.next_char()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.read_more():
+                    continue
+                raise
+            # A number cut off by the end of the text (even at "-7." or "1e") may continue in the next block
+            cut_off = self.buffer[end:end + 1] in NUMBER_TAIL_CHARS
+            if not cut_off or self.eof or not self.read_more():
+                self.pos = end
+                return value
+
+    def read(self, write_cells):
+        """Read the top-level object, streaming its "grid" into write_cells"""
+        map_data = {}
+        self.expect("{")
+        if self.next_char() == "}":
+            return map_data
+        while True:
+            key = self.read_value()
+            self.expect(":")
+            if key == "grid":
+                self.read_grid(write_cells)
+            else:
+                map_data[key] = self.read_value()
+            if self.next_char() == "}":
+                return map_data
+            self.expect(",")
+
+    def read_grid(self, write_cells):
+        """Read the "grid" object a block at a time, writing each block's cells"""
+        self.expect("{")
+        while True:
+            # Keys and values hold no braces, so the first one closes the object
+            close = self.buffer.find("}", self.pos)
+            if close >= 0:
+                last_entries = self.buffer[self.pos:close]
+                if last_entries.strip():
+                    self.write_entries(last_entries + ", ", write_cells)
+                self.pos = close + 1
+                return
+
+            # Otherwise take every entry before the last key that has started
+            last_key = self.buffer.rfind('"(', self.pos)
+            if last_key > self.pos:
+                self.write_entries(self.buffer[self.pos:last_key], write_cells)
+                self.pos = last_key
+            if not self.read_more():
+                raise ValueError("Unterminated grid object in the JSON map")
+
+    def write_entries(self, text, write_cells):
+        """Parse a run of comma-terminated "(x, y)": tile id entries and write them"""
+        if text.isspace():
+            return
+        entries = split_numbers(text, ENTRY_SKELETON, 3)
+        if entries is None:
+            # Entries with unusual spacing are matched one at a time
+            entries = []
+            pos = 0
+            while pos < len(text):
+                match = GRID_ENTRY.match(text, pos)
+                if match is None:
+                    raise ValueError("Invalid grid entry in the JSON map")
+                entries.append(match.groups())
+                pos = match.end()
+            entries = to_int64(entries).reshape(-1, 3)
+        if len(entries):
+            write_cells(entries[:, 0], entries[:, 1], entries[:, 2])
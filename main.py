@@ -1,9 +1,20 @@
 #!/usr/bin/env python3
-import pygame
+import time
+
+# When main.py started running, the start of the startup report
+startup_start = time.perf_counter()
+
 import sys
 import os
+
+# pygame finds its data files (like the default font) with pkg_resources if it can be
+# imported, which takes over 100 ms - without it pygame reads them from its own folder
+sys.modules.setdefault("pkg_resources", None)
+
+import pygame
+import settings
 from settings import *
-from tiles import load_tiles, set_entrance_tile, grid_to_cell
+from tiles import load_tiles, set_entrance_tile, grid_to_cell, screen_to_grid, warm_scaled_image_cache
 from ui import (
     draw_coordinates, 
     draw_status_message, 
@@ -13,7 +24,12 @@ from ui import (
     handle_palette_click
 )
 from grid import draw_grid
-from file_io import save_map, load_map
+from fonts import get_font, render_text
+from file_io import save_map, load_map, finish_saving, open_journal, compact_journal
+from history import edit_journal
+from browser import file_browser
+from render_cache import build_color_table
+import input_handler
 from input_handler import (
     handle_keyboard_input, 
     handle_mouse_motion, 
@@ -26,38 +42,34 @@ from input_handler import (
     editing_pos
 )
 
-def wrap_text(text, font, max_width):
-    """Helper function to wrap text to a maximum width"""
-    words = text.split()
-    wrapped_lines = []
-    current_line = ""
-    
-    for word in words:
-        # Try adding the next word
-        test_line = current_line + word + " "
-        # Check if it would be too wide
-        width, _ = font.size(test_line)
-        
-        if width <= max_width:
-            current_line = test_line  # Still fits, keep going
-        else:
-            if current_line:  # If we have text for this line, add it
-                wrapped_lines.append(current_line)
-                current_line = word + " "  # Start a new line with this word
-            else:
-                # Word is too long for the whole line, force add it
-                wrapped_lines.append(word + " ")
-                current_line = ""
-    
-    # Add the last line if it has content
-    if current_line:
-        wrapped_lines.append(current_line)
-    
-    # If there are no lines (empty note), create an empty line
-    if not wrapped_lines:
-        wrapped_lines = [""]
-        
-    return wrapped_lines
+# (phase, time it ended) for each startup phase so far
+startup_phases = []
+
+def mark_startup(phase):
+    """Record that a startup phase has just ended"""
+    startup_phases.append((phase, time.perf_counter()))
+
+def report_startup():
+    """Print how long each startup phase took, and return whether startup was within STARTUP_BUDGET_MS"""
+    parts = []
+    previous = startup_start
+    for phase, end in startup_phases:
+        parts.append(f"{phase} {(end - previous) * 1000:.0f} ms")
+        previous = end
+    total = (previous - startup_start) * 1000
+    within_budget = total <= STARTUP_BUDGET_MS
+    verdict = "within" if within_budget else "over"
+    print(f"Startup: {', '.join(parts)}; {total:.0f} ms total, {verdict} the {STARTUP_BUDGET_MS} ms budget")
+    return within_budget
+
+def report_idle(wall_seconds, cpu_seconds, wakeups):
+    """Print the share of one CPU used while idle, and return whether it was within IDLE_CPU_BUDGET_PERCENT"""
+    percent = cpu_seconds / wall_seconds * 100
+    within_budget = percent <= IDLE_CPU_BUDGET_PERCENT
+    verdict = "within" if within_budget else "over"
+    print(f"Idle: {cpu_seconds * 1000:.0f} ms of CPU in {wall_seconds:.1f} s, {percent:.2f}% with {wakeups} wakeups; "
+          f"{verdict} the {IDLE_CPU_BUDGET_PERCENT}% budget")
+    return within_budget
 
 def fixed_update():
     """Update logic that happens every frame"""
@@ -70,11 +82,11 @@ def fixed_update():
 
 def initialize():
     """Initialize the game"""
-    # Initialize pygame
-    pygame.init()
+    mark_startup("imports")
     
-    # Initialize screen
+    # Open the window - this starts the display, the only part of pygame the mapper needs up front
     init_screen()
+    mark_startup("display")
     
     # Create note tile image if it doesn't exist
     note_path = "tiles/note.png"
@@ -82,8 +94,7 @@ def initialize():
         # Create a transparent image with a blue 'N' label
         note_img = pygame.Surface((32, 32), pygame.SRCALPHA)
         # Draw small letter N in blue in the top-left corner
-        font = pygame.font.SysFont(None, 20)
-        n_label = font.render("N", True, BLUE)
+        n_label = render_text("N", 20, BLUE)
         note_img.blit(n_label, (2, 2))
         # Save the image
         pygame.image.save(note_img, note_path)
@@ -102,6 +113,35 @@ def initialize():
         # Save the image
         pygame.image.save(pipette_img, pipette_path)
     
+    # Create fill tile image if it doesn't exist
+    fill_path = "tiles/fill.png"
+    if not os.path.exists(fill_path):
+        # Create a transparent image with a paint bucket icon
+        fill_img = pygame.Surface((32, 32), pygame.SRCALPHA)
+        # Draw a tilted bucket with a handle
+        pygame.draw.polygon(fill_img, (255, 0, 255), [(6, 14), (18, 4), (28, 16), (16, 26)])   # Bucket body
+        pygame.draw.polygon(fill_img, (255, 255, 255), [(6, 14), (18, 4), (28, 16), (16, 26)], 2)  # Bucket outline
+        pygame.draw.arc(fill_img, (255, 255, 255), (10, 2, 14, 14), 0, 3.14, 2)                # Bucket handle
+        # Draw paint pouring out of the bucket
+        pygame.draw.circle(fill_img, (0, 255, 255), (6, 24), 4)                                  # Cyan paint
+        # Save the image
+        pygame.image.save(fill_img, fill_path)
+    
+    # Create select tile image if it doesn't exist
+    select_path = "tiles/select.png"
+    if not os.path.exists(select_path):
+        # Create a transparent image with a dashed selection rectangle
+        select_img = pygame.Surface((32, 32), pygame.SRCALPHA)
+        for i in range(4, 28, 6):
+            pygame.draw.line(select_img, (255, 0, 255), (i, 4), (i + 3, 4), 2)    # Top edge
+            pygame.draw.line(select_img, (255, 0, 255), (i, 27), (i + 3, 27), 2)  # Bottom edge
+            pygame.draw.line(select_img, (255, 0, 255), (4, i), (4, i + 3), 2)    # Left edge
+            pygame.draw.line(select_img, (255, 0, 255), (27, i), (27, i + 3), 2)  # Right edge
+        # Draw a small arrow cursor in the corner
+        pygame.draw.polygon(select_img, (0, 255, 255), [(16, 16), (26, 20), (20, 26)])  # Cyan arrow
+        # Save the image
+        pygame.image.save(select_img, select_path)
+    
     # Load tiles
     all_tiles = load_tiles()
     
@@ -112,6 +152,19 @@ def initialize():
     for tile in all_tiles.values():
         tile.update_scaled_images()
     
+    # Scale the images for the other zoom levels in the background
+    if WARM_SCALED_IMAGES:
+        warm_scaled_image_cache(all_tiles)
+    
+    # Map thumbnails in the file browser use the tile colours
+    file_browser.thumbnails.color_table = build_color_table(all_tiles)
+    
+    # Bring back the unsaved edits of the new map from before the last crash or exit
+    recovered = open_journal(None)
+    if recovered:
+        settings.status_message = f"Recovered {recovered} unsaved edits"
+        settings.status_message_timer = 180  # 3 seconds at 60 FPS
+    
     # Place entrance tile
     set_entrance_tile(grid, all_tiles)
     
@@ -122,13 +175,100 @@ def initialize():
     save_button.action = lambda: save_map(grid)
     load_button.action = lambda: load_map(all_tiles)
     
+    mark_startup("assets")
     return all_tiles, save_button, load_button
 
+def draw_note_editor(surface, editing_pos, note_text):
+    """Draw the note editing banner and edit box on top of everything else"""
+    # Draw a full-width notification bar at the top to indicate editing mode
+    top_banner = pygame.Rect(0, 0, WINDOW_WIDTH, 30)
+    pygame.draw.rect(surface, BLUE, top_banner)
+    banner_text = f"EDITING NOTE AT ({editing_pos[0]}, {editing_pos[1]})"
+    banner_surface = render_text(banner_text, 24, WHITE)
+    surface.blit(banner_surface, (10, 8))
+    
+    # Create a very prominent edit box with high contrast
+    edit_font = get_font(24)
+    
+    # Make the text input area stand out more
+    text_bg_rect = pygame.Rect(10, WINDOW_HEIGHT - 70, GRID_WIDTH - 20, 60)
+    
+    # Draw with high contrast
+    pygame.draw.rect(surface, (0, 0, 80), text_bg_rect)  # Dark blue background
+    pygame.draw.rect(surface, WHITE, text_bg_rect, 3)    # Thicker white outline
+    
+    # Get the prompt and text, word wrapped to the edit box as it was typed
+    wrapped_lines = input_handler.note_layout.lines
+    
+    # Only display the last two lines if there are more than 2
+    # (since our edit box can comfortably fit 2 lines)
+    if len(wrapped_lines) > 2:
+        wrapped_lines = wrapped_lines[-2:]
+    
+    # Draw each line
+    for i, line in enumerate(wrapped_lines):
+        note_surface = render_text(line, 24, (255, 255, 100))  # Bright yellow text
+        surface.blit(note_surface, (20, WINDOW_HEIGHT - 60 + (i * edit_font.get_height())))
+    
+    # Add blinking cursor after the last character for edit feedback
+    if cursor_visible():
+        last_line = wrapped_lines[-1]
+        if note_text and not note_text.endswith(" "):
+            last_line = last_line.rstrip()
+        cursor_x = 20 + edit_font.size(last_line)[0]
+        cursor_y = WINDOW_HEIGHT - 60 + ((len(wrapped_lines) - 1) * edit_font.get_height())
+        surface.blit(render_text("|", 24, (255, 255, 100)), (cursor_x, cursor_y))
+    
+    # Add a hint about saving
+    hint_text = "Press ENTER to save or ESC to cancel"
+    hint_surface = render_text(hint_text, 18, (255, 255, 255))  # White text
+    surface.blit(hint_surface, (20, WINDOW_HEIGHT - 25))
+    
+    # Return the screen areas that were drawn on
+    return [top_banner, text_bg_rect]
+
+def cursor_visible():
+    """Whether the blinking note cursor is currently shown"""
+    return (pygame.time.get_ticks() // CURSOR_BLINK_MS) % 2 == 0
+
+def idle_timeout(editing_note):
+    """How long the idle loop may sleep before something has to be redrawn"""
+    if editing_note:
+        # Wake up in time for the next cursor blink
+        return CURSOR_BLINK_MS - pygame.time.get_ticks() % CURSOR_BLINK_MS
+    return IDLE_WAIT_MS
+
+def wait_for_events(timeout):
+    """Sleep until events arrive or the timeout expires, then return the queued events.
+
+    pygame.event.wait wakes up every millisecond while it waits, so the queue
+    is checked every IDLE_POLL_MS instead, sleeping in between.
+    """
+    deadline = pygame.time.get_ticks() + timeout
+    while True:
+        events = pygame.event.get()
+        remaining = deadline - pygame.time.get_ticks()
+        if events or remaining <= 0:
+            return events
+        pygame.time.wait(min(IDLE_POLL_MS, remaining))
+
 def main():
     """Main game loop"""
     # Initialize game
     all_tiles, save_button, load_button = initialize()
     
+    # The window only exists now, so the screen imported from settings is still None
+    screen = settings.screen
+    
+    # With --startup-report, time the start up to the first frame on screen, then quit
+    startup_report = "--startup-report" in sys.argv[1:]
+    
+    # With --idle-report, measure the process's CPU time once the loop goes idle, then quit
+    idle_report = "--idle-report" in sys.argv[1:]
+    idle_start = None  # (wall time, CPU time) when the measurement started
+    idle_wakeups = 0
+    within_budget = True
+    
     # Create clock for limiting FPS
     clock = pygame.time.Clock()
     
@@ -139,9 +279,24 @@ def main():
     # Import once at the start to avoid reimporting every frame
     from input_handler import editing_note, note_text, editing_pos
     
+    # Screen areas that are redrawn independently
+    grid_area = pygame.Rect(0, 0, GRID_WIDTH, GRID_HEIGHT)
+    palette_area = pygame.Rect(GRID_WIDTH, 0, PALETTE_WIDTH, PALETTE_HEIGHT)
+    
+    # Everything that affects what each area looks like as of the last redraw
+    drawn_grid_state = None
+    drawn_palette_state = None
+    
     # Main game loop
     running = True
+    idle = False
     while running:
+        # Sleep until input arrives when the previous frame had nothing to do
+        if idle:
+            events = wait_for_events(idle_timeout(editing_note))
+        else:
+            events = pygame.event.get()
+        
         # Calculate mouse position
         mouse_pos = pygame.mouse.get_pos()
         
@@ -149,17 +304,34 @@ def main():
         save_button.update(mouse_pos)
         load_button.update(mouse_pos)
         
+        # Consecutive mouse moves are handled together so a fast drag paints one stroke
+        motion_events = []
+        
         # Event handling
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
+        for event in events + [None]:
+            # The file browser takes all input while it is open
+            if event is not None and file_browser.is_open and file_browser.handle_event(event):
+                continue
+            
+            if event is not None and event.type == pygame.MOUSEMOTION:
+                motion_events.append(event)
+                continue
+            
+            # Mouse movement - flushed before the next other event so the order is kept
+            if motion_events:
+                palette_rect = pygame.Rect(GRID_WIDTH, 0, PALETTE_WIDTH, PALETTE_HEIGHT)
+                handle_mouse_motion(motion_events, palette_rect, selected_tile_id, all_tiles)
+                motion_events = []
+            
+            if event is None:
+                break
+            elif event.type == pygame.QUIT:
                 running = False
                 
-            # Mouse movement
-            elif event.type == pygame.MOUSEMOTION:
-                # Create palette rect for reference
-                palette_rect = pygame.Rect(GRID_WIDTH, 0, PALETTE_WIDTH, PALETTE_HEIGHT)
-                # Handle mouse drag and motion
-                handle_mouse_motion(event, palette_rect, selected_tile_id, all_tiles)
+            # Window uncovered - the whole screen has to be redrawn
+            elif event.type == pygame.VIDEOEXPOSE or event.type == pygame.WINDOWEXPOSED:
+                drawn_grid_state = None
+                drawn_palette_state = None
                 
             # Mouse button events
             elif event.type == pygame.MOUSEBUTTONDOWN:
@@ -228,27 +400,25 @@ def main():
                     continue
                 
         # Handle keyboard input for navigation
+        camera_before = (settings.camera_x, settings.camera_y)
         keys = pygame.key.get_pressed()
-        selected_tile_id = handle_keyboard_input(keys, all_tiles, selected_tile_id, all_tiles)
+        if not file_browser.is_open:
+            selected_tile_id = handle_keyboard_input(keys, all_tiles, selected_tile_id, all_tiles)
+        camera_moved = camera_before != (settings.camera_x, settings.camera_y)
+        
+        # The fill tool pours the last tile that was selected for painting
+        if selected_tile_id not in (NOTE, PIPETTE, FILL, SELECT):
+            input_handler.fill_tile_id = selected_tile_id
         
         # Fixed update (timers, etc.)
+        timer_running = settings.status_message_timer > 0
         fixed_update()
         
-        # Drawing
-        screen.fill(BLACK)
-        
-        # Draw grid and tiles
-        draw_grid(screen, all_tiles, grid)
-        
-        # Draw palette
-        palette_rect = draw_palette(screen, all_tiles, selected_tile_id)
-        
-        # Draw UI elements
-        draw_coordinates(screen, mouse_pos)
-        draw_status_message(screen)
+        # Show the map thumbnails that finished rendering
+        file_browser.update()
         
-        save_button.draw(screen)
-        load_button.draw(screen)
+        # Keep the edit journal small by folding it into a snapshot now and then
+        compact_journal()
         
         # Ensure entrance tile is always at (0,0)
         set_entrance_tile(grid, all_tiles)
@@ -256,66 +426,85 @@ def main():
         # Re-import every frame to ensure we have the latest state
         from input_handler import editing_note, note_text, editing_pos
         
-        # Display note editing status and current text if editing - DRAW LAST TO ENSURE VISIBILITY
-        if editing_note and editing_pos is not None:
-            # Draw a full-width notification bar at the top to indicate editing mode
-            top_banner = pygame.Rect(0, 0, WINDOW_WIDTH, 30)
-            pygame.draw.rect(screen, BLUE, top_banner)
-            banner_font = pygame.font.SysFont(None, 24)
-            banner_text = f"EDITING NOTE AT ({editing_pos[0]}, {editing_pos[1]})"
-            banner_surface = banner_font.render(banner_text, True, WHITE)
-            screen.blit(banner_surface, (10, 8))
-            
-            # Create a very prominent edit box with high contrast
-            edit_font = pygame.font.SysFont(None, 24)
-            
-            # Make the text input area stand out more
-            text_bg_rect = pygame.Rect(10, WINDOW_HEIGHT - 70, GRID_WIDTH - 20, 60)
-            
-            # Draw with high contrast
-            pygame.draw.rect(screen, (0, 0, 80), text_bg_rect)  # Dark blue background
-            pygame.draw.rect(screen, WHITE, text_bg_rect, 3)    # Thicker white outline
-            
-            # Add a prompt and make the text more visible
-            prompt = "Note: "
-            
-            # Word wrap the text to fit in the edit box
-            max_edit_width = text_bg_rect.width - 30  # Allow for padding
+        editing_state = (editing_note, editing_pos, note_text, editing_note and cursor_visible())
+        
+        # The grid area shows tiles, notes, the hovered note popup and the overlays
+        mouse_cell = grid_to_cell(*screen_to_grid(*mouse_pos))
+        grid_state = (
+            settings.camera_x, settings.camera_y, settings.zoom_level,
+            grid.revision, settings.notes.revision,
+            mouse_cell, mouse_pos if mouse_cell in settings.notes else None,
+            settings.status_message if settings.status_message_timer > 0 else None,
+            settings.selection,
+            editing_state,
+            file_browser.revision
+        )
+        palette_state = (
+            getattr(settings, 'palette_scroll', 0), selected_tile_id,
+            save_button.is_hovered, load_button.is_hovered, editing_note
+        )
+        
+        # Drawing - only the areas whose state changed since they were last drawn
+        dirty_rects = []
+        if grid_state != drawn_grid_state:
+            # Draw grid and tiles
+            draw_grid(screen, all_tiles, grid)
             
-            # Add blinking cursor for edit feedback
-            display_text = note_text
-            if (pygame.time.get_ticks() // 500) % 2 == 0:
-                display_text += "|"
-                
-            # Get wrapped text lines
-            display_with_prompt = prompt + display_text
-            wrapped_lines = wrap_text(display_with_prompt, edit_font, max_edit_width)
+            # Draw UI elements
+            draw_coordinates(screen, mouse_pos)
+            if file_browser.is_open:
+                file_browser.draw(screen)
+            draw_status_message(screen)
             
-            # Only display the last two lines if there are more than 2
-            # (since our edit box can comfortably fit 2 lines)
-            if len(wrapped_lines) > 2:
-                wrapped_lines = wrapped_lines[-2:]
+            dirty_rects.append(grid_area)
+            drawn_grid_state = grid_state
+        
+        if palette_state != drawn_palette_state:
+            # Draw palette
+            draw_palette(screen, all_tiles, selected_tile_id)
             
-            # Draw each line
-            for i, line in enumerate(wrapped_lines):
-                note_surface = edit_font.render(line, True, (255, 255, 100))  # Bright yellow text
-                screen.blit(note_surface, (20, WINDOW_HEIGHT - 60 + (i * edit_font.get_height())))
+            save_button.draw(screen)
+            load_button.draw(screen)
             
-            # Add a hint about saving
-            hint_font = pygame.font.SysFont(None, 18)
-            hint_text = "Press ENTER to save or ESC to cancel"
-            hint_surface = hint_font.render(hint_text, True, (255, 255, 255))  # White text
-            screen.blit(hint_surface, (20, WINDOW_HEIGHT - 25))
+            dirty_rects.append(palette_area)
+            drawn_palette_state = palette_state
+        
+        # Display note editing status and current text if editing - DRAW LAST TO ENSURE VISIBILITY
+        if editing_note and editing_pos is not None and dirty_rects:
+            dirty_rects.extend(draw_note_editor(screen, editing_pos, note_text))
+        
+        # Update only the changed parts of the display
+        if dirty_rects:
+            pygame.display.update(dirty_rects)
         
-        # Update the display
-        pygame.display.flip()
+        if startup_report:
+            mark_startup("first frame")
+            within_budget = report_startup()
+            running = False
+        
+        # Go idle once a frame passes with no input, camera motion, timers or redraws
+        idle = not events and not camera_moved and not timer_running and not dirty_rects
+        
+        if idle_report and idle:
+            if idle_start is None:
+                idle_start = (time.perf_counter(), time.process_time())
+            else:
+                idle_wakeups += 1
+                wall_seconds = time.perf_counter() - idle_start[0]
+                if wall_seconds >= IDLE_REPORT_SECONDS:
+                    within_budget = report_idle(wall_seconds, time.process_time() - idle_start[1], idle_wakeups)
+                    running = False
         
         # Limit to 60 FPS
         clock.tick(60)
         
+    # Let a save that is still being written finish, and write out the last journaled edits
+    finish_saving()
+    edit_journal.close()
+    
     # Quit pygame before exiting
     pygame.quit()
-    sys.exit()
+    sys.exit(0 if within_budget else 1)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""Compare two maps, or merge two edited copies of a map, without opening the mapper.
+
+    python map_diff.py diff old.dungeonb new.dungeonb
+    python map_diff.py merge base.dungeonb mine.dungeonb theirs.dungeonb --output merged.dungeonb
+
+Maps of either format are read with the file_io loaders. Every non-empty cell
+is turned into one int64 key packing its (x, y), so comparing maps is a few
+NumPy set operations over sorted key arrays rather than a loop over cells.
+
+A merge takes every cell and note changed on only one side. A cell or note
+changed differently on both sides is a conflict: it is reported, and the
+merged map keeps the side chosen with --prefer.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+# Keep pygame's greeting out of the output
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import numpy as np
+from settings import *
+from chunks import GridStore
+from tiles import load_tiles
+from file_io import MapSnapshot, write_map_file
+from map_tool import read_map
+
+# Added to y so that it fits in the low 32 unsigned bits of a key, under the signed x
+KEY_OFFSET = 1 << 31
+
+def pack_keys(xs, ys):
+    """Pack cell coordinates into int64 keys, ordered by x then y"""
+    return (np.asarray(xs, dtype=np.int64) << 32) | (np.asarray(ys, dtype=np.int64) + KEY_OFFSET)
+
+def unpack_keys(keys):
+    """Return the (xs, ys) arrays of packed cell keys"""
+    return keys >> 32, (keys & 0xFFFFFFFF) - KEY_OFFSET
+
+def grid_cells(grid):
+    """Return (keys, values) arrays of every non-empty cell of a grid, sorted by key"""
+    key_parts = []
+    value_parts = []
+    for key in grid.chunk_keys():
+        chunk = grid.chunk_array(key)
+        local_ys, local_xs = np.nonzero(chunk)
+        key_parts.append(pack_keys(local_xs + key[0] * grid.chunk_size, local_ys + key[1] * grid.chunk_size))
+        value_parts.append(chunk[local_ys, local_xs])
+    if not key_parts:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int8)
+    keys = np.concatenate(key_parts)
+    values = np.concatenate(value_parts)
+    order = np.argsort(keys, kind="stable")
+    return keys[order], values[order]
+
+def union_keys(*key_arrays):
+    """Return the sorted keys found in any of the sorted key arrays.
+
+    A stable sort merges the already sorted runs in close to linear time,
+    which is much faster here than np.union1d or np.unique.
+    """
+    keys = np.sort(np.concatenate(key_arrays), kind="stable")
+    if not len(keys):
+        return keys
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = keys[1:] != keys[:-1]
+    return keys[first]
+
+def lookup(keys, values, wanted):
+    """Return the values of the cells at the sorted wanted keys, EMPTY where a cell isn't in keys"""
+    found = np.full(len(wanted), EMPTY, dtype=np.int8)
+    if not len(keys):
+        return found
+    indices = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+    present = keys[indices] == wanted
+    found[present] = values[indices[present]]
+    return found
+
+class MapCells:
+    """The cells, notes, camera and zoom of one map file"""
+
+    def __init__(self, file_path):
+        self.path = file_path
+        grid, notes, camera, zoom = read_map(file_path)
+        try:
+            self.keys, self.values = grid_cells(grid)
+        finally:
+            grid.clear()  # Unmaps the file
+        self.notes = dict(notes)
+        self.camera = camera if camera is not None else (0, 0)
+        self.zoom = zoom if zoom is not None else 1.0
+
+class MapDiff:
+    """The cells and notes added, removed and changed from one map to another.
+
+    Cell changes are kept as arrays: keys are packed cell coordinates, and
+    each has the tile id before and/or after. Note changes are dicts of
+    (x, y) -> text, or (old text, new text) for changed notes.
+    """
+
+    def __init__(self, old, new):
+        # Cells in both maps, and where they are in each map's arrays
+        common, old_indices, new_indices = np.intersect1d(old.keys, new.keys, assume_unique=True,
+                                                          return_indices=True)
+        changed = old.values[old_indices] != new.values[new_indices]
+        self.changed_keys = common[changed]
+        self.changed_old = old.values[old_indices[changed]]
+        self.changed_new = new.values[new_indices[changed]]
+
+        # Every cell not in both maps was either removed or added
+        removed = np.ones(len(old.keys), dtype=bool)
+        removed[old_indices] = False
+        self.removed_keys = old.keys[removed]
+        self.removed_values = old.values[removed]
+        added = np.ones(len(new.keys), dtype=bool)
+        added[new_indices] = False
+        self.added_keys = new.keys[added]
+        self.added_values = new.values[added]
+
+        old_positions = old.notes.keys()
+        new_positions = new.notes.keys()
+        self.notes_added = {pos: new.notes[pos] for pos in new_positions - old_positions}
+        self.notes_removed = {pos: old.notes[pos] for pos in old_positions - new_positions}
+        self.notes_changed = {pos: (old.notes[pos], new.notes[pos]) for pos in old_positions & new_positions
+                              if old.notes[pos] != new.notes[pos]}
+
+    def counts(self):
+        """Number of differences of each kind"""
+        return {
+            "cells_added": len(self.added_keys),
+            "cells_removed": len(self.removed_keys),
+            "cells_changed": len(self.changed_keys),
+            "notes_added": len(self.notes_added),
+            "notes_removed": len(self.notes_removed),
+            "notes_changed": len(self.notes_changed),
+        }
+
+    def __bool__(self):
+        return any(self.counts().values())
+
+    def lines(self, tile_names):
+        """Yield a line of text for each difference, cells in coordinate order then notes"""
+        name = lambda tile_id: tile_names.get(tile_id, f"Unknown ({tile_id})")
+        for symbol, keys, columns in (("+", self.added_keys, (self.added_values,)),
+                                      ("-", self.removed_keys, (self.removed_values,)),
+                                      ("~", self.changed_keys, (self.changed_old, self.changed_new))):
+            xs, ys = unpack_keys(keys)
+            for x, y, *tile_ids in zip(xs.tolist(), ys.tolist(), *(column.tolist() for column in columns)):
+                yield f"{symbol} ({x}, {y}) " + " -> ".join(name(tile_id) for tile_id in tile_ids)
+        for symbol, notes in (("+", self.notes_added), ("-", self.notes_removed)):
+            for pos, text in sorted(notes.items()):
+                yield f"{symbol} note ({pos[0]}, {pos[1]}) {text!r}"
+        for pos, (old_text, new_text) in sorted(self.notes_changed.items()):
+            yield f"~ note ({pos[0]}, {pos[1]}) {old_text!r} -> {new_text!r}"
+
+class MapMerge:
+    """A three-way merge of two maps edited from the same base map.
+
+    keys and values hold the merged map's non-empty cells. Conflicting cells
+    are kept as arrays of their keys and the base, ours and theirs tile ids;
+    conflicting notes as a dict of (x, y) -> (base, ours, theirs) text, with
+    None for a missing note.
+    """
+
+    def __init__(self, base, ours, theirs, prefer="ours"):
+        # Every cell on any of the maps, with its tile id on each (EMPTY where it isn't on one)
+        keys = union_keys(base.keys, ours.keys, theirs.keys)
+        base_values = lookup(base.keys, base.values, keys)
+        our_values = lookup(ours.keys, ours.values, keys)
+        their_values = lookup(theirs.keys, theirs.values, keys)
+
+        # Take their cell wherever only they changed it; ours is right everywhere else unless both sides disagree
+        their_changes = their_values != base_values
+        values = np.where(their_changes, their_values, our_values)
+        conflicts = their_changes & (our_values != base_values) & (our_values != their_values)
+        if prefer == "theirs":
+            values[conflicts] = their_values[conflicts]
+        else:
+            values[conflicts] = our_values[conflicts]
+
+        self.conflict_keys = keys[conflicts]
+        self.conflict_base = base_values[conflicts]
+        self.conflict_ours = our_values[conflicts]
+        self.conflict_theirs = their_values[conflicts]
+        filled = values != EMPTY
+        self.keys = keys[filled]
+        self.values = values[filled]
+
+        # Notes are merged the same way, with None standing for a missing note
+        self.notes = {}
+        self.note_conflicts = {}
+        for pos in base.notes.keys() | ours.notes.keys() | theirs.notes.keys():
+            base_text, our_text, their_text = base.notes.get(pos), ours.notes.get(pos), theirs.notes.get(pos)
+            text = their_text if their_text != base_text else our_text
+            if their_text != base_text and our_text != base_text and our_text != their_text:
+                self.note_conflicts[pos] = (base_text, our_text, their_text)
+                text = their_text if prefer == "theirs" else our_text
+            if text is not None:
+                self.notes[pos] = text
+
+        # The merged map opens where our copy was last looked at
+        self.camera = ours.camera
+        self.zoom = ours.zoom
+
+    def conflict_lines(self, tile_names):
+        """Yield a line of text for each conflict"""
+        name = lambda tile_id: tile_names.get(tile_id, f"Unknown ({tile_id})") if tile_id != EMPTY else "empty"
+        xs, ys = unpack_keys(self.conflict_keys)
+        for x, y, base_id, our_id, their_id in zip(xs.tolist(), ys.tolist(), self.conflict_base.tolist(),
+                                                   self.conflict_ours.tolist(), self.conflict_theirs.tolist()):
+            yield f"! ({x}, {y}) base {name(base_id)}, ours {name(our_id)}, theirs {name(their_id)}"
+        for pos, (base_text, our_text, their_text) in sorted(self.note_conflicts.items()):
+            yield f"! note ({pos[0]}, {pos[1]}) base {base_text!r}, ours {our_text!r}, theirs {their_text!r}"
+
+    def write(self, file_path):
+        """Write the merged map to a file, in the format of its extension"""
+        grid = GridStore(CHUNK_SIZE)
+        xs, ys = unpack_keys(self.keys)
+        grid.write_cells(xs, ys, self.values)
+        write_map_file(MapSnapshot(grid, self.notes, self.camera, self.zoom), file_path)
+
+def print_lines(lines, limit):
+    """Print up to limit lines (all of them if limit is 0), then how many were left out"""
+    shown = 0
+    left_out = 0
+    for line in lines:
+        if limit and shown >= limit:
+            left_out += 1
+            continue
+        print(line)
+        shown += 1
+    if left_out:
+        print(f"... and {left_out} more")
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Compare or three-way merge Dungeon Mapper maps.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    diff_parser = commands.add_parser("diff", help="list the cells and notes that differ between two maps")
+    diff_parser.add_argument("old", help="the earlier map")
+    diff_parser.add_argument("new", help="the later map")
+
+    merge_parser = commands.add_parser("merge", help="merge two maps edited from the same base map")
+    merge_parser.add_argument("base", help="the map both copies started from")
+    merge_parser.add_argument("ours", help="our edited copy")
+    merge_parser.add_argument("theirs", help="their edited copy")
+    merge_parser.add_argument("-o", "--output", required=True, help="file to write the merged map to (.dungeonb or .dungeon)")
+    merge_parser.add_argument("--prefer", choices=["ours", "theirs"], default="ours",
+                              help="which side wins a conflict in the merged map (default: ours)")
+
+    for command_parser in (diff_parser, merge_parser):
+        command_parser.add_argument("--limit", type=int, default=50,
+                                    help="most differences or conflicts to list, 0 for all (default: 50)")
+        command_parser.add_argument("--json", action="store_true", help="print the counts as a JSON object instead of text")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Tile names come from the tile definitions
+    tile_names = {tile_id: tile.name for tile_id, tile in load_tiles().items()}
+
+    start = time.perf_counter()
+    if args.command == "diff":
+        diff = MapDiff(MapCells(args.old), MapCells(args.new))
+        elapsed = time.perf_counter() - start
+        if args.json:
+            print(json.dumps(dict(diff.counts(), seconds=round(elapsed, 4))))
+        else:
+            print_lines(diff.lines(tile_names), args.limit)
+            counts = diff.counts()
+            print(f"cells: {counts['cells_added']} added, {counts['cells_removed']} removed, {counts['cells_changed']} changed; "
+                  f"notes: {counts['notes_added']} added, {counts['notes_removed']} removed, {counts['notes_changed']} changed "
+                  f"in {elapsed:.2f}s", file=sys.stderr)
+        # Like diff, the exit status says whether the maps differ
+        return 1 if diff else 0
+
+    merge = MapMerge(MapCells(args.base), MapCells(args.ours), MapCells(args.theirs), args.prefer)
+    merge.write(args.output)
+    elapsed = time.perf_counter() - start
+    conflicts = len(merge.conflict_keys) + len(merge.note_conflicts)
+    if args.json:
+        print(json.dumps({"output": args.output, "cells": len(merge.keys), "notes": len(merge.notes),
+                          "cell_conflicts": len(merge.conflict_keys), "note_conflicts": len(merge.note_conflicts),
+                          "seconds": round(elapsed, 4)}))
+    else:
+        print_lines(merge.conflict_lines(tile_names), args.limit)
+        print(f"Merged into {args.output}: {len(merge.keys)} cells, {len(merge.notes)} notes, "
+              f"{conflicts} conflicts kept as {args.prefer} in {elapsed:.2f}s", file=sys.stderr)
+    # A merge with conflicts is still written, but needs checking
+    return 1 if conflicts else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
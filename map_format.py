@@ -0,0 +1,168 @@
+"""Binary chunked map format (.dungeonb).
+
+Layout, all little-endian:
+
+    header           magic, version, chunk size, chunk count, camera x/y, zoom,
+                     and the offsets of the chunk directory and notes section
+    chunk data       per chunk: zlib-compressed run-length encoded tile ids
+    chunk directory  per chunk: chunk x, chunk y, data offset, data length, cell count
+    notes section    zlib-compressed list of x, y, text length, UTF-8 text
+
+The directory holds each chunk's cell count so a map can be opened without
+decoding any chunk; MapFile reads chunks out of an mmap of the file on demand.
+"""
+import mmap
+import struct
+import zlib
+import numpy as np
+
+MAGIC = b"DUNGEONB"
+VERSION = 1
+
+HEADER = struct.Struct("<8sHHIdddQQQ")  # magic, version, chunk size, chunk count, camera x, camera y, zoom,
+                                        # directory offset, notes offset, notes length
+DIRECTORY_ENTRY = struct.Struct("<iiQII")  # chunk x, chunk y, data offset, data length, cell count
+NOTE_ENTRY = struct.Struct("<iiI")  # x, y, UTF-8 text length
+
+PROGRESS_CHUNKS = 1024  # Chunks written between progress callbacks
+
+def encode_chunk(chunk):
+    """Run-length encode and compress an int8 chunk array"""
+    flat = chunk.ravel()
+    run_starts = np.flatnonzero(np.concatenate(([True], flat[1:] != flat[:-1])))
+    run_lengths = np.diff(np.append(run_starts, flat.size)).astype("<u2")
+    run_values = flat[run_starts]
+    raw = struct.pack("<H", len(run_starts)) + run_lengths.tobytes() + run_values.tobytes()
+    return zlib.compress(raw)
+
+def decode_chunk(data, chunk_size):
+    """Decompress and expand chunk data written by encode_chunk into a (chunk_size, chunk_size) int8 array"""
+    raw = zlib.decompress(data)
+    (run_count,) = struct.unpack_from("<H", raw)
+    run_lengths = np.frombuffer(raw, dtype="<u2", count=run_count, offset=2)
+    run_values = np.frombuffer(raw, dtype=np.int8, count=run_count, offset=2 + 2 * run_count)
+    if int(run_lengths.sum()) != chunk_size * chunk_size:
+        raise ValueError("Corrupt chunk data")
+    return np.repeat(run_values, run_lengths).reshape(chunk_size, chunk_size)
+
+def encode_notes(notes):
+    """Pack and compress (x, y) -> text notes"""
+    parts = [struct.pack("<I", len(notes))]
+    for (x, y), note_text in notes.items():
+        text = note_text.encode("utf-8")
+        parts.append(NOTE_ENTRY.pack(x, y, len(text)))
+        parts.append(text)
+    return zlib.compress(b"".join(parts))
+
+def decode_notes(data):
+    """Return the (x, y) -> text notes packed by encode_notes"""
+    raw = zlib.decompress(data)
+    (count,) = struct.unpack_from("<I", raw)
+    offset = 4
+    notes = {}
+    for _ in range(count):
+        x, y, length = NOTE_ENTRY.unpack_from(raw, offset)
+        offset += NOTE_ENTRY.size
+        notes[(x, y)] = raw[offset:offset + length].decode("utf-8")
+        offset += length
+    return notes
+
+def write_map(file, chunk_size, chunks, notes, camera_x, camera_y, zoom, encoded_chunks=(), progress=None):
+    """Write a map to an open binary file.
+
+    chunks yields ((chunk x, chunk y), int8 array) for every non-empty chunk,
+    and notes maps (x, y) to note text. encoded_chunks yields ((chunk x,
+    chunk y), data, cell count) for chunks that are already encoded, such as
+    ones still pending from another MapFile. progress(done, total) is called
+    after every batch of chunks if given.
+    """
+    chunks = list(chunks)
+    encoded_chunks = list(encoded_chunks)
+    total = len(chunks) + len(encoded_chunks)
+    
+    file.write(b"\0" * HEADER.size)  # Filled in once the offsets are known
+    offset = HEADER.size
+    directory = []
+    for (chunk_x, chunk_y), data, count in encoded_chunks:
+        file.write(data)
+        directory.append(DIRECTORY_ENTRY.pack(chunk_x, chunk_y, offset, len(data), count))
+        offset += len(data)
+    
+    for done, ((chunk_x, chunk_y), chunk) in enumerate(chunks, len(encoded_chunks) + 1):
+        count = int(np.count_nonzero(chunk))
+        if count:
+            data = encode_chunk(chunk)
+            file.write(data)
+            directory.append(DIRECTORY_ENTRY.pack(chunk_x, chunk_y, offset, len(data), count))
+            offset += len(data)
+        if progress is not None and done % PROGRESS_CHUNKS == 0:
+            progress(done, total)
+
+    directory_offset = offset
+    file.write(b"".join(directory))
+    offset += DIRECTORY_ENTRY.size * len(directory)
+
+    notes_data = encode_notes(notes)
+    file.write(notes_data)
+
+    file.seek(0)
+    file.write(HEADER.pack(MAGIC, VERSION, chunk_size, len(directory), camera_x, camera_y, zoom,
+                           directory_offset, offset, len(notes_data)))
+    if progress is not None:
+        progress(total, total)
+
+def is_binary_map(path):
+    """Whether the file starts with the .dungeonb magic bytes"""
+    with open(path, "rb") as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+class MapFile:
+    """An opened .dungeonb file whose chunks are decoded only when asked for"""
+
+    def __init__(self, path=None, data=None):
+        # data is a whole map already in memory, such as the snapshot in an edit journal
+        self.path = path
+        if data is None:
+            with open(path, "rb") as file:
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.data = data
+
+        (magic, version, self.chunk_size, chunk_count, self.camera_x, self.camera_y, self.zoom,
+         directory_offset, self.notes_offset, self.notes_length) = HEADER.unpack_from(self.data)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError("Not a .dungeonb map")
+        if version > VERSION:
+            self.close()
+            raise ValueError(f"Map format version {version} is newer than this program supports")
+
+        # (chunk x, chunk y) -> (data offset, data length), and the cell count of every chunk
+        self.directory = {}
+        self.chunk_counts = {}
+        for chunk_x, chunk_y, offset, length, count in DIRECTORY_ENTRY.iter_unpack(
+                self.data[directory_offset:directory_offset + DIRECTORY_ENTRY.size * chunk_count]):
+            self.directory[(chunk_x, chunk_y)] = (offset, length)
+            self.chunk_counts[(chunk_x, chunk_y)] = count
+
+    def read_chunk(self, key):
+        """Decode one chunk into a new int8 array"""
+        offset, length = self.directory[key]
+        return decode_chunk(self.data[offset:offset + length], self.chunk_size)
+
+    def read_chunk_data(self, key):
+        """Return a copy of the encoded data of one chunk, as written by encode_chunk"""
+        offset, length = self.directory[key]
+        return self.data[offset:offset + length]
+
+    def read_notes(self):
+        """Decode the notes section"""
+        return decode_notes(self.data[self.notes_offset:self.notes_offset + self.notes_length])
+
+    def in_memory(self):
+        """Return a MapFile reading the same map from a copy of its data in memory"""
+        return MapFile(data=bytes(self.data))
+
+    def close(self):
+        """Unmap the file once no more chunks will be read"""
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""Command line tool for checking, converting, summarising and exporting map files without opening the mapper.
+
+    python map_tool.py validate maps/
+    python map_tool.py convert --to dungeonb maps/ --output converted/
+    python map_tool.py stats maps/ --json
+    python map_tool.py export maps/big.dungeonb --tile-size 20
+
+Directories are searched for .dungeon and .dungeonb files. Maps are handled
+by a pool of worker processes, and a line is printed for each one as soon as
+it is done. Exports go one map at a time instead, each split into strips
+across the workers.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import time
+
+# Keep pygame's greeting out of the output
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import numpy as np
+from settings import *
+from chunks import GridStore
+from tiles import load_tiles
+from browser import is_map_file
+from file_io import MapSnapshot, read_map_file, release_map_file, write_map_file
+import map_format
+import image_export
+
+FORMAT_EXTENSIONS = {"dungeonb": ".dungeonb", "dungeon": ".dungeon"}
+
+# Tile id -> name, set in every worker process by init_worker
+tile_names = {}
+
+# The image_export setup and worker count used by the export command
+export_setup = None
+export_workers = 1
+
+def find_maps(paths):
+    """Return the map files among paths, searching directories recursively, as (path, path relative to its root)"""
+    maps = []
+    for path in paths:
+        if not os.path.isdir(path):
+            maps.append((path, os.path.basename(path)))
+            continue
+        for directory, subdirectories, files in os.walk(path):
+            subdirectories.sort()
+            for name in sorted(files):
+                if is_map_file(name):
+                    file_path = os.path.join(directory, name)
+                    maps.append((file_path, os.path.relpath(file_path, path)))
+    return maps
+
+def read_map(file_path):
+    """Read a map file into a new grid, returning (grid, notes, camera, zoom)"""
+    grid = GridStore(CHUNK_SIZE)
+    notes = {}
+    camera, zoom = read_map_file(file_path, grid, notes)
+    return grid, notes, camera, zoom
+
+def validate_map(file_path):
+    """Read every part of a map, returning a list of the problems found in it"""
+    problems = []
+    grid, notes, camera, zoom = read_map(file_path)
+    try:
+        unknown = set()
+        for key in grid.chunk_keys():
+            # Decoding a chunk of a .dungeonb file checks its run lengths, and its count against the directory
+            chunk = grid.chunk_array(key)
+            if int(np.count_nonzero(chunk)) != grid.counts[key]:
+                problems.append(f"chunk {key} has {np.count_nonzero(chunk)} cells, its directory entry says {grid.counts[key]}")
+            unknown.update(int(tile_id) for tile_id in np.unique(chunk) if int(tile_id) not in tile_names)
+        if unknown:
+            problems.append(f"unknown tile ids {sorted(unknown)}")
+
+        bad_notes = [pos for pos, text in notes.items() if not isinstance(text, str)]
+        if bad_notes:
+            problems.append(f"{len(bad_notes)} notes aren't text, e.g. at {bad_notes[0]}")
+
+        if camera is not None and not all(isinstance(value, (int, float)) for value in camera):
+            problems.append(f"camera position {camera!r} isn't a pair of numbers")
+        if zoom is not None and not isinstance(zoom, (int, float)):
+            problems.append(f"zoom {zoom!r} isn't a number")
+    finally:
+        grid.clear()  # Unmaps the file
+    return problems
+
+def convert_map(file_path, target_path, overwrite):
+    """Write a map file out in the format of target_path's extension"""
+    if os.path.exists(target_path) and not overwrite:
+        raise FileExistsError(f"{target_path} already exists (use --force to replace it)")
+    grid, notes, camera, zoom = read_map(file_path)
+    try:
+        snapshot = MapSnapshot(grid, notes, camera if camera is not None else (0, 0), zoom if zoom is not None else 1.0)
+        release_map_file(grid, target_path)  # In case the map is converted onto itself
+        os.makedirs(os.path.dirname(os.path.abspath(target_path)), exist_ok=True)
+        write_map_file(snapshot, target_path)
+    finally:
+        grid.clear()
+
+def export_map_image(file_path, target_path, overwrite):
+    """Render a map file to a PNG, returning its (width, height)"""
+    if os.path.exists(target_path) and not overwrite:
+        raise FileExistsError(f"{target_path} already exists (use --force to replace it)")
+    os.makedirs(os.path.dirname(os.path.abspath(target_path)), exist_ok=True)
+    return image_export.export_map(file_path, target_path, export_setup, EXPORT_STRIP_PIXELS, export_workers)
+
+def map_stats(file_path):
+    """Count a map's cells by tile, its chunks and notes, and find its bounds"""
+    grid, notes, camera, zoom = read_map(file_path)
+    try:
+        counts = np.zeros(256, dtype=np.int64)  # Indexed by tile id as an unsigned byte
+        min_x = min_y = max_x = max_y = None
+        keys = grid.chunk_keys()
+        for key in keys:
+            chunk = grid.chunk_array(key)
+            counts += np.bincount(chunk.view(np.uint8).ravel(), minlength=256)
+            ys, xs = np.nonzero(chunk)
+            if len(xs):
+                chunk_min_x, chunk_max_x = key[0] * CHUNK_SIZE + int(xs.min()), key[0] * CHUNK_SIZE + int(xs.max())
+                chunk_min_y, chunk_max_y = key[1] * CHUNK_SIZE + int(ys.min()), key[1] * CHUNK_SIZE + int(ys.max())
+                if min_x is None:
+                    min_x, min_y, max_x, max_y = chunk_min_x, chunk_min_y, chunk_max_x, chunk_max_y
+                else:
+                    min_x, min_y = min(min_x, chunk_min_x), min(min_y, chunk_min_y)
+                    max_x, max_y = max(max_x, chunk_max_x), max(max_y, chunk_max_y)
+
+        tiles = {}
+        for unsigned_id in np.flatnonzero(counts):
+            tile_id = int(np.int8(np.uint8(unsigned_id)))
+            if tile_id != EMPTY:
+                tiles[tile_names.get(tile_id, f"Unknown ({tile_id})")] = int(counts[unsigned_id])
+        return {
+            "cells": len(grid),
+            "chunks": len(keys),
+            "notes": len(notes),
+            "bounds": None if min_x is None else [min_x, min_y, max_x, max_y],
+            "tiles": tiles,
+        }
+    finally:
+        grid.clear()
+
+def init_worker(names):
+    global tile_names
+    tile_names = names
+    # SDL, if anything has started it, turns SIGTERM into a quit event - the pool needs it to end workers
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+def run_task(job):
+    """Handle one map in a worker process, returning a result dict instead of raising"""
+    command, file_path, target_path, overwrite = job
+    result = {"path": file_path, "ok": True}
+    start = time.perf_counter()
+    try:
+        if command == "validate":
+            problems = validate_map(file_path)
+            result["ok"] = not problems
+            result["problems"] = problems
+        elif command == "convert":
+            convert_map(file_path, target_path, overwrite)
+            result["output"] = target_path
+        elif command == "export":
+            result["size"] = export_map_image(file_path, target_path, overwrite)
+            result["output"] = target_path
+        else:
+            result.update(map_stats(file_path))
+    except Exception as e:
+        result["ok"] = False
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = round(time.perf_counter() - start, 4)
+    return result
+
+def format_result(command, result):
+    """One line of text output for a finished map"""
+    if "error" in result:
+        return f"FAIL  {result['path']}: {result['error']}"
+    if command == "validate":
+        if result["ok"]:
+            return f"OK    {result['path']}"
+        return f"FAIL  {result['path']}: " + "; ".join(result["problems"])
+    if command == "convert":
+        return f"OK    {result['path']} -> {result['output']}"
+    if command == "export":
+        if result["size"] is None:
+            return f"OK    {result['path']}: empty, nothing exported"
+        return f"OK    {result['path']} -> {result['output']} ({result['size'][0]}x{result['size'][1]})"
+    bounds = "empty" if result["bounds"] is None else "({}, {}) to ({}, {})".format(*result["bounds"])
+    tiles = ", ".join(f"{name} {count}" for name, count in sorted(result["tiles"].items(), key=lambda item: -item[1]))
+    return f"{result['path']}: {result['cells']} cells in {result['chunks']} chunks, {result['notes']} notes, {bounds}; {tiles}"
+
+def target_path(relative_path, file_path, extension, output):
+    """Where a converted map goes - next to the original, or at the same place under the output directory"""
+    if output is not None:
+        file_path = os.path.join(output, relative_path)
+    return os.path.splitext(file_path)[0] + extension
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Check, convert, summarise and export Dungeon Mapper maps without opening the mapper.")
+    parser.add_argument("command", choices=["validate", "convert", "stats", "export"],
+                        help="validate: read every chunk and note of each map and report problems; "
+                             "convert: write each map in another format; "
+                             "stats: count each map's cells by tile; "
+                             "export: draw each whole map to a PNG")
+    parser.add_argument("paths", nargs="+", help="map files, or directories to search for .dungeon and .dungeonb files")
+    parser.add_argument("--to", choices=sorted(FORMAT_EXTENSIONS), default="dungeonb",
+                        help="format to convert to (default: dungeonb)")
+    parser.add_argument("--tile-size", type=int, default=EXPORT_TILE_SIZE,
+                        help=f"pixels per cell in exported images (default: {EXPORT_TILE_SIZE})")
+    parser.add_argument("--output", help="directory to write converted maps and images to, keeping their folders (default: next to each map)")
+    parser.add_argument("--force", action="store_true", help="replace existing files when converting or exporting")
+    parser.add_argument("--json", action="store_true", help="print one JSON object per map instead of text")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes (default: one per CPU)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    maps = find_maps(args.paths)
+    if not maps:
+        print("No map files found", file=sys.stderr)
+        return 2
+
+    # A map already in the target format is never converted onto itself
+    extension = FORMAT_EXTENSIONS[args.to]
+    jobs = []
+    for file_path, relative_path in maps:
+        if args.command == "export":
+            jobs.append((args.command, file_path, target_path(relative_path, file_path, ".png", args.output), args.force))
+        elif args.command == "convert":
+            target = target_path(relative_path, file_path, extension, args.output)
+            if os.path.abspath(target) == os.path.abspath(file_path):
+                continue
+            jobs.append((args.command, file_path, target, args.force))
+        else:
+            jobs.append((args.command, file_path, None, False))
+
+    # Tile names and images come from the tile definitions, so are loaded once here
+    tiles = load_tiles()
+    names = {tile_id: tile.name for tile_id, tile in tiles.items()}
+
+    start = time.perf_counter()
+    failed = 0
+    totals = {}
+    worker_count = max(1, min(args.jobs, len(jobs)))
+    if args.command == "export":
+        # Every map is split into strips across all the workers, so the maps themselves go one at a time
+        global export_setup, export_workers
+        export_setup = image_export.export_setup(tiles, args.tile_size)
+        export_workers = args.jobs
+        worker_count = 1
+    if worker_count == 1:
+        init_worker(names)
+        results = map(run_task, jobs)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(worker_count, initializer=init_worker, initargs=(names,))
+        # Unordered and one map at a time, so each result is printed as soon as its map is done
+        results = pool.imap_unordered(run_task, jobs)
+    try:
+        for result in results:
+            if not result["ok"]:
+                failed += 1
+            for name, count in result.get("tiles", {}).items():
+                totals[name] = totals.get(name, 0) + count
+            print(json.dumps(result) if args.json else format_result(args.command, result), flush=True)
+    except BaseException:
+        # Interrupted, or the output was closed - stop the maps still being worked on
+        if pool is not None:
+            pool.terminate()
+        raise
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    elapsed = time.perf_counter() - start
+    if args.command == "export":
+        worker_count = export_workers
+    summary = f"{len(jobs)} maps, {len(jobs) - failed} ok, {failed} failed in {elapsed:.2f}s with {worker_count} workers"
+    if args.command == "stats" and totals:
+        summary += "; all maps: " + ", ".join(f"{name} {count}" for name, count in sorted(totals.items(), key=lambda item: -item[1]))
+    print(summary, file=sys.stderr)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
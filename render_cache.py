@@ -0,0 +1,157 @@
+import math
+from collections import OrderedDict
+import numpy as np
+import pygame
+from settings import *
+from tiles import get_scaled_image
+
+def blit_tiles(surface, cells, tiles, tile_size, origin_x, origin_y, image_size):
+    """Draw ((x, y), tile_id) cells onto a surface with one batched blits call.
+
+    Cell (x, y) is drawn at floor((x - origin_x) * tile_size), floor((y - origin_y) * tile_size),
+    the same rounding as grid_to_screen. Tiles without an image are filled with their colour.
+    """
+    floor = math.floor
+    blit_sequence = []
+    color_cells = []
+    images = {}  # tile id -> scaled image, looked up once per tile type
+    
+    for (grid_x, grid_y), tile_id in cells:
+        if tile_id == EMPTY:
+            continue
+        position = (floor((grid_x - origin_x) * tile_size), floor((grid_y - origin_y) * tile_size))
+        image = images.get(tile_id)
+        if image is None:
+            tile = tiles[tile_id]
+            image = get_scaled_image(tile, image_size) if tile.scaled_image else False
+            images[tile_id] = image
+        if image:
+            blit_sequence.append((image, position))
+        else:
+            color_cells.append((tile_id, position))
+    
+    surface.blits(blit_sequence, doreturn=False)
+    
+    # If no image, draw a filled rectangle with the tile's color
+    drawn_tile_size = image_size - 1
+    for tile_id, position in color_cells:
+        tile_rect = pygame.Rect(position, (drawn_tile_size, drawn_tile_size))
+        surface.fill(tiles[tile_id].color, tile_rect)
+        pygame.draw.rect(surface, GRAY, tile_rect, 1)
+
+class ChunkRenderCache:
+    """Pre-rendered surfaces for grid chunks, one per chunk per zoom level.
+
+    A cached surface is re-rendered when the grid reports a new revision for its
+    chunk, and the least recently used surfaces are dropped once the total pixel
+    count goes over the budget.
+    """
+
+    def __init__(self, pixel_budget):
+        self.pixel_budget = pixel_budget
+        self.entries = OrderedDict()  # (chunk key, zoom) -> (revision, surface)
+        self.pixels = 0  # Total pixels held by cached surfaces
+
+    def get(self, key, grid, tiles, zoom):
+        """Return the surface for a chunk at the given zoom, rendering it if stale"""
+        cache_key = (key, zoom)
+        revision = grid.chunk_revision(key)
+        entry = self.entries.get(cache_key)
+        if entry is not None and entry[0] == revision:
+            self.entries.move_to_end(cache_key)
+            return entry[1]
+
+        if entry is not None:
+            self._discard(cache_key)
+        chunk_surface = self.render_chunk(key, grid, tiles, zoom)
+        self.entries[cache_key] = (revision, chunk_surface)
+        self.pixels += chunk_surface.get_width() * chunk_surface.get_height()
+        self._evict()
+        return chunk_surface
+
+    def render_chunk(self, key, grid, tiles, zoom):
+        """Compose every tile of a chunk into a single transparent surface"""
+        tile_size = BASE_TILE_SIZE * zoom
+        chunk_size = grid.chunk_size
+        drawn_tile_size = int(tile_size) + 1
+
+        # Tiles are placed relative to the chunk origin, which is floored separately
+        # when the chunk is blitted, so draw them one pixel larger to hide the seam
+        surface_size = math.floor((chunk_size - 1) * tile_size) + drawn_tile_size + 1
+        chunk_surface = pygame.Surface((surface_size, surface_size), pygame.SRCALPHA)
+
+        origin_x = key[0] * chunk_size
+        origin_y = key[1] * chunk_size
+        blit_tiles(chunk_surface, grid.chunk_items(key), tiles, tile_size,
+                   origin_x, origin_y, drawn_tile_size + 1)
+        return chunk_surface
+
+    def _discard(self, cache_key):
+        """Remove one entry and release its pixels from the budget"""
+        _, chunk_surface = self.entries.pop(cache_key)
+        self.pixels -= chunk_surface.get_width() * chunk_surface.get_height()
+
+    def _evict(self):
+        """Drop least recently used surfaces until the cache fits the pixel budget"""
+        # Always keep the newest entry, even if it alone exceeds the budget
+        while self.pixels > self.pixel_budget and len(self.entries) > 1:
+            self._discard(next(iter(self.entries)))
+
+    def clear(self):
+        """Drop every cached surface"""
+        self.entries.clear()
+        self.pixels = 0
+
+def build_color_table(tiles):
+    """Return a (256, 3) array mapping each tile id, as an unsigned byte, to the tile's colour"""
+    color_table = np.zeros((256, 3), dtype=np.uint8)
+    for tile_id, tile in tiles.items():
+        color_table[tile_id & 0xFF] = tile.color[:3]
+    return color_table
+
+class ChunkColorCache:
+    """Per-chunk arrays of tile colours for the far zoom renderer.
+
+    Like ChunkRenderCache, an entry is rebuilt when its chunk revision changes
+    and the least recently used entries are dropped once there are too many.
+    """
+
+    def __init__(self, max_chunks):
+        self.max_chunks = max_chunks
+        self.entries = OrderedDict()  # chunk key -> (revision, (size, size, 3) colour array)
+
+    def get(self, key, grid, color_table):
+        """Return the colour array of a chunk, indexed [x, y] from the chunk origin"""
+        revision = grid.chunk_revision(key)
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == revision:
+            self.entries.move_to_end(key)
+            return entry[1]
+        
+        # Look up every cell at once, transposed to the [x, y] order of pygame.surfarray
+        tile_ids = grid.chunk_array(key).view(np.uint8)
+        colors = color_table[tile_ids.T]
+        
+        self.entries[key] = (revision, colors)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_chunks:
+            self.entries.popitem(last=False)
+        return colors
+
+    def colors_in_rect(self, grid, color_table, min_x, min_y, max_x, max_y):
+        """Return a (width, height, 3) array of the colours of the cells in the inclusive rectangle"""
+        colors = np.zeros((max_x - min_x + 1, max_y - min_y + 1, 3), dtype=np.uint8)
+        chunk_size = grid.chunk_size
+        for key in grid.chunks_in_rect(min_x, min_y, max_x, max_y):
+            chunk_colors = self.get(key, grid, color_table)
+            
+            # Copy the part of the chunk that overlaps the rectangle
+            origin_x = key[0] * chunk_size
+            origin_y = key[1] * chunk_size
+            x0 = max(min_x, origin_x)
+            y0 = max(min_y, origin_y)
+            x1 = min(max_x + 1, origin_x + chunk_size)
+            y1 = min(max_y + 1, origin_y + chunk_size)
+            colors[x0 - min_x:x1 - min_x, y0 - min_y:y1 - min_y] = \
+                chunk_colors[x0 - origin_x:x1 - origin_x, y0 - origin_y:y1 - origin_y]
+        return colors
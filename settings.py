@@ -1,7 +1,6 @@
+import os
 import pygame
-
-# Initialize pygame
-pygame.init()
+from chunks import ChunkedGrid, GridStore
 
 # Colors
 BLACK = (0, 0, 0)
@@ -21,9 +20,20 @@ GRID_HEIGHT_TILES = 15  # Number of tiles visible vertically at default zoom
 
 # Zoom settings
 zoom_level = 1.0  # 1.0 is default, <1 is zoomed out, >1 is zoomed in
-MIN_ZOOM = 0.15  # Shows about 100x100 tiles (15/0.15 = 100)
+MIN_ZOOM = 0.015  # Shows about 1000x1000 tiles (15/0.015 = 1000)
 MAX_ZOOM = 1.5   # Shows about 10x10 tiles (15/1.5 = 10)
 ZOOM_STEP = 0.1  # How much to change zoom per mouse wheel tick
+FAR_ZOOM = 0.15  # Below this zoom (about 100x100 tiles) the wheel zooms by a factor instead
+FAR_ZOOM_FACTOR = 1.5  # How much to change zoom per mouse wheel tick below FAR_ZOOM
+LOD_ZOOM_THRESHOLD = 0.15  # At or below this zoom tiles are drawn as single-colour pixels
+LOD_CHUNK_CACHE_SIZE = 16384  # Max chunk colour arrays kept for the far zoom renderer
+SCALED_IMAGE_CACHE_SIZE = 2048  # Max scaled tile images kept across zoom levels, each tile scaled on its own
+WARM_SCALED_IMAGES = True  # Pre-scale tile images for all zoom levels at startup
+
+# Text settings
+TEXT_CACHE_SIZE = 512  # Max rendered text surfaces kept between frames
+WRAP_CACHE_SIZE = 128  # Max word-wrapped texts kept between frames
+NOTE_POPUP_CACHE_SIZE = 32  # Max rendered note popups kept between frames
 
 # Calculated grid settings (updated when zoom changes)
 TILE_SIZE = BASE_TILE_SIZE * zoom_level
@@ -45,12 +55,57 @@ WINDOW_WIDTH = GRID_WIDTH + PALETTE_WIDTH
 WINDOW_HEIGHT = GRID_HEIGHT
 WINDOW_TITLE = "Dungeon Mapper"
 
+# Startup settings
+STARTUP_BUDGET_MS = 300  # Cold start target from launch to the first frame on screen, checked by main.py --startup-report
+
+# Frame timing settings
+IDLE_WAIT_MS = 1000  # Longest time the main loop sleeps waiting for input when nothing changes
+IDLE_POLL_MS = 40  # How often the idle loop checks for input, so input waits at most this long
+CURSOR_BLINK_MS = 500  # Note editing cursor blink interval
+IDLE_CPU_BUDGET_PERCENT = 1  # Most of one CPU the mapper may use while idle, checked by main.py --idle-report
+IDLE_REPORT_SECONDS = 10  # How long main.py --idle-report measures the idle mapper for
+
 # Camera settings
 camera_x = 0 - GRID_WIDTH_TILES / 2  # Start with camera centered on (0,0)
 camera_y = 0 - GRID_HEIGHT_TILES / 2  # Start with camera centered on (0,0)
 scroll_speed = 1  # How many tiles to scroll per key press
 drag_sensitivity = 2.5  # Higher value = less sensitive
 
+# Spatial index settings
+CHUNK_SIZE = 16  # Width and height of a grid chunk in cells
+CHUNK_CACHE_PIXEL_BUDGET = 8_000_000  # Max pixels held by pre-rendered chunk surfaces
+
+# Fill tool settings
+FILL_MAX_CELLS = 250_000  # Largest area the fill tool fills, so filling open space can't run away
+
+# Undo settings
+HISTORY_MEMORY_LIMIT = 64_000_000  # Max bytes of undo/redo history; the oldest edits are dropped past it
+
+# Per-user files kept between runs
+APP_DATA_DIR = os.path.join(os.path.expanduser("~"), ".dungeon_mapper")
+
+# Crash recovery settings
+JOURNAL_FLUSH_MS = 500  # How often journaled edits are written to disk and fsynced
+JOURNAL_COMPACT_BYTES = 8_000_000  # Journal size at which it is folded into a snapshot of the whole map
+UNTITLED_JOURNAL_PATH = os.path.join(APP_DATA_DIR, "untitled.dungeonb.journal")  # Journal of a map that has never been saved
+
+# File browser settings
+THUMBNAIL_CACHE_DIR = os.path.join(APP_DATA_DIR, "thumbnails")  # Map thumbnails, named by map path, size and mtime
+RECENT_MAPS_FILE = os.path.join(APP_DATA_DIR, "recent_maps.json")  # Recently opened or saved maps
+RECENT_MAPS_KEPT = 8  # How many recent maps are remembered
+THUMBNAIL_SIZE = 48  # Width and height of a map thumbnail in pixels
+
+# Tile atlas settings
+ATLAS_CACHE_DIR = os.path.join(APP_DATA_DIR, "atlas")  # Tile images packed at their own size into one sheet, with an index of their sources
+
+# Image export settings
+EXPORT_TILE_SIZE = BASE_TILE_SIZE  # Pixels per cell in exported PNGs
+EXPORT_STRIP_PIXELS = 4_000_000  # Pixels drawn at once by each export worker; bounds the memory of an export
+
+# JSON map settings
+JSON_STREAM_LOAD = True  # Read the grid of .dungeon files a block at a time instead of with one json.load
+JSON_STREAM_BLOCK_CHARS = 1 << 20  # Characters of the file read per block when streaming
+
 # UI elements
 save_button = None
 load_button = None
@@ -80,21 +135,31 @@ THRONE = 18  # New throne tile
 BOSS = 19  # New boss tile
 EXIT = 20  # Exit tile
 POISON_POOL = 21 # Poison pool
+FILL = 22  # Tool for flood filling an area with the last selected tile
+SELECT = 23  # Tool for selecting, copying and moving a rectangle of tiles
 ENTRANCE = -1  # Special entrance tile, moved to -1 to keep it separate from regular tiles
 
-# Create the grid - use dictionary for infinite grid
-# Keys are (x, y) tuples, values are tile IDs
-grid = {}
+# Create the grid - a dictionary-like store for the infinite grid
+# Keys are (x, y) tuples, values are tile IDs; cells are kept in small int8 chunks
+# so drawing only has to visit the cells near the camera
+grid = GridStore(CHUNK_SIZE)
 
 # Create notes dictionary - keys are (x, y) tuples, values are note text
-notes = {}
+# Notes are indexed by chunk like the grid so drawing only visits the visible ones
+notes = ChunkedGrid(CHUNK_SIZE)
 
-# Create the screen initially
-screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
-pygame.display.set_caption(WINDOW_TITLE)
+# File the open map was loaded from or last saved to, or None for a new map
+map_path = None
+
+# Rectangle picked with the selection tool as (min_x, min_y, max_x, max_y) in cells, or None
+selection = None
+
+# The window surface, created by init_screen - importing settings doesn't open a window,
+# so tools that only read and write maps never start the display
+screen = None
 
 def init_screen():
-    """Initialize the screen with fixed dimensions"""
+    """Open the window with fixed dimensions, starting the display the first time"""
     global screen, WINDOW_WIDTH, WINDOW_HEIGHT, GRID_WIDTH, GRID_HEIGHT, PALETTE_HEIGHT
     
     # Set fixed window dimensions based on default zoom
@@ -104,6 +169,8 @@ def init_screen():
     WINDOW_WIDTH = GRID_WIDTH + PALETTE_WIDTH
     WINDOW_HEIGHT = GRID_HEIGHT
     
+    # Only the display is started, not every pygame module - audio and joysticks aren't used
+    pygame.display.init()
     screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
     pygame.display.set_caption(WINDOW_TITLE)
 
@@ -113,3 +180,15 @@ def update_grid_dimensions():
     
     current_zoom = zoom_level  # Store in local variable to ensure we're using the correct value
     TILE_SIZE = BASE_TILE_SIZE * current_zoom
+
+def step_zoom(zoom, zoom_in):
+    """Return the zoom level one mouse wheel tick away from the given one"""
+    if zoom_in:
+        if zoom < FAR_ZOOM:
+            return min(FAR_ZOOM, zoom * FAR_ZOOM_FACTOR)
+        return min(MAX_ZOOM, zoom + ZOOM_STEP)
+    
+    # Linear steps would jump from FAR_ZOOM straight to MIN_ZOOM, so zoom by a factor there
+    if zoom <= FAR_ZOOM:
+        return max(MIN_ZOOM, zoom / FAR_ZOOM_FACTOR)
+    return max(FAR_ZOOM, zoom - ZOOM_STEP)
@@ -0,0 +1,15 @@
+"""Run the tests headless, from the repository root, without touching the user's ~/.dungeon_mapper."""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Set before anything imports pygame or settings, which reads the home directory
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+os.environ["HOME"] = tempfile.mkdtemp(prefix="dungeon_mapper_home_")
+
+# Tile images are found relative to the working directory, like when running main.py
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
@@ -0,0 +1,60 @@
+import os
+import pygame
+import pytest
+from browser import FileBrowser, Entry
+
+def key(key, unicode=""):
+    return pygame.event.Event(pygame.KEYDOWN, key=key, unicode=unicode, mod=0)
+
+@pytest.fixture
+def save_browser(tmp_path):
+    (tmp_path / "old.dungeonb").write_bytes(b"map")
+    picked = []
+    cancelled = []
+    browser = FileBrowser()
+    browser.open("save", picked.append, lambda: cancelled.append(True), str(tmp_path), "old")
+    return browser, picked, cancelled, tmp_path
+
+def test_saving_a_new_name_picks_it_straight_away(save_browser):
+    browser, picked, cancelled, directory = save_browser
+    browser.file_name = "new"
+    browser.handle_event(key(pygame.K_RETURN))
+    assert picked == [str(directory / "new.dungeonb")]
+
+def test_replacing_an_existing_map_asks_first(save_browser):
+    browser, picked, cancelled, directory = save_browser
+    browser.handle_event(key(pygame.K_RETURN))
+    assert picked == []
+    assert browser.is_open
+    assert browser.confirm_path == str(directory / "old.dungeonb")
+    browser.handle_event(key(pygame.K_RETURN))
+    assert picked == [str(directory / "old.dungeonb")]
+
+def test_escape_keeps_the_existing_map_and_the_browser_open(save_browser):
+    browser, picked, cancelled, directory = save_browser
+    browser.handle_event(key(pygame.K_RETURN))
+    browser.handle_event(key(pygame.K_ESCAPE))
+    assert browser.is_open and browser.confirm_path is None and not cancelled
+    # Asked again, not replaced, on the next Enter
+    browser.handle_event(key(pygame.K_RETURN))
+    assert picked == []
+    browser.handle_event(key(pygame.K_ESCAPE))
+    browser.handle_event(key(pygame.K_ESCAPE))
+    assert cancelled == [True] and picked == []
+
+def test_editing_the_name_drops_the_question(save_browser):
+    browser, picked, cancelled, directory = save_browser
+    browser.handle_event(key(pygame.K_RETURN))
+    browser.handle_event(key(pygame.K_2, "2"))
+    assert browser.confirm_path is None
+    browser.handle_event(key(pygame.K_RETURN))
+    assert picked == [str(directory / "old2.dungeonb")]
+
+def test_clicked_map_name_is_confirmed_before_replacing(save_browser):
+    browser, picked, cancelled, directory = save_browser
+    path = str(directory / "old.dungeonb")
+    browser.choose_entry(Entry("old.dungeonb", path, False, 3, os.stat(path).st_mtime_ns))
+    browser.save_typed_name()
+    assert picked == []
+    browser.save_typed_name()
+    assert picked == [path]
@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+import settings
+import history
+import tools
+from chunks import ChunkedGrid, GridStore
+from history import edit_history
+
+@pytest.fixture
+def grid(monkeypatch):
+    """A fresh grid and notes for the history and tools modules, with an empty history"""
+    grid = GridStore(settings.CHUNK_SIZE)
+    grid.write_cells([0], [0], [settings.ENTRANCE])
+    notes = ChunkedGrid(settings.CHUNK_SIZE)
+    for module in (history, tools):
+        monkeypatch.setattr(module, "grid", grid)
+        monkeypatch.setattr(module, "notes", notes)
+    edit_history.clear()
+    yield grid
+    edit_history.clear()
+
+def snapshot(grid, size=40):
+    return grid.read_region(-size, -size, 2 * size, 2 * size)
+
+def test_write_cells_keeps_the_last_listing_of_each_cell():
+    grid = GridStore(settings.CHUNK_SIZE)
+    grid.write_cells([5], [5], [settings.LEVER])
+    xs = np.array([5, 6, 5, 5, -70, 6])
+    ys = np.array([5, 6, 5, 5, 90, 6])
+    old_values = grid.write_cells(xs, ys, np.array([1, 2, 3, 4, 5, 6], dtype=np.int8))
+    # Every listing gets the value from before the call
+    assert old_values.tolist() == [settings.LEVER, 0, settings.LEVER, settings.LEVER, 0, 0]
+    assert grid.get((5, 5), 0) == 4
+    assert grid.get((6, 6), 0) == 6
+    assert grid.get((-70, 90), 0) == 5
+
+def test_write_cells_matches_a_dict_with_random_duplicates():
+    rng = np.random.default_rng(14)
+    grid = GridStore(settings.CHUNK_SIZE)
+    reference = {}
+    for _ in range(50):
+        xs = rng.integers(-100, 100, 300)
+        ys = rng.integers(-100, 100, 300)
+        values = rng.integers(1, 8, 300).astype(np.int8)
+        old_values = grid.write_cells(xs, ys, values)
+        assert old_values.tolist() == [reference.get((x, y), 0) for x, y in zip(xs.tolist(), ys.tolist())]
+        for x, y, value in zip(xs.tolist(), ys.tolist(), values.tolist()):
+            reference[(x, y)] = value
+    for (x, y), value in reference.items():
+        assert grid.get((x, y), 0) == value
+
+def test_undo_a_self_overlapping_stroke(grid):
+    before = snapshot(grid)
+    # One stroke whose motion batches cross each other and change tile midway
+    edit_history.begin("Paint")
+    tools.paint_cells(tools.line_cells(-10, 0, 10, 0), settings.WALL)
+    tools.paint_cells(tools.line_cells(0, -10, 0, 10), settings.FLOOR)
+    tools.paint_cells(tools.line_cells(-10, -10, 10, 10), settings.LEVER)
+    tools.paint_cells(tools.line_cells(-10, 0, 10, 0), settings.FLOOR)
+    edit_history.end()
+    after = snapshot(grid)
+    assert len(edit_history.undo_stack) == 1
+
+    edit_history.undo()
+    assert np.array_equal(snapshot(grid), before)
+    edit_history.redo()
+    assert np.array_equal(snapshot(grid), after)
+
+def test_undo_a_move_onto_itself(grid):
+    rng = np.random.default_rng(3)
+    xs = rng.integers(-8, 8, 120)
+    ys = rng.integers(-8, 8, 120)
+    tools.set_cells(xs, ys, settings.WALL)
+    tools.set_cells(xs[::3], ys[::3], settings.FLOOR)
+    tools.set_note((2, 3), "trap")
+    before = snapshot(grid)
+
+    # The moved rectangle overlaps where it was, so its cells are cleared and then written again
+    tools.move_region(-8, -8, 7, 7, 3, 2)
+    after = snapshot(grid)
+    assert grid.get((0, 0), 0) == settings.ENTRANCE
+    assert history.notes.get((5, 5)) == "trap"
+
+    edit_history.undo()
+    assert np.array_equal(snapshot(grid), before)
+    assert history.notes.get((2, 3)) == "trap" and history.notes.get((5, 5)) is None
+    edit_history.redo()
+    assert np.array_equal(snapshot(grid), after)
+
+@pytest.mark.parametrize("values", [[300], [-129], 128, [1.5]])
+def test_write_cells_rejects_tile_ids_that_dont_fit(values):
+    grid = GridStore(settings.CHUNK_SIZE)
+    with pytest.raises(ValueError):
+        grid.write_cells([1], [1], values)
+    with pytest.raises(ValueError):
+        grid.write_region(0, 0, np.full((2, 2), values))
+    assert len(grid) == 0
+
+def test_tile_ids_at_the_ends_of_the_range_are_kept():
+    grid = GridStore(settings.CHUNK_SIZE)
+    grid.write_cells([1, 2], [1, 1], [127, -128])
+    grid[(3, 1)] = -100
+    assert [grid.get((x, 1)) for x in (1, 2, 3)] == [127, -128, -100]
+    with pytest.raises(ValueError):
+        grid[(4, 1)] = 200
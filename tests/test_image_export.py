@@ -0,0 +1,33 @@
+import pygame
+import settings
+import file_io
+from chunks import GridStore
+from tiles import load_tiles
+
+def test_unused_image_path_never_picks_an_existing_file(tmp_path):
+    map_path = str(tmp_path / "cave.dungeonb")
+    assert file_io.unused_image_path(map_path) == str(tmp_path / "cave.png")
+    (tmp_path / "cave.png").write_bytes(b"edited by hand")
+    assert file_io.unused_image_path(map_path) == str(tmp_path / "cave-2.png")
+    (tmp_path / "cave-2.png").write_bytes(b"")
+    assert file_io.unused_image_path(map_path) == str(tmp_path / "cave-3.png")
+
+def test_export_keeps_the_existing_image(tmp_path, monkeypatch):
+    tiles = load_tiles()
+    grid = GridStore(settings.CHUNK_SIZE)
+    grid.write_cells([1, 2, 3], [1, 1, 1], [settings.WALL, settings.FLOOR, settings.LEVER])
+    monkeypatch.setattr(settings, "map_path", str(tmp_path / "cave.dungeonb"))
+    (tmp_path / "cave.png").write_bytes(b"edited by hand")
+
+    file_io.export_image(grid, tiles)
+    file_io.active_export.join()
+
+    assert (tmp_path / "cave.png").read_bytes() == b"edited by hand"
+    assert settings.status_message.startswith("Exported cave-2.png")
+    # Cells (0, 0) to (3, 1), since the entrance at the origin is always drawn
+    assert pygame.image.load(str(tmp_path / "cave-2.png")).get_size() == (4 * settings.EXPORT_TILE_SIZE, 2 * settings.EXPORT_TILE_SIZE)
+
+def test_new_map_must_be_saved_before_export(monkeypatch):
+    monkeypatch.setattr(settings, "map_path", None)
+    file_io.export_image(GridStore(settings.CHUNK_SIZE), {})
+    assert settings.status_message == "Save the map before exporting it as an image"
@@ -0,0 +1,152 @@
+import os
+import numpy as np
+import pytest
+import settings
+import file_io
+import journal
+import tools
+from chunks import GridStore
+from journal import CELLS, NOTE, EditJournal, read_journal
+from tiles import load_tiles
+
+BASE = (1234, 5678)
+
+def same_records(records, expected):
+    if len(records) != len(expected):
+        return False
+    for record, wanted in zip(records, expected):
+        if record[0] != wanted[0]:
+            return False
+        if record[0] == CELLS:
+            if not all(np.array_equal(a, b) for a, b in zip(record[1:], wanted[1:])):
+                return False
+        elif record[1:] != wanted[1:]:
+            return False
+    return True
+
+@pytest.fixture
+def journal_file(tmp_path):
+    """A journal of a few records of every kind, with the file offset where each record ends"""
+    path = str(tmp_path / "cave.dungeonb.journal")
+    edit_journal = EditJournal(10_000)
+    edit_journal.create(path, BASE)
+    records = []
+    ends = [os.path.getsize(path)]
+    def add(record, append):
+        append()
+        edit_journal.flush()
+        records.append(record)
+        ends.append(os.path.getsize(path))
+
+    xs = np.array([0, -5, 2**31 - 1], dtype=np.int32)
+    ys = np.array([7, -2**31, 3], dtype=np.int32)
+    values = np.array([1, -1, 4], dtype=np.int8)
+    add((CELLS, xs, ys, values), lambda: edit_journal.append_cells(xs, ys, values))
+    add((NOTE, (3, -4), "trap ✓"), lambda: edit_journal.append_note((3, -4), "trap ✓"))
+    add((NOTE, (3, -4), None), lambda: edit_journal.append_note((3, -4), None))
+    add((CELLS, xs[:1], ys[:1], values[1:2]), lambda: edit_journal.append_cells(xs[:1], ys[:1], values[1:2]))
+    add((NOTE, (-1, 9), ""), lambda: edit_journal.append_note((-1, 9), ""))
+    edit_journal.close()
+    return path, records, ends
+
+def test_read_whole_journal(journal_file):
+    path, records, ends = journal_file
+    base, snapshot, read_records, length = read_journal(path)
+    assert base == BASE
+    assert snapshot is None
+    assert same_records(read_records, records)
+    assert length == ends[-1] == os.path.getsize(path)
+
+def test_truncated_at_every_offset(journal_file, tmp_path):
+    path, records, ends = journal_file
+    with open(path, "rb") as f:
+        data = f.read()
+    torn_path = str(tmp_path / "torn.journal")
+    for cut in range(len(data) + 1):
+        with open(torn_path, "wb") as f:
+            f.write(data[:cut])
+        if cut < journal.HEADER.size:
+            with pytest.raises(ValueError):
+                read_journal(torn_path)
+            continue
+
+        # Every whole record is kept and the torn one is dropped
+        whole = sum(end <= cut for end in ends) - 1
+        base, snapshot, read_records, length = read_journal(torn_path)
+        assert base == BASE and snapshot is None
+        assert same_records(read_records, records[:whole])
+        assert length == ends[whole]
+
+        # Appending after the valid length replaces the torn record
+        edit_journal = EditJournal(10_000)
+        edit_journal.resume(torn_path, base, length)
+        edit_journal.append_note((8, 8), "after")
+        edit_journal.close()
+        _, _, read_records, length = read_journal(torn_path)
+        assert same_records(read_records, records[:whole] + [(NOTE, (8, 8), "after")])
+        assert length == os.path.getsize(torn_path)
+
+def test_truncated_snapshot(tmp_path):
+    path = str(tmp_path / "cave.dungeonb.journal")
+    snapshot = bytes(range(256)) * 3
+    EditJournal(10_000)._write_journal(path, BASE, snapshot, journal.NOTE_DELETE_RECORD.pack(journal.NOTE_DELETE, 1, 2))
+    with open(path, "rb") as f:
+        data = f.read()
+    assert read_journal(path)[1:3] == (snapshot, [(NOTE, (1, 2), None)])
+
+    for cut in range(journal.HEADER.size, journal.HEADER.size + len(snapshot)):
+        with open(path, "wb") as f:
+            f.write(data[:cut])
+        with pytest.raises(ValueError):
+            read_journal(path)
+    with open(path, "wb") as f:
+        f.write(data[:journal.HEADER.size + len(snapshot)])
+    assert read_journal(path)[1:] == (snapshot, [], journal.HEADER.size + len(snapshot))
+
+@pytest.fixture
+def mapper(tmp_path):
+    """Two saved maps, the tiles, and the journal of the open map closed again afterwards"""
+    paths = []
+    for name, tile_id in (("a", settings.WALL), ("b", settings.FLOOR)):
+        grid = GridStore(settings.CHUNK_SIZE)
+        grid.write_cells([1], [1], [tile_id])
+        path = str(tmp_path / f"{name}.dungeonb")
+        file_io.write_map_file(file_io.MapSnapshot(grid, {}, (0, 0), 1.0), path)
+        paths.append(path)
+    yield load_tiles(), paths
+    file_io.edit_journal.close()
+    settings.grid.clear()
+    settings.notes.clear()
+    settings.map_path = None
+
+def test_loading_another_map_discards_the_journal(mapper):
+    tiles, (path_a, path_b) = mapper
+    file_io.load_map_from(path_a, tiles)
+    tools.set_cells(np.array([5]), np.array([5]), settings.LEVER)
+    file_io.edit_journal.flush()
+    assert len(read_journal(path_a + ".journal")[2]) == 1
+
+    file_io.load_map_from(path_b, tiles)
+    assert not os.path.exists(path_a + ".journal")
+    assert "discarded" in settings.status_message
+
+    file_io.load_map_from(path_a, tiles)
+    assert settings.grid.get((5, 5), settings.EMPTY) == settings.EMPTY
+    assert "recovered" not in settings.status_message
+
+def test_journal_of_a_closed_map_is_replayed(mapper):
+    tiles, (path_a, _) = mapper
+    file_io.load_map_from(path_a, tiles)
+    tools.set_cells(np.array([5]), np.array([5]), settings.LEVER)
+    file_io.edit_journal.close()  # Closed without saving, as when the mapper exits or crashes
+
+    settings.grid.clear()
+    assert file_io.open_journal(path_a) == 1
+    assert settings.grid.get((5, 5), settings.EMPTY) == settings.LEVER
+
+def test_untitled_journal_is_kept_in_the_data_folder(mapper):
+    assert os.path.dirname(settings.UNTITLED_JOURNAL_PATH) == settings.APP_DATA_DIR
+    file_io.open_journal(None)
+    assert file_io.edit_journal.path == settings.UNTITLED_JOURNAL_PATH
+    assert os.path.exists(settings.UNTITLED_JOURNAL_PATH)
+    assert not os.path.exists(os.path.join(os.getcwd(), "untitled.dungeonb.journal"))
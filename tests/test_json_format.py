@@ -0,0 +1,94 @@
+import io
+import json
+import re
+import numpy as np
+import pytest
+import json_format
+import map_tool
+
+def random_map(rng, cell_count):
+    """A map dict as save_map writes it, with cells, notes and other top-level values"""
+    xs = rng.integers(-2**31, 2**31, cell_count) // rng.choice([1, 1000, 2**28], cell_count)
+    ys = rng.integers(-50, 50, cell_count)
+    return {
+        "camera": [-12.5, 3e-7],
+        "grid": {f"({x}, {y})": int(value) for x, y, value in
+                 zip(xs.tolist(), ys.tolist(), rng.integers(-1, 8, cell_count).tolist())},
+        "zoom": -1.25e3,
+        "notes": {"(3, -4)": "trap } {", "(-7, 0)": "\"(1, 2)\": 3, ünï ✓"},
+        "name": "cave",
+    }
+
+def read_with_json_load(text):
+    """What read_map should return, worked out from json.load one key at a time"""
+    map_data = json.load(io.StringIO(text))
+    cells = {}
+    for key, value in map_data.pop("grid", {}).items():
+        x, y = re.fullmatch(r"\(\s*(-?\d+)\s*,\s*(-?\d+)\s*\)", key).groups()
+        cells[(int(x), int(y))] = value
+    if "notes" in map_data:
+        map_data["notes"] = {tuple(int(n) for n in re.findall(r"-?\d+", key)): text
+                             for key, text in map_data["notes"].items()}
+    return map_data, cells
+
+def read_with_read_map(text, stream, block_chars):
+    cells = {}
+    def write_cells(xs, ys, values):
+        for x, y, value in zip(xs.tolist(), ys.tolist(), values.tolist()):
+            cells[(x, y)] = value
+    map_data = json_format.read_map(io.StringIO(text), write_cells, stream, block_chars)
+    return map_data, cells
+
+def unusual_spacing(map_data):
+    """JSON of the map with extra whitespace in and around the grid entries, so the regex fallbacks are used"""
+    entries = ["%s  :\n %d" % (json.dumps(key.replace("(", "( ").replace(", ", " ,")), value)
+               for key, value in map_data["grid"].items()]
+    other = json.dumps({key: value for key, value in map_data.items() if key != "grid"})
+    return '{ "grid" : {\n' + " ,\n".join(entries) + "\n} , " + other[1:]
+
+@pytest.mark.parametrize("block_chars", [1, 2, 7, 64, 1 << 20])
+@pytest.mark.parametrize("stream", [True, False])
+@pytest.mark.parametrize("layout", ["compact", "indented", "unusual"])
+def test_read_map_matches_json_load(layout, stream, block_chars):
+    rng = np.random.default_rng(block_chars)
+    for cell_count in (0, 1, 300):
+        map_data = random_map(rng, cell_count)
+        if layout == "indented":
+            text = json.dumps(map_data, indent=4)
+        elif layout == "unusual":
+            text = unusual_spacing(map_data)
+        else:
+            text = json.dumps(map_data)
+        assert read_with_read_map(text, stream, block_chars) == read_with_json_load(text)
+
+def test_read_map_without_a_grid():
+    text = '{"notes": {}, "zoom": 2}'
+    assert read_with_read_map(text, True, 3) == ({"notes": {}, "zoom": 2}, {})
+
+@pytest.mark.parametrize("stream", [True, False])
+@pytest.mark.parametrize("text", ['{"grid": {"(1, 2)": 3', '{"grid": {"(1, 2)": x}}', '{"grid": {"(1; 2)": 3}}',
+                                  '{"grid": {"(1, 2)": 3-4}}', '{"grid": {"(1-, 2)": 3}}', '{"grid": {"(1, 2)": 1.5}}',
+                                  '{"grid": {"(1, 2)": true}}', '{"grid": {"(1, 2)": 99999999999999999999}}',
+                                  '{"grid": {"(-99999999999999999999, 2)": 1}}'])
+def test_read_map_rejects_broken_maps(text, stream):
+    with pytest.raises(ValueError):
+        read_with_read_map(text, stream, 4)
+
+def test_parse_integers_matches_int():
+    rng = np.random.default_rng(17)
+    for _ in range(500):
+        numbers = rng.integers(-10 ** int(rng.integers(1, 19)), 10 ** int(rng.integers(1, 19)), int(rng.integers(0, 30)))
+        text = " " * int(rng.integers(0, 3)) + "  ".join(str(n) for n in numbers.tolist()) + " "
+        assert json_format.parse_integers(text).tolist() == [int(token) for token in text.split()]
+
+@pytest.mark.parametrize("text", ["1-2", "--3", "-", "3 -", "4-", "1234567890123456789", "12a", "1.5", "1e3", "\u0663"])
+def test_parse_integers_rejects_other_text(text):
+    with pytest.raises(ValueError):
+        json_format.parse_integers(text)
+
+def test_validate_reports_tile_ids_that_dont_fit(tmp_path):
+    path = tmp_path / "cave.dungeon"
+    path.write_text(json.dumps({"grid": {"(1, 2)": 3, "(4, 5)": 300}, "notes": {}}))
+    result = map_tool.run_task(("validate", str(path), None, False))
+    assert not result["ok"]
+    assert "300" in result["error"]
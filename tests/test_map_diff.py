@@ -0,0 +1,133 @@
+import numpy as np
+import pytest
+import settings
+from chunks import GridStore
+from file_io import MapSnapshot, write_map_file
+from map_diff import MapCells, MapDiff, MapMerge, pack_keys, unpack_keys
+
+EMPTY = settings.EMPTY
+
+def random_cells(rng, count):
+    """A dict of (x, y) -> tile id, crowded into a small area plus a few cells far out"""
+    xs = np.concatenate([rng.integers(-12, 12, count), [-2**31, 2**31 - 1, 5]])
+    ys = np.concatenate([rng.integers(-12, 12, count), [2**31 - 1, -2**31, -2**31]])
+    values = rng.integers(1, 5, len(xs))
+    cells = dict(zip(zip(xs.tolist(), ys.tolist()), values.tolist()))
+    cells.pop((0, 0), None)  # The entrance's cell, which map files never store
+    return cells
+
+def edited(rng, cells, count):
+    """A copy of cells with some cells set, changed or erased"""
+    cells = dict(cells)
+    for x, y, value in zip(rng.integers(-12, 12, count).tolist(), rng.integers(-12, 12, count).tolist(),
+                           rng.integers(0, 5, count).tolist()):
+        if (x, y) == (0, 0):
+            continue
+        if value == EMPTY:
+            cells.pop((x, y), None)
+        else:
+            cells[(x, y)] = value
+    return cells
+
+def edited_notes(rng, notes):
+    notes = dict(notes)
+    for _ in range(30):
+        pos = (int(rng.integers(-4, 4)), int(rng.integers(-4, 4)))
+        text = rng.choice(["", "trap", "door", None])
+        if text is None:
+            notes.pop(pos, None)
+        else:
+            notes[pos] = str(text)
+    return notes
+
+def write_test_map(path, cells, notes, camera=(0, 0)):
+    grid = GridStore(settings.CHUNK_SIZE)
+    if cells:
+        xs, ys = zip(*cells)
+        grid.write_cells(np.array(xs), np.array(ys), np.array(list(cells.values()), dtype=np.int8))
+    write_map_file(MapSnapshot(grid, notes, camera, 1.0), str(path))
+    return MapCells(str(path))
+
+def as_dict(keys, values):
+    xs, ys = unpack_keys(keys)
+    return dict(zip(zip(xs.tolist(), ys.tolist()), values.tolist()))
+
+def merge_by_dict(base, ours, theirs, prefer):
+    """Three-way merge of (x, y) -> value dicts one position at a time, returning (merged, conflicts)"""
+    merged = {}
+    conflicts = {}
+    for pos in base.keys() | ours.keys() | theirs.keys():
+        base_value, our_value, their_value = base.get(pos), ours.get(pos), theirs.get(pos)
+        if our_value == their_value or their_value == base_value:
+            value = our_value
+        elif our_value == base_value:
+            value = their_value
+        else:
+            conflicts[pos] = (base_value, our_value, their_value)
+            value = their_value if prefer == "theirs" else our_value
+        if value is not None:
+            merged[pos] = value
+    return merged, conflicts
+
+def test_pack_keys_round_trip_and_order():
+    xs = np.array([-2**31, -1, 0, 0, 5, 2**31 - 1])
+    ys = np.array([2**31 - 1, -2**31, -1, 0, 3, -2**31])
+    keys = pack_keys(xs, ys)
+    assert np.all(np.diff(keys) > 0)
+    unpacked_xs, unpacked_ys = unpack_keys(keys)
+    assert unpacked_xs.tolist() == xs.tolist() and unpacked_ys.tolist() == ys.tolist()
+
+@pytest.mark.parametrize("prefer", ["ours", "theirs"])
+def test_merge_with_conflicts_matches_a_dict_merge(tmp_path, prefer):
+    for seed in range(5):
+        rng = np.random.default_rng(seed)
+        base_cells = random_cells(rng, 300)
+        base_notes = {(0, 0): "start", (1, 1): "trap", (2, 2): "door"}
+        cells = [base_cells, edited(rng, base_cells, 200), edited(rng, base_cells, 200)]
+        notes = [base_notes, edited_notes(rng, base_notes), edited_notes(rng, base_notes)]
+        base, ours, theirs = (write_test_map(tmp_path / f"{name}.dungeonb", map_cells, map_notes, (seed, 1))
+                              for name, map_cells, map_notes in zip(("base", "ours", "theirs"), cells, notes))
+
+        merge = MapMerge(base, ours, theirs, prefer)
+        merged_cells, cell_conflicts = merge_by_dict(*cells, prefer)
+        merged_notes, note_conflicts = merge_by_dict(*notes, prefer)
+        assert cell_conflicts  # The edits overlap enough that some always conflict
+        assert as_dict(merge.keys, merge.values) == merged_cells
+        conflict_values = np.stack([merge.conflict_base, merge.conflict_ours, merge.conflict_theirs], axis=1)
+        assert as_dict(merge.conflict_keys, conflict_values) == {
+            pos: [EMPTY if value is None else value for value in values] for pos, values in cell_conflicts.items()}
+        assert merge.notes == merged_notes
+        assert merge.note_conflicts == note_conflicts
+        assert len(list(merge.conflict_lines({}))) == len(cell_conflicts) + len(note_conflicts)
+
+        # The written merge reads back as the same map
+        merge.write(str(tmp_path / "merged.dungeonb"))
+        merged = MapCells(str(tmp_path / "merged.dungeonb"))
+        assert as_dict(merged.keys, merged.values) == merged_cells
+        assert merged.notes == merged_notes
+        assert merged.camera == (seed, 1)
+
+def test_diff_matches_dicts(tmp_path):
+    rng = np.random.default_rng(9)
+    old_cells = random_cells(rng, 300)
+    new_cells = edited(rng, old_cells, 300)
+    old_notes = {(0, 0): "start", (1, 1): "trap"}
+    new_notes = {(0, 0): "begin", (2, 2): "door"}
+    diff = MapDiff(write_test_map(tmp_path / "old.dungeonb", old_cells, old_notes),
+                   write_test_map(tmp_path / "new.dungeonb", new_cells, new_notes))
+
+    assert as_dict(diff.added_keys, diff.added_values) == {
+        pos: value for pos, value in new_cells.items() if pos not in old_cells}
+    assert as_dict(diff.removed_keys, diff.removed_values) == {
+        pos: value for pos, value in old_cells.items() if pos not in new_cells}
+    changed = np.stack([diff.changed_old, diff.changed_new], axis=1)
+    assert as_dict(diff.changed_keys, changed) == {
+        pos: [old_cells[pos], new_cells[pos]] for pos in old_cells.keys() & new_cells.keys()
+        if old_cells[pos] != new_cells[pos]}
+    assert diff.notes_added == {(2, 2): "door"}
+    assert diff.notes_removed == {(1, 1): "trap"}
+    assert diff.notes_changed == {(0, 0): ("start", "begin")}
+    assert sum(diff.counts().values()) == len(list(diff.lines({})))
+
+    same = write_test_map(tmp_path / "same.dungeonb", old_cells, old_notes)
+    assert not MapDiff(same, same)
@@ -0,0 +1,131 @@
+import io
+import os
+import struct
+import numpy as np
+import pytest
+import settings
+import file_io
+import map_format
+from chunks import GridStore
+
+CHUNK_SIZE = 16
+
+def random_chunk(rng, run_length):
+    """A chunk of random tile ids in runs of about run_length cells"""
+    values = rng.integers(-3, 8, CHUNK_SIZE * CHUNK_SIZE // run_length + 1).astype(np.int8)
+    return np.repeat(values, run_length)[:CHUNK_SIZE * CHUNK_SIZE].reshape(CHUNK_SIZE, CHUNK_SIZE)
+
+@pytest.mark.parametrize("run_length", [1, 3, 16, 100, 256])
+def test_chunk_round_trip(run_length):
+    rng = np.random.default_rng(run_length)
+    for _ in range(20):
+        chunk = random_chunk(rng, run_length)
+        decoded = map_format.decode_chunk(map_format.encode_chunk(chunk), CHUNK_SIZE)
+        assert decoded.dtype == np.int8
+        assert np.array_equal(decoded, chunk)
+
+def test_decode_chunk_rejects_the_wrong_cell_count():
+    data = map_format.encode_chunk(np.ones((CHUNK_SIZE, CHUNK_SIZE), dtype=np.int8))
+    with pytest.raises(ValueError):
+        map_format.decode_chunk(data, CHUNK_SIZE * 2)
+
+def write_random_map(rng):
+    """Write a map with random chunks and notes, returning (bytes, chunks, notes)"""
+    chunks = {}
+    for _ in range(40):
+        key = (int(rng.integers(-50, 50)), int(rng.integers(-50, 50)))
+        chunks[key] = random_chunk(rng, int(rng.integers(1, 40)))
+    chunks[(7, 7)] = np.zeros((CHUNK_SIZE, CHUNK_SIZE), dtype=np.int8)  # Empty, so left out of the file
+    notes = {(3, -4): "trap", (-100000, 2**31 - 1): "Ünïcödé ✓", (0, 0): ""}
+    file = io.BytesIO()
+    map_format.write_map(file, CHUNK_SIZE, chunks.items(), notes, 12.5, -3.25, 1.5)
+    del chunks[(7, 7)]
+    return file.getvalue(), chunks, notes
+
+def check_map_file(map_file, chunks, notes):
+    assert map_file.chunk_size == CHUNK_SIZE
+    assert (map_file.camera_x, map_file.camera_y, map_file.zoom) == (12.5, -3.25, 1.5)
+    assert set(map_file.directory) == set(chunks)
+    for key, chunk in chunks.items():
+        assert np.array_equal(map_file.read_chunk(key), chunk)
+        assert map_file.chunk_counts[key] == np.count_nonzero(chunk)
+    assert map_file.read_notes() == notes
+
+def test_map_round_trip_in_memory():
+    data, chunks, notes = write_random_map(np.random.default_rng(1))
+    check_map_file(map_format.MapFile(data=data), chunks, notes)
+
+def test_map_round_trip_through_a_file(tmp_path):
+    data, chunks, notes = write_random_map(np.random.default_rng(2))
+    path = tmp_path / "cave.dungeonb"
+    path.write_bytes(data)
+    assert map_format.is_binary_map(str(path))
+    map_file = map_format.MapFile(str(path))
+    try:
+        check_map_file(map_file, chunks, notes)
+    finally:
+        map_file.close()
+
+def test_encoded_chunks_are_copied_as_is():
+    data, chunks, notes = write_random_map(np.random.default_rng(3))
+    source = map_format.MapFile(data=data)
+    encoded = [(key, source.read_chunk_data(key), source.chunk_counts[key]) for key in source.directory]
+
+    # Half the chunks are passed on still encoded, the other half as arrays
+    keys = sorted(chunks)
+    file = io.BytesIO()
+    map_format.write_map(file, CHUNK_SIZE, [(key, chunks[key]) for key in keys[::2]], notes, 12.5, -3.25, 1.5,
+                         encoded_chunks=[entry for entry in encoded if entry[0] in keys[1::2]])
+    check_map_file(map_format.MapFile(data=file.getvalue()), chunks, notes)
+
+def test_map_file_rejects_other_files():
+    data, _, _ = write_random_map(np.random.default_rng(4))
+    with pytest.raises(ValueError):
+        map_format.MapFile(data=b"NOTAMAP!" + data[8:])
+    newer = data[:8] + struct.pack("<H", map_format.VERSION + 1) + data[10:]
+    with pytest.raises(ValueError):
+        map_format.MapFile(data=newer)
+
+def test_save_over_the_lazily_opened_map(tmp_path, monkeypatch):
+    rng = np.random.default_rng(5)
+    data, chunks, notes = write_random_map(rng)
+    path = str(tmp_path / "cave.dungeonb")
+    with open(path, "wb") as f:
+        f.write(data)
+
+    grid = GridStore(CHUNK_SIZE)
+    file_io.read_map_file(path, grid, {})
+    file_io.open_journal(path)
+    grid.write_cells([3], [3], [settings.LEVER])  # Decodes one chunk, the rest stay pending
+    sources = set(grid.pending.values())
+    assert sources
+
+    # Like Windows, refuse to replace a file that is still memory-mapped
+    replace = os.replace
+    def checked_replace(source, target):
+        if target == path and any(not map_file.data.closed for map_file in sources):
+            raise PermissionError(f"{target} is mapped into memory")
+        replace(source, target)
+    monkeypatch.setattr(file_io.os, "replace", checked_replace)
+
+    try:
+        file_io.save_map_to(grid, path)
+        file_io.finish_saving()
+        assert settings.status_message.startswith("Map saved")
+    finally:
+        file_io.edit_journal.close()
+        settings.map_path = None
+
+    # The grid still reads its pending chunks, and the file holds the whole map
+    chunks[(0, 0)] = chunks.get((0, 0), np.zeros((CHUNK_SIZE, CHUNK_SIZE), dtype=np.int8)).copy()
+    chunks[(0, 0)][3, 3] = settings.LEVER
+    saved = map_format.MapFile(path)
+    try:
+        for key, chunk in chunks.items():
+            assert np.array_equal(grid.chunk_array(key), chunk)
+            if key != (0, 0):
+                assert np.array_equal(saved.read_chunk(key), chunk)
+        assert saved.read_chunk((0, 0))[3, 3] == settings.LEVER
+    finally:
+        saved.close()
+        grid.clear()
@@ -0,0 +1,203 @@
+from collections import deque
+import numpy as np
+import pytest
+import settings
+import history
+import tools
+from chunks import ChunkedGrid, GridStore
+from history import edit_history
+
+EMPTY = settings.EMPTY
+WALL = settings.WALL
+ENTRANCE = settings.ENTRANCE
+
+@pytest.fixture
+def grid(monkeypatch):
+    grid = GridStore(settings.CHUNK_SIZE)
+    monkeypatch.setattr(tools, "grid", grid)
+    return grid
+
+def bfs_fill(cells, seed, limit):
+    """Flood fill a dict of (x, y) -> tile id one cell at a time, or None past limit cells"""
+    target = cells.get(seed, EMPTY)
+    filled = {seed}
+    queue = deque([seed])
+    while queue:
+        x, y = queue.popleft()
+        for neighbour in ((x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1)):
+            if neighbour not in filled and cells.get(neighbour, EMPTY) == target:
+                filled.add(neighbour)
+                if len(filled) > limit:
+                    return None
+                queue.append(neighbour)
+    return filled
+
+def walled_room(rng, grid, left, top, width, height, density):
+    """Write a room with a wall border and random walls inside, returning its cells as a dict"""
+    room = np.where(rng.random((height, width)) < density, WALL, EMPTY).astype(np.int8)
+    room[0, :] = room[-1, :] = room[:, 0] = room[:, -1] = WALL
+    grid.write_region(left, top, room)
+    ys, xs = np.nonzero(room)
+    return dict(zip(zip((xs + left).tolist(), (ys + top).tolist()), room[ys, xs].tolist()))
+
+def filled_set(cells):
+    xs, ys = cells
+    assert len(set(zip(xs.tolist(), ys.tolist()))) == len(xs)  # No cell listed twice
+    return set(zip(xs.tolist(), ys.tolist()))
+
+@pytest.mark.parametrize("left, top", [(0, 0), (-1000, 500), (2**30, -2**30)])
+def test_fill_matches_a_naive_fill(grid, left, top):
+    rng = np.random.default_rng(abs(left) % 97)
+    # Larger than the first 65x65 window around the seed, so the window has to grow
+    cells = walled_room(rng, grid, left, top, 300, 140, 0.35)
+    for _ in range(10):
+        seed = (left + int(rng.integers(1, 299)), top + int(rng.integers(1, 139)))
+        expected = bfs_fill(cells, seed, settings.FILL_MAX_CELLS)
+        assert filled_set(tools.flood_fill(*seed, settings.FILL_MAX_CELLS)) == expected
+
+def test_fill_of_a_winding_corridor(grid):
+    # A zigzag corridor running far from the seed in both directions
+    rng = np.random.default_rng(1)
+    cells = walled_room(rng, grid, -200, -60, 401, 121, 0)
+    for x in range(-190, 200, 10):
+        gap = -55 if x % 20 else 55
+        xs = np.full(121, x)
+        ys = np.arange(-60, 61)
+        keep = ys != gap
+        grid.write_cells(xs[keep], ys[keep], WALL)
+        cells.update({(x, y): WALL for y in ys[keep].tolist()})
+    expected = bfs_fill(cells, (5, 0), settings.FILL_MAX_CELLS)
+    assert len(expected) > 40_000
+    assert filled_set(tools.flood_fill(5, 0, settings.FILL_MAX_CELLS)) == expected
+
+def test_fill_stops_past_the_limit(grid):
+    rng = np.random.default_rng(2)
+    cells = walled_room(rng, grid, -40, -30, 120, 90, 0.05)
+    grid.write_cells([0], [0], [EMPTY])
+    cells.pop((0, 0), None)
+    area = len(bfs_fill(cells, (0, 0), settings.FILL_MAX_CELLS))
+    assert area > 5000
+    assert filled_set(tools.flood_fill(0, 0, area)) == bfs_fill(cells, (0, 0), area)
+    assert tools.flood_fill(0, 0, area - 1) is None
+
+    # Open space never ends
+    assert tools.flood_fill(1000, 1000, settings.FILL_MAX_CELLS) is None
+
+def test_scanline_fill_matches_a_naive_fill():
+    rng = np.random.default_rng(3)
+    for _ in range(200):
+        height, width = rng.integers(1, 30, 2)
+        fillable = rng.random((height, width)) < rng.random()
+        seed_y, seed_x = int(rng.integers(height)), int(rng.integers(width))
+        fillable[seed_y, seed_x] = True
+        # Everything outside the array counts as not fillable
+        cells = {(x, y): 1 for y, x in zip(*np.nonzero(fillable))}
+        expected = bfs_fill({**cells, **{(x, y): 0 for x in range(-1, width + 1) for y in (-1, height)},
+                             **{(x, y): 0 for y in range(height) for x in (-1, width)}}, (seed_x, seed_y), width * height)
+        assert filled_set(tools.scanline_fill(fillable, seed_x, seed_y, width * height)) == expected
+        if len(expected) > 1:
+            assert tools.scanline_fill(fillable, seed_x, seed_y, len(expected) - 1) is None
+
+@pytest.fixture
+def map_state(monkeypatch):
+    """A fresh grid with the entrance and empty notes for the tools and history, returning (grid, notes)"""
+    grid = GridStore(settings.CHUNK_SIZE)
+    grid.write_cells([0], [0], [ENTRANCE])
+    notes = ChunkedGrid(settings.CHUNK_SIZE)
+    for module in (tools, history):
+        monkeypatch.setattr(module, "grid", grid)
+        monkeypatch.setattr(module, "notes", notes)
+    edit_history.clear()
+    yield grid, notes
+    edit_history.clear()
+
+AREA = (-30, -30, 30, 30)  # Every cell the tests below can touch, as min x, min y, max x, max y
+
+def grid_dict(grid):
+    """The non-empty cells of the test area as a dict of (x, y) -> tile id"""
+    tiles = grid.read_region(AREA[0], AREA[1], AREA[2] - AREA[0] + 1, AREA[3] - AREA[1] + 1)
+    ys, xs = np.nonzero(tiles)
+    return dict(zip(zip((xs + AREA[0]).tolist(), (ys + AREA[1]).tolist()), tiles[ys, xs].tolist()))
+
+def rect_cells(min_x, min_y, max_x, max_y):
+    return [(x, y) for y in range(min_y, max_y + 1) for x in range(min_x, max_x + 1)]
+
+def dict_copy(cells, notes, min_x, min_y, max_x, max_y):
+    """Copy a rectangle of dicts, leaving out the entrance"""
+    tiles = {(x - min_x, y - min_y): cells[(x, y)] for x, y in rect_cells(min_x, min_y, max_x, max_y)
+             if cells.get((x, y), EMPTY) not in (EMPTY, ENTRANCE)}
+    region_notes = {(x - min_x, y - min_y): notes[(x, y)] for x, y in rect_cells(min_x, min_y, max_x, max_y)
+                    if (x, y) in notes}
+    return tiles, region_notes, max_x - min_x + 1, max_y - min_y + 1
+
+def dict_paste(cells, notes, buffer, min_x, min_y):
+    """Replace a rectangle of dicts with a copied buffer, keeping the entrance at (0,0)"""
+    tiles, region_notes, width, height = buffer
+    for x, y in rect_cells(min_x, min_y, min_x + width - 1, min_y + height - 1):
+        if (x, y) != (0, 0):
+            cells.pop((x, y), None)
+            if (x - min_x, y - min_y) in tiles:
+                cells[(x, y)] = tiles[(x - min_x, y - min_y)]
+        notes.pop((x, y), None)
+        if (x - min_x, y - min_y) in region_notes:
+            notes[(x, y)] = region_notes[(x - min_x, y - min_y)]
+
+def random_map(rng, grid):
+    """Fill the middle of the test area with random tiles and notes, returning them as dicts"""
+    xs = rng.integers(-12, 12, 300)
+    ys = rng.integers(-12, 12, 300)
+    keep = (xs != 0) | (ys != 0)
+    tools.set_cells(xs[keep], ys[keep], WALL)
+    tools.set_cells(xs[::4][keep[::4]], ys[::4][keep[::4]], settings.FLOOR)
+    for i in range(10):
+        tools.set_note((int(rng.integers(-12, 12)), int(rng.integers(-12, 12))), f"note {i}")
+    return grid_dict(grid), {pos: text for pos, text in history.notes.items()}
+
+def random_rect(rng):
+    min_x, min_y = rng.integers(-12, 8, 2).tolist()
+    width, height = rng.integers(1, 10, 2).tolist()
+    return min_x, min_y, min_x + width - 1, min_y + height - 1
+
+def test_move_matches_a_dict_move(map_state):
+    grid, notes = map_state
+    rng = np.random.default_rng(13)
+    cells, note_dict = random_map(rng, grid)
+    for _ in range(60):
+        rect = random_rect(rng)
+        dx, dy = rng.integers(-6, 7, 2).tolist()
+        buffer = dict_copy(cells, note_dict, *rect)
+        for x, y in rect_cells(*rect):
+            if (x, y) != (0, 0):
+                cells.pop((x, y), None)
+            note_dict.pop((x, y), None)
+        dict_paste(cells, note_dict, buffer, rect[0] + dx, rect[1] + dy)
+
+        tools.move_region(*rect, dx, dy)
+        assert grid_dict(grid) == cells
+        assert dict(notes.items()) == note_dict
+        assert grid.get((0, 0), EMPTY) == ENTRANCE
+
+def test_paste_matches_a_dict_paste(map_state):
+    grid, notes = map_state
+    rng = np.random.default_rng(14)
+    cells, note_dict = random_map(rng, grid)
+    for _ in range(60):
+        rect = random_rect(rng)
+        min_x, min_y = rng.integers(-12, 8, 2).tolist()
+        dict_paste(cells, note_dict, dict_copy(cells, note_dict, *rect), min_x, min_y)
+
+        tools.paste_region(tools.copy_region(*rect), min_x, min_y)
+        assert grid_dict(grid) == cells
+        assert dict(notes.items()) == note_dict
+        assert grid.get((0, 0), EMPTY) == ENTRANCE
+
+def test_undo_a_move_over_the_entrance(map_state):
+    grid, notes = map_state
+    cells, note_dict = random_map(np.random.default_rng(15), grid)
+    tools.move_region(-5, -5, 5, 5, 3, 1)
+    tools.clear_region(-3, -3, 3, 3)
+    assert grid.get((0, 0), EMPTY) == ENTRANCE
+    edit_history.undo()
+    edit_history.undo()
+    assert grid_dict(grid) == cells
+    assert dict(notes.items()) == note_dict
@@ -1,7 +1,63 @@
-import os
 import pygame
 import math
+import threading
+from collections import OrderedDict
 from settings import *
+from atlas import load_atlas
+
+# Scaled tile images shared by every zoom level, keyed by (tile id, pixel size)
+scaled_image_cache = OrderedDict()
+scaled_image_cache_lock = threading.Lock()  # The cache is also filled by the warm-up thread
+
+def get_scaled_image(tile, size):
+    """Return the tile image scaled to size x size, scaling it only on a cache miss"""
+    key = (tile.id, size)
+    with scaled_image_cache_lock:
+        image = scaled_image_cache.get(key)
+        if image is not None:
+            scaled_image_cache.move_to_end(key)
+            return image
+    
+    image = pygame.transform.scale(tile.original_image, (size, size))
+    
+    with scaled_image_cache_lock:
+        scaled_image_cache[key] = image
+        # Drop the least recently used images once the cache is full
+        while len(scaled_image_cache) > SCALED_IMAGE_CACHE_SIZE:
+            scaled_image_cache.popitem(last=False)
+    return image
+
+def reachable_zoom_levels():
+    """Return every zoom level the mouse wheel can reach from the default zoom"""
+    # Use the same stepping as handle_mousewheel so the float values match
+    levels = {1.0}
+    pending = [1.0]
+    while pending and len(levels) < 1000:
+        zoom = pending.pop()
+        for new_zoom in (step_zoom(zoom, True), step_zoom(zoom, False)):
+            if new_zoom not in levels:
+                levels.add(new_zoom)
+                pending.append(new_zoom)
+    return sorted(levels)
+
+def warm_scaled_image_cache(tiles):
+    """Scale every tile image for every reachable zoom level in a background thread"""
+    def warm():
+        sizes = set()
+        for zoom in reachable_zoom_levels():
+            if zoom <= LOD_ZOOM_THRESHOLD:
+                continue  # Far zoom levels draw colours, not images
+            tile_size = int(BASE_TILE_SIZE * zoom) + 1
+            # Chunk surfaces draw tiles one pixel larger to hide chunk seams
+            sizes.update((tile_size, tile_size + 1))
+        for size in sorted(sizes):
+            for tile in list(tiles.values()):
+                if tile.original_image:
+                    get_scaled_image(tile, size)
+    
+    thread = threading.Thread(target=warm, name="scaled-image-warmup", daemon=True)
+    thread.start()
+    return thread
 
 class Tile:
     def __init__(self, id, name, img_path, color, hotkey=None, is_palette_tile=True):
@@ -14,10 +70,12 @@ class Tile:
         self.is_palette_tile = is_palette_tile  # Whether this tile appears in the palette
         self.is_note = id == NOTE  # Is this a note tile?
         self.note_overlay_img = None  # For storing the 'N' overlay image
-        
-        # Load the image if it exists, otherwise use the color
-        if os.path.exists(img_path):
-            self.original_image = pygame.image.load(img_path).convert_alpha()
+        self.img_path = img_path
+    
+    def set_atlas(self, atlas):
+        """Take the tile's image from the atlas if it has one, otherwise the color is used"""
+        self.original_image = atlas.image(self.img_path)
+        if self.original_image:
             self.update_scaled_images()
         
     def update_scaled_images(self):
@@ -29,10 +87,7 @@ class Tile:
             
             # Add 1 to dimensions to prevent gaps between tiles
             current_tile_size = int(settings.BASE_TILE_SIZE * current_zoom) + 1
-            self.scaled_image = pygame.transform.scale(
-                self.original_image, 
-                (current_tile_size, current_tile_size)
-            )
+            self.scaled_image = get_scaled_image(self, current_tile_size)
 
 # Define tile types
 def load_tiles():
@@ -54,6 +109,8 @@ def load_tiles():
         POISON_POOL: Tile(POISON_POOL, "Poison Pool", "tiles/poison_pool.png", (0, 255, 0), "p"),  # Green
         NOTE: Tile(NOTE, "Note", "tiles/note.png", BLUE, "n"),  # Blue note tile
         PIPETTE: Tile(PIPETTE, "Pipette", "tiles/pipette.png", (255, 0, 255), "q"),  # Magenta pipette tool
+        FILL: Tile(FILL, "Fill", "tiles/fill.png", (255, 0, 255), "f"),  # Magenta fill tool
+        SELECT: Tile(SELECT, "Select", "tiles/select.png", (255, 0, 255), "r"),  # Magenta selection tool
         CRONE: Tile(CRONE, "Crone", "tiles/crone.png", (153, 51, 153), "4"),  # Purple-ish for crone 
         DOOR: Tile(DOOR, "Door", "tiles/door.png", (139, 69, 19), "e"),  # Similar to brown for door
         THRONE: Tile(THRONE, "Throne", "tiles/throne.png", (128, 0, 128), "l"),  # Purple for throne
@@ -61,6 +118,12 @@ def load_tiles():
         EXIT: Tile(EXIT, "Exit", "tiles/exit.png", (0, 100, 0), "PERIOD"),  # Dark green for exit
         ENTRANCE: Tile(ENTRANCE, "Entrance", "tiles/entrance.png", RED, is_palette_tile=False),
     }
+    
+    # Every tile image comes out of one cached sheet, decoded once instead of a file per tile -
+    # only loading uses the sheet, each tile is still scaled on its own by get_scaled_image
+    atlas = load_atlas([tile.img_path for tile in tiles.values()])
+    for tile in tiles.values():
+        tile.set_atlas(atlas)
     return tiles
 
 # Grid to Cell function
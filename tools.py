@@ -0,0 +1,215 @@
+from bisect import bisect_right
+import numpy as np
+from settings import *
+from history import edit_history, set_note_text
+
+def line_cells(x0, y0, x1, y1):
+    """Return the cells on the line from (x0, y0) to (x1, y1), both ends included (Bresenham)"""
+    cells = []
+    dx = abs(x1 - x0)
+    dy = -abs(y1 - y0)
+    step_x = 1 if x0 < x1 else -1
+    step_y = 1 if y0 < y1 else -1
+    error = dx + dy
+
+    while True:
+        cells.append((x0, y0))
+        if x0 == x1 and y0 == y1:
+            return cells
+        double_error = 2 * error
+        if double_error >= dy:
+            error += dy
+            x0 += step_x
+        if double_error <= dx:
+            error += dx
+            y0 += step_y
+
+def set_cells(xs, ys, tile_id):
+    """Set the cells in the xs, ys arrays to tile_id with one bulk grid write.
+
+    The entrance at (0,0) is never modified. Returns False if the cells
+    included the entrance, so the caller can tell the user.
+    """
+    entrance = (xs == 0) & (ys == 0)
+    entrance_hit = bool(entrance.any())
+    if entrance_hit:
+        xs = xs[~entrance]
+        ys = ys[~entrance]
+
+    if len(xs):
+        old_values = grid.write_cells(xs, ys, tile_id)
+        edit_history.record_cells(xs, ys, old_values, tile_id)
+    return not entrance_hit
+
+def paint_cells(cells, tile_id):
+    """Set every (x, y) cell in the list to tile_id, see set_cells"""
+    # Drop repeated cells but keep the stroke order
+    positions = np.array(list(dict.fromkeys(cells)), dtype=np.int64).reshape(-1, 2)
+    return set_cells(positions[:, 0], positions[:, 1], tile_id)
+
+def scanline_fill(fillable, seed_x, seed_y, limit):
+    """Flood fill a boolean [y, x] array from the seed, one horizontal span at a time.
+
+    Every span is a whole run of fillable cells in a row, so the runs of all
+    rows are found up front with NumPy and the fill walks from run to run.
+    Returns (xs, ys) arrays of the filled cells, or None as soon as more than
+    limit cells would be filled.
+    """
+    height, width = fillable.shape
+    
+    # Find the start and (exclusive) end of every run, in row-major order
+    padded = np.zeros((height, width + 2), dtype=np.int8)
+    padded[:, 1:-1] = fillable
+    edges = np.diff(padded, axis=1)
+    run_rows, run_starts = np.nonzero(edges == 1)
+    run_ends = np.nonzero(edges == -1)[1]
+    row_offsets = np.searchsorted(run_rows, np.arange(height + 1)).tolist()
+    starts = run_starts.tolist()
+    ends = run_ends.tolist()
+    
+    # Start from the run containing the seed
+    first = bisect_right(starts, seed_x, row_offsets[seed_y], row_offsets[seed_y + 1]) - 1
+    visited = bytearray(len(starts))
+    visited[first] = 1
+    stack = [(first, seed_y)]
+    count = 0
+    
+    while stack:
+        run, y = stack.pop()
+        span_left = starts[run]
+        span_right = ends[run]
+        count += span_right - span_left
+        if count > limit:
+            return None
+        
+        # Queue every unvisited run just above and below that overlaps the span
+        for next_y in (y - 1, y + 1):
+            if 0 <= next_y < height:
+                row_end = row_offsets[next_y + 1]
+                next_run = max(row_offsets[next_y], bisect_right(starts, span_left, row_offsets[next_y], row_end) - 1)
+                while next_run < row_end and starts[next_run] < span_right:
+                    if ends[next_run] > span_left and not visited[next_run]:
+                        visited[next_run] = 1
+                        stack.append((next_run, next_y))
+                    next_run += 1
+    
+    # Expand the visited runs back into cells
+    runs = np.flatnonzero(np.frombuffer(visited, dtype=np.uint8))
+    lengths = run_ends[runs] - run_starts[runs]
+    offsets = np.cumsum(lengths) - lengths
+    xs = np.arange(count) - np.repeat(offsets - run_starts[runs], lengths)
+    ys = np.repeat(run_rows[runs], lengths)
+    return xs, ys
+
+def flood_fill(seed_x, seed_y, limit):
+    """Return (xs, ys) arrays of the cells connected to the seed that hold the same tile id.
+
+    Returns None if the area has more than limit cells, so filling open space
+    on the infinite grid stops instead of running away.
+    """
+    target = grid.get((seed_x, seed_y), EMPTY)
+    
+    # Fill inside a window around the seed, growing it toward every side the fill reaches
+    left = right = up = down = 32  # Distance from the seed to each window edge
+    while True:
+        width = left + right + 1
+        height = up + down + 1
+        if width * height > limit * 16:
+            return None  # A winding area that would need a huge window
+        
+        min_x = seed_x - left
+        min_y = seed_y - up
+        region = grid.read_region(min_x, min_y, width, height)
+        cells = scanline_fill(region == target, left, up, limit)
+        if cells is None:
+            return None
+        
+        xs, ys = cells
+        grown = False
+        if xs.min() == 0:
+            left *= 2
+            grown = True
+        if xs.max() == width - 1:
+            right *= 2
+            grown = True
+        if ys.min() == 0:
+            up *= 2
+            grown = True
+        if ys.max() == height - 1:
+            down *= 2
+            grown = True
+        if not grown:
+            return xs + min_x, ys + min_y
+
+class RegionBuffer:
+    """Tiles and notes copied out of a rectangle of the map, relative to its top-left cell"""
+
+    def __init__(self, tiles, notes):
+        self.tiles = tiles  # int8 array [y, x] of tile ids
+        self.notes = notes  # (dx, dy) -> note text
+
+    @property
+    def width(self):
+        return self.tiles.shape[1]
+
+    @property
+    def height(self):
+        return self.tiles.shape[0]
+
+def notes_in_rect(min_x, min_y, max_x, max_y):
+    """Return the positions of the notes inside the inclusive cell rectangle"""
+    return [pos for pos, _ in notes.items_in_rect(min_x, min_y, max_x, max_y)]
+
+def copy_region(min_x, min_y, max_x, max_y):
+    """Copy the tiles and notes in the inclusive cell rectangle into a RegionBuffer"""
+    tiles = grid.read_region(min_x, min_y, max_x - min_x + 1, max_y - min_y + 1)
+    
+    # The entrance belongs at (0,0) only, so it is never copied
+    tiles[tiles == ENTRANCE] = EMPTY
+    
+    region_notes = {(x - min_x, y - min_y): notes[(x, y)]
+                    for x, y in notes_in_rect(min_x, min_y, max_x, max_y)}
+    return RegionBuffer(tiles, region_notes)
+
+def write_region(min_x, min_y, tiles):
+    """Write an array of tiles into the grid at (min_x, min_y) with one bulk write, keeping the entrance"""
+    height, width = tiles.shape
+    if min_x <= 0 < min_x + width and min_y <= 0 < min_y + height:
+        tiles = tiles.copy()
+        tiles[-min_y, -min_x] = ENTRANCE
+    old_tiles = grid.write_region(min_x, min_y, tiles)
+    
+    # Record only the cells that changed, as coordinate arrays
+    ys, xs = np.nonzero(old_tiles != tiles)
+    edit_history.record_cells(xs + min_x, ys + min_y, old_tiles[ys, xs], tiles[ys, xs])
+
+def clear_region(min_x, min_y, max_x, max_y):
+    """Erase the tiles and notes in the inclusive cell rectangle"""
+    with edit_history.group("Delete"):
+        write_region(min_x, min_y, np.zeros((max_y - min_y + 1, max_x - min_x + 1), dtype=np.int8))
+        for pos in notes_in_rect(min_x, min_y, max_x, max_y):
+            set_note(pos, None)
+
+def paste_region(buffer, min_x, min_y):
+    """Replace the rectangle starting at (min_x, min_y) with the buffer's tiles and notes"""
+    with edit_history.group("Paste"):
+        write_region(min_x, min_y, buffer.tiles)
+        for pos in notes_in_rect(min_x, min_y, min_x + buffer.width - 1, min_y + buffer.height - 1):
+            if (pos[0] - min_x, pos[1] - min_y) not in buffer.notes:
+                set_note(pos, None)
+        for (dx, dy), note_text in buffer.notes.items():
+            set_note((min_x + dx, min_y + dy), note_text)
+
+def move_region(min_x, min_y, max_x, max_y, dx, dy):
+    """Move the tiles and notes in the inclusive cell rectangle by (dx, dy)"""
+    buffer = copy_region(min_x, min_y, max_x, max_y)
+    with edit_history.group("Move"):
+        clear_region(min_x, min_y, max_x, max_y)
+        paste_region(buffer, min_x + dx, min_y + dy)
+
+def set_note(pos, note_text):
+    """Add, change or (with None) delete the note at pos, recording it for undo"""
+    old_text = notes.get(pos)
+    set_note_text(pos, note_text)
+    with edit_history.group("Note"):
+        edit_history.record_note(pos, old_text, note_text)
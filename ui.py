@@ -2,7 +2,13 @@ import pygame
 import math
 import settings
 from settings import *
-from tiles import grid_to_cell, grid_to_screen, screen_to_grid
+from tiles import grid_to_cell, grid_to_screen, screen_to_grid, get_scaled_image
+from fonts import render_text
+
+# Palette panel rendered without the selection highlight, and what it was rendered for
+palette_panel = None
+palette_panel_key = None
+palette_tile_rects = {}  # tile id -> screen rect of its selection outline
 
 class Button:
     def __init__(self, x, y, width, height, text, color, hover_color, text_color, action):
@@ -30,14 +36,13 @@ class Button:
         pygame.draw.rect(surface, BLACK, self.rect, 2)
         
         # Render button text
-        font = pygame.font.SysFont(None, 24)
-        text_surface = font.render(self.text, True, self.text_color)
+        text_surface = render_text(self.text, 24, self.text_color)
         text_rect = text_surface.get_rect(center=self.rect.center)
         surface.blit(text_surface, text_rect)
         
         # Render hotkey text if present
         if self.hotkey_text:
-            hotkey_surface = font.render(self.hotkey_text, True, DARK_GRAY)
+            hotkey_surface = render_text(self.hotkey_text, 24, DARK_GRAY)
             hotkey_rect = hotkey_surface.get_rect(midleft=(self.rect.right + 5, self.rect.centery))
             surface.blit(hotkey_surface, hotkey_rect)
     
@@ -61,15 +66,14 @@ def draw_coordinates(surface, mouse_pos):
     # Import settings to get current zoom level
     import settings
     
-    font = pygame.font.SysFont(None, 24)
     text = f"Grid: ({cell_x}, {cell_y})"
     zoom_text = f"Zoom: {settings.zoom_level:.2f}x"
     
-    text_surface = font.render(text, True, WHITE)
-    zoom_surface = font.render(zoom_text, True, WHITE)
+    text_surface = render_text(text, 24, WHITE)
+    zoom_surface = render_text(zoom_text, 24, WHITE)
     
-    text_outline = font.render(text, True, BLACK)
-    zoom_outline = font.render(zoom_text, True, BLACK)
+    text_outline = render_text(text, 24, BLACK)
+    zoom_outline = render_text(zoom_text, 24, BLACK)
     
     # Draw text with outline for visibility
     for dx, dy in [(-1, -1), (-1, 1), (1, -1), (1, 1)]:
@@ -85,8 +89,7 @@ def draw_status_message(surface):
     import settings
     
     if settings.status_message and settings.status_message_timer > 0:
-        font = pygame.font.SysFont(None, 24)
-        text_surface = font.render(settings.status_message, True, WHITE)
+        text_surface = render_text(settings.status_message, 24, WHITE)
         text_rect = text_surface.get_rect(bottomleft=(10, WINDOW_HEIGHT - 10))
         
         # Draw background for better visibility
@@ -96,16 +99,18 @@ def draw_status_message(surface):
         
         surface.blit(text_surface, text_rect)
 
-def draw_palette(surface, tiles, selected_tile_id):
-    """Draw the tile palette on the right side of the screen with a scrollbar"""
+def render_palette(palette_tiles):
+    """Render the palette panel, without the selection highlight, into an off-screen surface.
+
+    Returns the surface and a dict of tile id -> screen rect of its selection outline.
+    """
     # Draw palette background
-    palette_rect = pygame.Rect(GRID_WIDTH, 0, PALETTE_WIDTH, PALETTE_HEIGHT)
-    pygame.draw.rect(surface, DARK_GRAY, palette_rect)
+    panel = pygame.Surface((PALETTE_WIDTH, PALETTE_HEIGHT))
+    panel.fill(DARK_GRAY)
     
     # Draw palette title
-    font = pygame.font.SysFont(None, 28)
-    title_text = font.render("Palette", True, WHITE)
-    surface.blit(title_text, (GRID_WIDTH + 10, 20))
+    title_text = render_text("Palette", 28, WHITE)
+    panel.blit(title_text, (10, 20))
     
     # Calculate tile preview size and spacing
     PREVIEW_SIZE = min(45, (PALETTE_WIDTH - 60) // 3)  # Slightly larger previews
@@ -113,9 +118,6 @@ def draw_palette(surface, tiles, selected_tile_id):
     VERTICAL_SPACING = 15  # Increased space between rows
     ITEM_HEIGHT = PREVIEW_SIZE + 35  # Height of each tile including name and hotkey
     
-    # Get list of palette tiles
-    palette_tiles = [(id, tile) for id, tile in tiles.items() if tile.is_palette_tile]
-    
     # Calculate total rows needed
     TILES_PER_ROW = 3
     total_rows = (len(palette_tiles) + TILES_PER_ROW - 1) // TILES_PER_ROW
@@ -132,9 +134,7 @@ def draw_palette(surface, tiles, selected_tile_id):
     SCROLLBAR_WIDTH = 15
     scrollbar_height = min(visible_height, (visible_height * rows_visible) / total_rows)
     
-    # Get/update scroll position (store in settings)
-    if not hasattr(settings, 'palette_scroll'):
-        settings.palette_scroll = 0
+    # Clamp scroll position (stored in settings)
     settings.palette_scroll = min(settings.max_palette_scroll, settings.palette_scroll)
     
     # Draw tiles
@@ -142,55 +142,52 @@ def draw_palette(surface, tiles, selected_tile_id):
     start_idx = start_row * TILES_PER_ROW
     visible_tiles = palette_tiles[start_idx:start_idx + (rows_visible * TILES_PER_ROW)]
     
+    tile_rects = {}
     for idx, (tile_id, tile) in enumerate(visible_tiles):
         row = idx // TILES_PER_ROW
         col = idx % TILES_PER_ROW
         
-        # Calculate position
-        x = GRID_WIDTH + HORIZONTAL_SPACING + (col * (PREVIEW_SIZE + HORIZONTAL_SPACING))
+        # Calculate position inside the panel
+        x = HORIZONTAL_SPACING + (col * (PREVIEW_SIZE + HORIZONTAL_SPACING))
         y = TITLE_HEIGHT + (row * ITEM_HEIGHT)
         
-        # Draw selection outline
+        # Draw unselected outline, the selection highlight is drawn over it every frame
         select_rect = pygame.Rect(x - 2, y - 2, PREVIEW_SIZE + 4, PREVIEW_SIZE + 4)
-        if tile_id == selected_tile_id:
-            pygame.draw.rect(surface, GREEN, select_rect, 2)
-        else:
-            pygame.draw.rect(surface, WHITE, select_rect, 1)
+        pygame.draw.rect(panel, WHITE, select_rect, 1)
+        tile_rects[tile_id] = select_rect.move(GRID_WIDTH, 0)
         
         # Draw tile
         if tile.original_image:
-            tile_img = pygame.transform.scale(tile.original_image, (PREVIEW_SIZE, PREVIEW_SIZE))
-            surface.blit(tile_img, (x, y))
+            panel.blit(get_scaled_image(tile, PREVIEW_SIZE), (x, y))
         else:
             tile_rect = pygame.Rect(x, y, PREVIEW_SIZE, PREVIEW_SIZE)
-            pygame.draw.rect(surface, tile.color, tile_rect)
-            pygame.draw.rect(surface, BLACK, tile_rect, 1)
+            pygame.draw.rect(panel, tile.color, tile_rect)
+            pygame.draw.rect(panel, BLACK, tile_rect, 1)
         
         # Draw name
-        name_font = pygame.font.SysFont(None, 20)
-        name_text = name_font.render(tile.name, True, WHITE)
+        name_text = render_text(tile.name, 20, WHITE)
         name_x = x + (PREVIEW_SIZE - name_text.get_width()) // 2
-        surface.blit(name_text, (name_x, y + PREVIEW_SIZE + 2))
+        panel.blit(name_text, (name_x, y + PREVIEW_SIZE + 2))
         
         # Draw hotkey if available
         if tile.hotkey:
             hotkey_text = f"({tile.hotkey})"
-            hotkey_surface = name_font.render(hotkey_text, True, LIGHT_BLUE)
+            hotkey_surface = render_text(hotkey_text, 20, LIGHT_BLUE)
             hotkey_x = x + (PREVIEW_SIZE - hotkey_surface.get_width()) // 2
-            surface.blit(hotkey_surface, (hotkey_x, y + PREVIEW_SIZE + 2 + name_text.get_height()))
+            panel.blit(hotkey_surface, (hotkey_x, y + PREVIEW_SIZE + 2 + name_text.get_height()))
     
     # Draw scrollbar if needed
     if settings.max_palette_scroll > 0:
-        scrollbar_x = GRID_WIDTH + PALETTE_WIDTH - SCROLLBAR_WIDTH - 5
+        scrollbar_x = PALETTE_WIDTH - SCROLLBAR_WIDTH - 5
         scrollbar_bg = pygame.Rect(scrollbar_x, TITLE_HEIGHT, SCROLLBAR_WIDTH, visible_height)
-        pygame.draw.rect(surface, GRAY, scrollbar_bg)
+        pygame.draw.rect(panel, GRAY, scrollbar_bg)
         
         scroll_pos = TITLE_HEIGHT + (visible_height - scrollbar_height) * (settings.palette_scroll / settings.max_palette_scroll)
         scrollbar = pygame.Rect(scrollbar_x, scroll_pos, SCROLLBAR_WIDTH, scrollbar_height)
-        pygame.draw.rect(surface, WHITE, scrollbar)
+        pygame.draw.rect(panel, WHITE, scrollbar)
         
-        # Store scrollbar rect for hit testing
-        settings.scrollbar_rect = scrollbar
+        # Store scrollbar rect (in screen coordinates) for hit testing
+        settings.scrollbar_rect = scrollbar.move(GRID_WIDTH, 0)
     else:
         settings.scrollbar_rect = None
     
@@ -203,6 +200,33 @@ def draw_palette(surface, tiles, selected_tile_id):
         'tiles_per_row': TILES_PER_ROW
     }
     
+    return panel, tile_rects
+
+def draw_palette(surface, tiles, selected_tile_id):
+    """Draw the tile palette on the right side of the screen with a scrollbar"""
+    global palette_panel, palette_panel_key, palette_tile_rects
+    palette_rect = pygame.Rect(GRID_WIDTH, 0, PALETTE_WIDTH, PALETTE_HEIGHT)
+    
+    # Get list of palette tiles
+    palette_tiles = [(id, tile) for id, tile in tiles.items() if tile.is_palette_tile]
+    
+    # Get scroll position (store in settings)
+    if not hasattr(settings, 'palette_scroll'):
+        settings.palette_scroll = 0
+    
+    # Re-render the panel only when the scroll position or the tile set changed
+    tile_set = tuple((id, tile.name, tile.hotkey, tile.original_image) for id, tile in palette_tiles)
+    if palette_panel_key != (settings.palette_scroll, tile_set):
+        palette_panel, palette_tile_rects = render_palette(palette_tiles)
+        palette_panel_key = (settings.palette_scroll, tile_set)
+    
+    surface.blit(palette_panel, palette_rect)
+    
+    # Draw selection outline over the cached panel
+    select_rect = palette_tile_rects.get(selected_tile_id)
+    if select_rect is not None:
+        pygame.draw.rect(surface, GREEN, select_rect, 2)
+    
     return palette_rect
 
 def handle_palette_scroll(event):